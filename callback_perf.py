@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+callback_perf.py - Timing hooks for the GladeVCP handler callbacks
+
+PerfMonitor.instrument() replaces the handler's signal handlers (on_*) and
+periodic callbacks (_poll*, _publish*, load_variables) on the instance with
+wrappers that time every call with perf_counter and keep count, mean, max
+and the last WINDOW durations for the p99. It has to run at the top of
+HandlerClass.__init__, before the methods are connected or handed to
+GLib.timeout_add.
+
+A STALL_PERIOD ms GLib timer measures how late the main loop runs it; a
+delay over STALL_LIMIT ms counts as a stall and remembers the slowest
+callback of that interval. Everything is published once a second as pins:
+
+    gladevcp.perf.<callback>.count / .mean-ms / .p99-ms / .max-ms
+        (<callback> is cut to HAL_NAME_LEN and ends in ~<index> when it was too long)
+    gladevcp.perf.lag-ms (last), gladevcp.perf.lag-max-ms,
+    gladevcp.perf.stalls, gladevcp.perf.stall-culprit (index in pin name order, -1 none)
+
+Usage:
+    python3 callback_perf.py dump          (table of the gladevcp.perf pins via halcmd)
+"""
+
+import sys
+import time
+import subprocess
+from collections import deque
+
+WINDOW = 1024          # durations kept per callback for the p99
+STALL_PERIOD = 50      # ms
+STALL_LIMIT = 200      # ms late before the main loop counts as stalled
+PUBLISH_PERIOD = 1000  # ms
+HAL_NAME_LEN = 47     # including the "gladevcp." prefix
+LONGEST_FIELD = ".mean-ms"
+PREFIXES = ("on_", "_poll", "_publish")
+EXTRA = ("load_variables",)
+
+
+class CallbackStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.recent.append(seconds)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def p99(self):
+        if not self.recent:
+            return 0.0
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, int(0.99 * len(values)))]
+
+
+def pin_name(name):
+    return name.lstrip("_")
+
+
+def pin_bases(names, component="gladevcp"):
+    """{callback: pin base} with every pin name inside HAL_NAME_LEN"""
+    limit = HAL_NAME_LEN - len(component) - 1 - len(LONGEST_FIELD)
+    bases = {}
+    for index, name in enumerate(names):
+        base = f"perf.{pin_name(name)}"
+        if len(base) > limit:
+            suffix = f"~{index}"
+            base = base[:limit - len(suffix)] + suffix
+        bases[name] = base
+    return bases
+
+
+class PerfMonitor:
+    def __init__(self, halcomp=None):
+        self.halcomp = halcomp
+        self.stats = {}
+        self.names = []
+        self.bases = {}
+        self.lag = CallbackStats()
+        self.last_lag = 0.0
+        self.stalls = 0
+        self.culprit = -1
+        self.slowest = (0.0, -1)     # slowest callback since the last stall tick
+        self.last_tick = None
+
+    def wrap(self, name, func):
+        stats = self.stats.setdefault(name, CallbackStats())
+        if name not in self.names:
+            self.names.append(name)
+        index = self.names.index(name)
+        clock = time.perf_counter
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = clock() - start
+                stats.add(seconds)
+                if seconds > self.slowest[0]:
+                    self.slowest = (seconds, index)
+        timed.__name__ = getattr(func, "__name__", name)
+        timed.__doc__ = getattr(func, "__doc__", None)
+        return timed
+
+    def instrument(self, handler, prefixes=PREFIXES, extra=EXTRA):
+        """Wrap matching methods of handler in place; returns the wrapped names"""
+        # sorted by pin name, so stall-culprit indexes the callbacks as halcmd lists them
+        targets = []
+        for name in sorted(dir(type(handler)), key=pin_name):
+            if not (name.startswith(prefixes) or name in extra):
+                continue
+            method = getattr(handler, name, None)
+            if callable(method):
+                targets.append((name, method))
+        self.names = [name for name, _ in targets]
+        # pins first: if HAL refuses one, no method has been replaced yet
+        self.make_pins()
+        for name, method in targets:
+            setattr(handler, name, self.wrap(name, method))
+        return list(self.names)
+
+    def make_pins(self):
+        if self.halcomp is None:
+            return
+        import hal
+        try:
+            component = self.halcomp.getprefix()
+        except Exception:
+            component = "gladevcp"
+        self.bases = pin_bases(self.names, component)
+        too_long = [b for b in self.bases.values() if len(f"{component}.{b}{LONGEST_FIELD}") > HAL_NAME_LEN]
+        if too_long:
+            raise ValueError(f"pin names longer than {HAL_NAME_LEN}: {', '.join(too_long)}")
+        for name in self.names:
+            base = self.bases[name]
+            self.halcomp.newpin(f"{base}.count", hal.HAL_S32, hal.HAL_OUT)
+            for field in ("mean-ms", "p99-ms", "max-ms"):
+                self.halcomp.newpin(f"{base}.{field}", hal.HAL_FLOAT, hal.HAL_OUT)
+        self.halcomp.newpin("perf.lag-ms", hal.HAL_FLOAT, hal.HAL_OUT)
+        self.halcomp.newpin("perf.lag-max-ms", hal.HAL_FLOAT, hal.HAL_OUT)
+        self.halcomp.newpin("perf.stalls", hal.HAL_S32, hal.HAL_OUT)
+        self.halcomp.newpin("perf.stall-culprit", hal.HAL_S32, hal.HAL_OUT)
+
+    def start(self):
+        """Stall detector and 1 s publishing, in the GTK main loop"""
+        from gi.repository import GLib
+        self.last_tick = time.perf_counter()
+        GLib.timeout_add(STALL_PERIOD, self._tick)
+        GLib.timeout_add(PUBLISH_PERIOD, self._publish)
+
+    def _tick(self):
+        now = time.perf_counter()
+        late = max(0.0, (now - self.last_tick) * 1000.0 - STALL_PERIOD)
+        self.last_tick = now
+        self.last_lag = late
+        self.lag.add(late / 1000.0)
+        if late > STALL_LIMIT:
+            self.stalls += 1
+            self.culprit = self.slowest[1]
+            culprit = self.names[self.culprit] if self.culprit >= 0 else "unknown"
+            print(f"[callback_perf] Main loop stalled {late:.0f} ms (slowest callback: {culprit})")
+        self.slowest = (0.0, -1)
+        return True
+
+    def _publish(self):
+        if self.halcomp is None:
+            return True
+        try:
+            for name in self.names:
+                stats = self.stats[name]
+                base = self.bases[name]
+                self.halcomp[f"{base}.count"] = stats.count
+                self.halcomp[f"{base}.mean-ms"] = stats.mean() * 1000.0
+                self.halcomp[f"{base}.p99-ms"] = stats.p99() * 1000.0
+                self.halcomp[f"{base}.max-ms"] = stats.max * 1000.0
+            self.halcomp["perf.lag-ms"] = self.last_lag
+            self.halcomp["perf.lag-max-ms"] = self.lag.max * 1000.0
+            self.halcomp["perf.stalls"] = self.stalls
+            self.halcomp["perf.stall-culprit"] = self.culprit
+        except Exception as e:
+            print(f"[callback_perf] Publish error: {e}")
+        return True
+
+
+def dump(component="gladevcp"):
+    """Read the perf pins of a running panel with halcmd"""
+    output = subprocess.run(["halcmd", "-s", "show", "pin", f"{component}.perf."],
+                            capture_output=True, text=True, timeout=5.0, check=True).stdout
+    rows = {}
+    totals = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) < 5:
+            continue
+        name, value = fields[4], fields[3]
+        key = name[len(component) + len(".perf."):]
+        callback, _, field = key.rpartition(".")
+        if callback:
+            rows.setdefault(callback, {})[field] = value
+        else:
+            totals[field] = value
+    print(f"  {'callback':32s} {'count':>8s} {'mean ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    for callback, values in sorted(rows.items(), key=lambda kv: -float(kv[1].get("max-ms", 0))):
+        print(f"  {callback:32s} {int(values.get('count', 0)):8d} {float(values.get('mean-ms', 0)):9.2f} "
+              f"{float(values.get('p99-ms', 0)):9.2f} {float(values.get('max-ms', 0)):9.2f}")
+    for field, value in sorted(totals.items()):
+        if field == "stall-culprit" and 0 <= int(value) < len(rows):
+            value = f"{value} ({sorted(rows)[int(value)]})"
+        print(f"  {field}: {value}")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if command == "dump":
+            dump(sys.argv[2] if len(sys.argv) > 2 else "gladevcp")
+        else:
+            print(__doc__)
+            return 1
+    except (OSError, ValueError, subprocess.SubprocessError) as e:
+        print(f"PERF: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+cia402_sim.py - Offline CiA402 drive simulator and enable/fault-recovery benchmark
+
+Mycia402Logic is a line-by-line Python port of read_all/write_all in
+mycia402.comp (the state machine glue lathe.hal loads for the 4 drives);
+keep it in step with the .comp when either changes. DriveModel implements
+the CiA402 power state machine of a drive (statusword from controlword)
+with a configurable delay in servo cycles for every transition.
+
+The harness runs the servo-thread order of lathe.hal cycle by cycle:
+    lcec.read-all (statusword from the last frame) -> mycia402.read-all
+    -> motion (amp-enable) -> mycia402.write-all -> lcec.write-all (controlword)
+and reports in servo cycles:
+    enable     machine on (amp-enable rises) until every drive is Operation Enabled
+    fault      a drive faults while enabled; motion drops amp-enable when it
+               sees drv-fault, the operator switches the machine on again after
+               OPERATOR_DELAY cycles, until every drive is Operation Enabled again
+
+Settings in lathe.ini (delays in servo cycles, SERVO_PERIOD from [EMCMOT]):
+    [CIA402_SIM]
+    DRIVES = 4
+    DELAYS = boot=50 shutdown=2 switch_on=10 enable=5 fault_reset=3 fault_reaction=2 mode=1
+    DRIVE_2 = switch_on=40          (per drive overrides)
+    OPERATOR_DELAY = 500
+
+Usage:
+    python3 cia402_sim.py enable [trace]
+    python3 cia402_sim.py fault [drive] [trace]
+    python3 cia402_sim.py all
+"""
+
+import sys
+
+from ini_config import IniConfig
+
+# CiA402 power states and their statusword (bits 0-3, 5, 6; bit 4 voltage, bit 9 remote)
+NOT_READY = "not ready"
+SWITCH_ON_DISABLED = "switch on disabled"
+READY_TO_SWITCH_ON = "ready to switch on"
+SWITCHED_ON = "switched on"
+OPERATION_ENABLED = "operation enabled"
+QUICK_STOP_ACTIVE = "quick stop active"
+FAULT_REACTION_ACTIVE = "fault reaction active"
+FAULT = "fault"
+STATUSWORD = {
+    NOT_READY: 0x0000,
+    SWITCH_ON_DISABLED: 0x0040,
+    READY_TO_SWITCH_ON: 0x0021,
+    SWITCHED_ON: 0x0033,
+    OPERATION_ENABLED: 0x0037,
+    QUICK_STOP_ACTIVE: 0x0017,
+    FAULT_REACTION_ACTIVE: 0x001F,
+    FAULT: 0x0008,
+}
+REMOTE = 1 << 9
+TARGET_REACHED = 1 << 10
+
+DEFAULT_DELAYS = {"boot": 50, "shutdown": 2, "switch_on": 10, "enable": 5,
+                  "fault_reset": 3, "fault_reaction": 2, "mode": 1}
+DEFAULT_PERIOD_NS = 1000000
+
+# mycia402.comp constants
+FAULT_AUTORESET_DELAY_NS = 100000000
+OPMODE_CYCLIC_POSITION = 8
+OPMODE_CYCLIC_VELOCITY = 9
+OPMODE_HOMING = 6
+OPMODE_NONE = 0
+
+
+class Mycia402Logic:
+    """Port of mycia402.comp read_all/write_all (pins and variables as attributes)"""
+
+    def __init__(self, period_ns):
+        self.period = period_ns
+        # pins
+        self.statusword = 0
+        self.opmode_display = 0
+        self.controlword = 0
+        self.opmode = 0
+        self.enable = False
+        self.fault_reset = False
+        self.drv_fault = False
+        self.home = False
+        self.stat_homed = False
+        self.stat_homing = False
+        # parameters (EXTRA_SETUP defaults)
+        self.auto_fault_reset = True
+        self.csp_mode = True
+        self.homing_delay_ns = 4000000000
+        # variables
+        self.enable_old = False
+        self.stat_homed_old = False
+        self.pos_mode = True
+        self.init_pos_mode = False
+        self.auto_fault_reset_delay = 0
+        self.homing_delay_timer = 0
+
+    def read_all(self):
+        status = self.statusword
+        self.opmode_homing = self.opmode_display == OPMODE_HOMING
+        self.stat_switchon_ready = bool(status >> 0 & 1)
+        self.stat_switched_on = bool(status >> 1 & 1)
+        self.stat_op_enabled = bool(status >> 2 & 1)
+        self.stat_fault = bool(status >> 3 & 1)
+        self.stat_voltage_enabled = bool(status >> 4 & 1)
+
+        if self.opmode_homing:
+            self.stat_homed = bool(status >> 10 & 1) and bool(status >> 12 & 1)
+            self.stat_homing = not self.stat_homed and not (status >> 10 & 1)
+
+        # update fault output
+        if self.auto_fault_reset_delay > 0:
+            self.auto_fault_reset_delay -= self.period
+            self.drv_fault = False
+        else:
+            self.drv_fault = self.stat_fault and self.enable
+
+    def write_all(self):
+        if not self.init_pos_mode:
+            self.pos_mode = self.csp_mode
+            self.init_pos_mode = True
+
+        enable_edge = self.enable and not self.enable_old
+        self.enable_old = self.enable
+        if enable_edge:
+            self.homing_delay_timer = self.homing_delay_ns
+        if self.homing_delay_timer > 0:
+            self.homing_delay_timer -= self.period
+
+        controlword = 1 << 2  # quick stop (bit 2 always set)
+        if self.stat_fault:
+            self.home = False
+            if self.fault_reset:
+                controlword |= 1 << 7
+            if self.auto_fault_reset and enable_edge:
+                self.auto_fault_reset_delay = FAULT_AUTORESET_DELAY_NS
+                controlword |= 1 << 7
+        elif self.enable:
+            controlword |= 1 << 1
+            if self.stat_switchon_ready:
+                controlword |= 1 << 0
+                if self.stat_switched_on:
+                    controlword |= 1 << 3
+
+        if self.home and self.homing_delay_timer <= 0:
+            self.opmode = OPMODE_HOMING
+            controlword |= 1 << 4
+            controlword &= ~((1 << 5) | (1 << 6))
+            if self.stat_homed and not self.stat_homed_old:
+                self.home = False
+        elif self.stat_voltage_enabled:
+            self.opmode = OPMODE_CYCLIC_POSITION if self.pos_mode else OPMODE_CYCLIC_VELOCITY
+
+        self.controlword = controlword
+        self.stat_homed_old = self.stat_homed
+
+
+def decode_command(controlword, state):
+    """Target state of a controlword in the given state (CiA402 device control)"""
+    low = controlword & 0x0F
+    if state == FAULT:
+        return None
+    if not controlword & 0x02:                       # disable voltage
+        return SWITCH_ON_DISABLED
+    if (controlword & 0x06) == 0x02:                 # quick stop
+        return QUICK_STOP_ACTIVE if state == OPERATION_ENABLED else SWITCH_ON_DISABLED
+    if (controlword & 0x07) == 0x06:                 # shutdown
+        return READY_TO_SWITCH_ON
+    if low == 0x07:                                  # switch on / disable operation
+        return SWITCHED_ON
+    if low == 0x0F:                                  # switch on + enable operation
+        if state == READY_TO_SWITCH_ON:
+            return SWITCHED_ON
+        return OPERATION_ENABLED
+    return None
+
+
+# allowed transitions and the delay that applies to them
+TRANSITIONS = {
+    (SWITCH_ON_DISABLED, READY_TO_SWITCH_ON): "shutdown",
+    (SWITCHED_ON, READY_TO_SWITCH_ON): "shutdown",
+    (OPERATION_ENABLED, READY_TO_SWITCH_ON): "shutdown",
+    (READY_TO_SWITCH_ON, SWITCHED_ON): "switch_on",
+    (OPERATION_ENABLED, SWITCHED_ON): "shutdown",
+    (SWITCHED_ON, OPERATION_ENABLED): "enable",
+    (QUICK_STOP_ACTIVE, OPERATION_ENABLED): "enable",
+    (READY_TO_SWITCH_ON, SWITCH_ON_DISABLED): "shutdown",
+    (SWITCHED_ON, SWITCH_ON_DISABLED): "shutdown",
+    (OPERATION_ENABLED, SWITCH_ON_DISABLED): "shutdown",
+    (QUICK_STOP_ACTIVE, SWITCH_ON_DISABLED): "shutdown",
+    (OPERATION_ENABLED, QUICK_STOP_ACTIVE): "shutdown",
+}
+
+
+class DriveModel:
+    """CiA402 drive: follows the controlword after per-transition delays"""
+
+    def __init__(self, delays):
+        self.delays = dict(delays)
+        self.state = NOT_READY
+        self.pending = None          # (target state, cycles left)
+        self.opmode_display = OPMODE_NONE
+        self.mode_pending = None
+        self.last_controlword = 0
+        self.fault_pending = False
+        self._schedule(SWITCH_ON_DISABLED, "boot")
+
+    def _schedule(self, target, delay_name):
+        if self.pending and self.pending[0] == target:
+            return
+        self.pending = (target, self.delays.get(delay_name, 0))
+
+    def inject_fault(self):
+        self.state = FAULT_REACTION_ACTIVE
+        self.pending = None
+        self._schedule(FAULT, "fault_reaction")
+
+    def step(self, controlword, opmode):
+        """One servo cycle with the controlword/opmode of this frame"""
+        fault_reset_edge = controlword & 0x80 and not self.last_controlword & 0x80
+        self.last_controlword = controlword
+
+        if self.state == FAULT and fault_reset_edge:
+            self._schedule(SWITCH_ON_DISABLED, "fault_reset")
+        elif self.state not in (NOT_READY, FAULT, FAULT_REACTION_ACTIVE):
+            target = decode_command(controlword, self.state)
+            if target and target != self.state and (self.state, target) in TRANSITIONS:
+                self._schedule(target, TRANSITIONS[(self.state, target)])
+            elif self.pending and self.pending[0] != target and target is not None:
+                self.pending = None  # command withdrawn before the drive got there
+
+        if self.pending:
+            target, left = self.pending
+            if left <= 0:
+                self.state = target
+                self.pending = None
+            else:
+                self.pending = (target, left - 1)
+
+        if opmode != self.opmode_display:
+            if self.mode_pending is None or self.mode_pending[0] != opmode:
+                self.mode_pending = (opmode, self.delays.get("mode", 0))
+            target, left = self.mode_pending
+            if left <= 0:
+                self.opmode_display = target
+                self.mode_pending = None
+            else:
+                self.mode_pending = (target, left - 1)
+
+    @property
+    def statusword(self):
+        status = STATUSWORD[self.state]
+        if self.state != NOT_READY:
+            status |= REMOTE
+        if self.state == OPERATION_ENABLED:
+            status |= TARGET_REACHED
+        return status
+
+
+class Simulation:
+    """Drives + component logic on a simulated servo-thread"""
+
+    def __init__(self, drive_delays, period_ns=DEFAULT_PERIOD_NS, trace=False):
+        self.drives = [DriveModel(d) for d in drive_delays]
+        self.logic = [Mycia402Logic(period_ns) for _ in drive_delays]
+        self.bus_status = [0] * len(self.drives)
+        self.bus_opmode = [0] * len(self.drives)
+        self.amp_enable = False
+        self.cycle = 0
+        self.trace = trace
+        self.last_states = [None] * len(self.drives)
+
+    def step(self):
+        # lcec.read-all: statusword of the previous frame
+        for logic, status, drive in zip(self.logic, self.bus_status, self.drives):
+            logic.statusword = status
+            logic.opmode_display = drive.opmode_display
+            logic.read_all()
+        # motion: any drive fault drops amp-enable (joint.N.amp-fault-in)
+        if any(logic.drv_fault for logic in self.logic):
+            self.amp_enable = False
+        for logic in self.logic:
+            logic.enable = self.amp_enable
+            logic.write_all()
+        # lcec.write-all: the frame reaches the drives
+        for i, (logic, drive) in enumerate(zip(self.logic, self.drives)):
+            drive.step(logic.controlword, logic.opmode)
+            self.bus_status[i] = drive.statusword
+            if self.trace and drive.state != self.last_states[i]:
+                print(f"  cycle {self.cycle:6d}  drive {i}: {drive.state:22s} "
+                      f"cw=0x{logic.controlword:04x} sw=0x{drive.statusword:04x}")
+            self.last_states[i] = drive.state
+        self.cycle += 1
+
+    def run_until(self, condition, limit):
+        start = self.cycle
+        while not condition():
+            if self.cycle - start >= limit:
+                return None
+            self.step()
+        return self.cycle - start
+
+    def all_enabled(self):
+        return all(d.state == OPERATION_ENABLED for d in self.drives) and \
+            all(l.stat_op_enabled for l in self.logic)
+
+
+def read_settings(ini=None):
+    ini = ini or IniConfig()
+    period = ini.find_int("EMCMOT", "SERVO_PERIOD", DEFAULT_PERIOD_NS)
+    count = ini.find_int("CIA402_SIM", "DRIVES", 4)
+    base = dict(DEFAULT_DELAYS)
+    base.update(parse_delays(ini.find("CIA402_SIM", "DELAYS", "")))
+    delays = []
+    for i in range(count):
+        d = dict(base)
+        d.update(parse_delays(ini.find("CIA402_SIM", f"DRIVE_{i}", "")))
+        delays.append(d)
+    operator_delay = ini.find_int("CIA402_SIM", "OPERATOR_DELAY", 500)
+    return delays, period, operator_delay
+
+
+def parse_delays(text):
+    delays = {}
+    for item in (text or "").split():
+        key, _, value = item.partition("=")
+        if key in DEFAULT_DELAYS:
+            delays[key] = int(value)
+    return delays
+
+
+def bench_enable(delays, period, trace=False, limit=100000):
+    sim = Simulation(delays, period, trace)
+    # drives boot while the machine is off, like after LinuxCNC start
+    booted = sim.run_until(lambda: all(d.state == SWITCH_ON_DISABLED for d in sim.drives), limit)
+    sim.amp_enable = True
+    cycles = sim.run_until(sim.all_enabled, limit)
+    return booted, cycles, sim
+
+
+def bench_fault(delays, period, operator_delay, drive=0, trace=False, limit=100000):
+    _, _, sim = bench_enable(delays, period, False, limit)
+    sim.trace = trace
+    sim.drives[drive].inject_fault()
+    dropped = sim.run_until(lambda: not sim.amp_enable, limit)
+    sim.run_until(lambda: False, operator_delay)
+    sim.amp_enable = True
+    cycles = sim.run_until(sim.all_enabled, limit)
+    return dropped, cycles, sim
+
+
+def report(name, cycles, period):
+    if cycles is None:
+        print(f"CIA402SIM: {name}: NOT reached (limit)")
+    else:
+        print(f"CIA402SIM: {name}: {cycles} cycles ({cycles * period / 1e6:.1f} ms)")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "all"
+    trace = "trace" in sys.argv
+    args = [a for a in sys.argv[2:] if a != "trace"]
+    try:
+        # off the machine there is no lathe.ini: the built-in delays apply
+        delays, period, operator_delay = read_settings()
+        if command in ("enable", "all"):
+            booted, cycles, _ = bench_enable(delays, period, trace and command == "enable")
+            report("drive boot to switch on disabled", booted, period)
+            report("machine on -> all drives operation enabled", cycles, period)
+        if command in ("fault", "all"):
+            drives = [int(args[0])] if args else range(len(delays))
+            for drive in drives:
+                dropped, cycles, _ = bench_fault(delays, period, operator_delay, drive,
+                                                 trace and command == "fault")
+                report(f"drive {drive} fault -> amp-enable dropped", dropped, period)
+                report(f"drive {drive} re-enable -> all operation enabled", cycles, period)
+        if command not in ("enable", "fault", "all"):
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError) as e:
+        print(f"CIA402SIM: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
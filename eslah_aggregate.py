@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+eslah_aggregate.py - Running aggregate of the ESLH correction profiles
+
+Keeps per workpiece type the prefix sums of the ESLH profiles (value and
+value squared) in the order of their ESLH numbers:
+    S[k] = ESLH-1 + ... + ESLH-k
+so the mean/std of the newest n files is (S[K] - S[K-n]) / n, the same
+cost for 5 or 5000 files of history. Adding a file appends one prefix row
+and M124 removing the newest files truncates rows, both O(profile length).
+
+Files in StandardDimentions/<TYPE>/.eslh_cache/:
+    aggregate.json         profile shape and the files summed (name, size, mtime_ns)
+    aggregate.sum.f8       prefix sums, (K + 1) rows of float64
+    aggregate.sumsq.f8     prefix sums of squares
+
+sync() compares the recorded files with the folder: new newest files are
+added, removed newest files are popped, anything else (an older file
+edited or removed, a different profile shape) rebuilds from the files.
+NaN padding of short rows (see eslah_cache) counts as 0.
+
+M118 appends its new file (add_file), M124 pops the newest files it removed
+(pop_files) and an M125 restore syncs, so the aggregate stays current at
+the cost of one profile per file. A hook that finds the aggregate out of
+step with the folder falls back to sync(). GuiLib.create_eslah
+(gcode/GuiLib, outside this config) still combines the text files itself;
+window() is the O(profile length) replacement it can read.
+
+Usage:
+    python3 eslah_aggregate.py sync [TYPE ...]
+    python3 eslah_aggregate.py window <TYPE> <count>     (mean/std of the newest count files)
+    python3 eslah_aggregate.py rebuild <TYPE>
+"""
+
+import os
+import sys
+import json
+
+import numpy as np
+
+from eslah_cache import (load_eslh, list_eslh_files, eslh_number, type_folder,
+                         CACHE_DIR_NAME, WORKPIECE_TYPES)
+
+VERSION = 1
+
+
+class EslahAggregate:
+    def __init__(self, folder, workpiece_type):
+        self.folder = folder
+        self.workpiece_type = workpiece_type
+        cache_dir = os.path.join(folder, CACHE_DIR_NAME)
+        self.meta_file = os.path.join(cache_dir, "aggregate.json")
+        self.sum_file = os.path.join(cache_dir, "aggregate.sum.f8")
+        self.sumsq_file = os.path.join(cache_dir, "aggregate.sumsq.f8")
+        self.shape = None
+        self.files = []
+        self.load()
+
+    # ---------------------------
+    # persisted state
+    # ---------------------------
+    def load(self):
+        try:
+            with open(self.meta_file, "r") as f:
+                meta = json.load(f)
+            if meta.get("version") != VERSION:
+                raise ValueError("version")
+            self.shape = tuple(meta["shape"]) if meta["shape"] else None
+            self.files = meta["files"]
+            if self.shape and os.path.getsize(self.sum_file) < self._row_offset(len(self.files) + 1):
+                raise ValueError("prefix file too short")
+        except (OSError, ValueError, KeyError):
+            self.shape = None
+            self.files = []
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.meta_file), exist_ok=True)
+        tmp_file = self.meta_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"version": VERSION, "shape": list(self.shape) if self.shape else None,
+                       "files": self.files}, f, indent=1)
+        os.replace(tmp_file, self.meta_file)
+
+    @property
+    def row_size(self):
+        return int(np.prod(self.shape)) if self.shape else 0
+
+    def _row_offset(self, row):
+        return row * self.row_size * 8
+
+    def _prefix_row(self, path, row):
+        """Prefix sum row k (S[0] is zero) as a memory-mapped view"""
+        return np.memmap(path, dtype="<f8", mode="r", offset=self._row_offset(row),
+                         shape=(self.row_size,))
+
+    def _truncate(self, rows):
+        for path in (self.sum_file, self.sumsq_file):
+            with open(path, "ab") as f:
+                f.truncate(self._row_offset(rows))
+
+    def _append_rows(self, total, total_sq):
+        for path, row in ((self.sum_file, total), (self.sumsq_file, total_sq)):
+            with open(path, "r+b") as f:
+                f.seek(self._row_offset(len(self.files) + 1))
+                f.write(np.ascontiguousarray(row, dtype="<f8").tobytes())
+
+    # ---------------------------
+    # updates
+    # ---------------------------
+    def _reset(self, shape):
+        self.shape = tuple(shape)
+        self.files = []
+        os.makedirs(os.path.dirname(self.meta_file), exist_ok=True)
+        zero = np.zeros(self.row_size, dtype="<f8").tobytes()
+        for path in (self.sum_file, self.sumsq_file):
+            with open(path, "wb") as f:
+                f.write(zero)
+
+    def add(self, file_path, save=True):
+        """Append one ESLH file as the newest profile"""
+        values = np.nan_to_num(np.asarray(load_eslh(file_path), dtype=np.float64), nan=0.0)
+        if self.shape != values.shape:
+            if self.files:
+                print(f"ESLH_AGG: {self.workpiece_type}: profile shape {values.shape} differs "
+                      f"from {self.shape}, restarting the aggregate")
+            self._reset(values.shape)
+        values = values.ravel()
+        k = len(self.files)
+        total = self._prefix_row(self.sum_file, k) + values
+        total_sq = self._prefix_row(self.sumsq_file, k) + values * values
+        self._append_rows(total, total_sq)
+        st = os.stat(file_path)
+        self.files.append({"name": os.path.basename(file_path), "size": st.st_size,
+                           "mtime_ns": st.st_mtime_ns})
+        if save:
+            self.save()
+
+    def pop(self, count=1, save=True):
+        """Remove the newest count profiles"""
+        count = min(count, len(self.files))
+        if count <= 0:
+            return 0
+        self.files = self.files[:len(self.files) - count]
+        self._truncate(len(self.files) + 1)
+        if save:
+            self.save()
+        return count
+
+    def rebuild(self):
+        paths = list(reversed(list_eslh_files(self.folder, self.workpiece_type)))
+        self.shape = None
+        self.files = []
+        for path in paths:
+            self.add(path, save=False)
+        self.save()
+        print(f"ESLH_AGG: {self.workpiece_type}: rebuilt from {len(paths)} file(s)")
+
+    def sync(self):
+        """Bring the aggregate in line with the ESLH files on disk (oldest first)"""
+        on_disk = []
+        for path in reversed(list_eslh_files(self.folder, self.workpiece_type)):
+            st = os.stat(path)
+            on_disk.append({"name": os.path.basename(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns})
+
+        common = 0
+        while (common < len(self.files) and common < len(on_disk)
+               and self.files[common] == on_disk[common]):
+            common += 1
+        removed = len(self.files) - common
+        added = on_disk[common:]
+        if removed and common == 0 and added:
+            self.rebuild()
+            return
+        if removed:
+            self.pop(removed, save=False)
+        for entry in added:
+            self.add(os.path.join(self.folder, entry["name"]), save=False)
+        if removed or added or not os.path.exists(self.meta_file):
+            self.save()
+            print(f"ESLH_AGG: {self.workpiece_type}: +{len(added)} -{removed}, {len(self.files)} file(s)")
+
+    # ---------------------------
+    # queries
+    # ---------------------------
+    def window(self, count):
+        """(mean, std, files used) over the newest count profiles, O(profile length)"""
+        k = len(self.files)
+        count = min(count, k)
+        if count <= 0:
+            return None, None, 0
+        total = self._prefix_row(self.sum_file, k) - self._prefix_row(self.sum_file, k - count)
+        total_sq = self._prefix_row(self.sumsq_file, k) - self._prefix_row(self.sumsq_file, k - count)
+        mean = total / count
+        variance = np.maximum(total_sq / count - mean * mean, 0.0)
+        return mean.reshape(self.shape), np.sqrt(variance).reshape(self.shape), count
+
+    def newest_number(self):
+        if not self.files:
+            return 0
+        return eslh_number(self.files[-1]["name"], self.workpiece_type)
+
+
+def add_file(workpiece_type, file_path, folder=None):
+    """M118 hook: append the new newest ESLH file; never raises"""
+    try:
+        aggregate = EslahAggregate(folder or type_folder(workpiece_type), workpiece_type)
+        if aggregate.files and eslh_number(os.path.basename(file_path), workpiece_type) > aggregate.newest_number():
+            aggregate.add(file_path)
+            print(f"ESLH_AGG: {workpiece_type}: +1, {len(aggregate.files)} file(s)")
+        else:
+            # first use or out of step with the folder
+            aggregate.sync()
+    except Exception as e:
+        print(f"ESLH_AGG: Warning - {workpiece_type} aggregate not updated: {e}")
+
+
+def pop_files(workpiece_type, names, folder=None):
+    """M124 hook: pop the removed newest ESLH files (names); never raises"""
+    try:
+        aggregate = EslahAggregate(folder or type_folder(workpiece_type), workpiece_type)
+        newest = [entry["name"] for entry in aggregate.files[len(aggregate.files) - len(names):]]
+        if names and len(newest) == len(names) and set(newest) == set(names):
+            aggregate.pop(len(names))
+            print(f"ESLH_AGG: {workpiece_type}: -{len(names)}, {len(aggregate.files)} file(s)")
+        else:
+            aggregate.sync()
+    except Exception as e:
+        print(f"ESLH_AGG: Warning - {workpiece_type} aggregate not updated: {e}")
+
+
+def sync_type(workpiece_type, folder=None):
+    """M125 hook: bring the aggregate in line with restored files; never raises"""
+    try:
+        EslahAggregate(folder or type_folder(workpiece_type), workpiece_type).sync()
+    except Exception as e:
+        print(f"ESLH_AGG: Warning - {workpiece_type} aggregate not updated: {e}")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    command = sys.argv[1]
+    try:
+        if command == "sync":
+            for workpiece_type in [t.upper() for t in sys.argv[2:]] or WORKPIECE_TYPES:
+                EslahAggregate(type_folder(workpiece_type), workpiece_type).sync()
+        elif command == "window":
+            workpiece_type = sys.argv[2].upper()
+            aggregate = EslahAggregate(type_folder(workpiece_type), workpiece_type)
+            aggregate.sync()
+            mean, std, used = aggregate.window(int(sys.argv[3]))
+            if mean is None:
+                print(f"ESLH_AGG: No ESLH files for {workpiece_type}")
+                return 1
+            print(f"ESLH_AGG: {workpiece_type}: newest {used} of {len(aggregate.files)} file(s), shape {mean.shape}")
+            np.savetxt(sys.stdout, np.column_stack((mean.reshape(len(mean), -1), std.reshape(len(std), -1))),
+                       fmt="%.6f")
+        elif command == "rebuild":
+            workpiece_type = sys.argv[2].upper()
+            EslahAggregate(type_folder(workpiece_type), workpiece_type).rebuild()
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError) as e:
+        print(f"ESLH_AGG: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+eslah_async.py - Double-buffered eslah: generate while grinding, swap at the part boundary
+
+M118 stops the series at M0 while create_eslah and create_CNC_code run. With
+#89=1 file.ngc calls M127 instead, which starts this script in the
+background: the new ESLH file is created and <type>.ngc is generated into the
+shadow buffer (.regen_staging/shadow/, see regen_worker.py) while the machine
+keeps grinding with the live program. When the buffer is complete the
+eslah-buffer-ready signal goes high and file.ngc calls M128 at the next part
+boundary, which renames the shadow program over the live one. A marker
+keeps regen_worker.py from regenerating the type in between.
+
+HAL (spindle_to_gladevcp.hal):
+    net eslah-buffer-ready gladevcp.eslah_buffer_ready
+
+Usage:
+    python3 eslah_async.py start <type 0-5> <read_count>   (M127, runs until the buffer is ready)
+    python3 eslah_async.py swap <type 0-5>                 (M128)
+    python3 eslah_async.py status
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+from regen_worker import (WORKPIECE_TYPES, get_generator_params, generate_shadow, read_shadow_marker,
+                          shadow_paths, shadow_ready, swap_shadow, write_shadow_marker)
+
+FILE_TYPE_MAP = {0: "SX", 1: "S1", 2: "S2", 3: "F1", 4: "F2", 5: "F3"}
+
+
+def set_buffer_ready(ready):
+    try:
+        subprocess.run(["halcmd", "sets", "eslah-buffer-ready", "1" if ready else "0"],
+                       check=True, timeout=2.0)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"ESLH_ASYNC: Could not set eslah-buffer-ready: {e}")
+
+
+def start(file_type, read_count):
+    """Create the ESLH file and fill the shadow buffer; returns True when it is ready"""
+    marker = read_shadow_marker(file_type)
+    if marker is not None and marker.get("state") == "generating":
+        print(f"ESLH_ASYNC: {file_type} is already being generated (pid {marker.get('pid')})")
+        return False
+    # claim the type before the new ESLH file appears so regen_worker keeps its hands off
+    write_shadow_marker(file_type, {"state": "generating", "pid": os.getpid(),
+                                    "started_at": time.strftime('%Y-%m-%d %H:%M:%S')})
+    set_buffer_ready(False)
+    start_time = time.time()
+    try:
+        if read_count > 0:
+            from eslah_m118 import create_eslh_step
+            if not create_eslh_step(file_type, read_count):
+                raise RuntimeError("ESLH file was not created")
+        if not generate_shadow(file_type, get_generator_params()):
+            raise RuntimeError("program generation failed")
+    except Exception as e:
+        print(f"ESLH_ASYNC: {file_type} failed: {e}")
+        # release the type; regen_worker.py picks up whatever inputs changed
+        os.remove(shadow_paths(file_type)[1])
+        return False
+    set_buffer_ready(True)
+    print(f"ESLH_ASYNC: {file_type} buffer ready in {time.time() - start_time:.1f}s, swapped in by M128")
+    return True
+
+
+def swap(file_type):
+    if not swap_shadow(file_type):
+        print(f"ESLH_ASYNC: No ready buffer for {file_type}, keeping the live program")
+        return False
+    set_buffer_ready(False)
+    return True
+
+
+def status():
+    for file_type in WORKPIECE_TYPES:
+        marker = read_shadow_marker(file_type)
+        if marker is None:
+            state = "no buffer"
+        elif shadow_ready(file_type):
+            state = f"ready since {marker.get('generated_at')}"
+        else:
+            state = f"{marker.get('state')} (started {marker.get('started_at', '?')})"
+        print(f"  {file_type}: {state}")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if command == "start" and len(sys.argv) == 4:
+            file_type = FILE_TYPE_MAP.get(int(sys.argv[2]), "F2")
+            return 0 if start(file_type, int(sys.argv[3])) else 1
+        elif command == "swap" and len(sys.argv) == 3:
+            swap(FILE_TYPE_MAP.get(int(sys.argv[2]), "F2"))
+        elif command == "status":
+            status()
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError) as e:
+        print(f"ESLH_ASYNC: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
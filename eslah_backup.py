@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+eslah_backup.py - Content-addressed backup store for removed ESLH files
+
+Removed files are stored once per content (sha256) as zlib compressed blobs:
+    StandardDimentions/backup/objects/<hh>/<rest of hash>.z
+and every removal is recorded in StandardDimentions/backup/index.json.
+
+Retention is set in lathe.ini:
+    [ESLAH_BACKUP]
+    MAX_BYTES = 52428800      (compressed size of all blobs)
+    MAX_ENTRIES = 500         (removal records per workpiece type)
+
+Usage:
+    python3 eslah_backup.py list [TYPE]
+    python3 eslah_backup.py restore <TYPE> [count] [--force]
+    python3 eslah_backup.py restore-file <TYPE> <file name> [--force]
+    python3 eslah_backup.py prune
+    python3 eslah_backup.py migrate     (import old backup_<name>_<timestamp> copies)
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import hashlib
+from datetime import datetime
+
+from ini_config import IniConfig
+
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 500
+WORKPIECE_TYPES = ["SX", "S1", "S2", "F1", "F2", "F3"]
+
+
+class EslahBackupStore:
+    def __init__(self, standard_dimensions_dir=None, max_bytes=None, max_entries=None):
+        self.base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.standard_dimensions_dir = standard_dimensions_dir or os.path.join(
+            self.base_dir, "gcode", "StandardDimentions")
+        self.backup_dir = os.path.join(self.standard_dimensions_dir, "backup")
+        self.objects_dir = os.path.join(self.backup_dir, "objects")
+        self.index_file = os.path.join(self.backup_dir, "index.json")
+
+        ini = IniConfig()
+        self.max_bytes = max_bytes if max_bytes is not None else ini.find_int(
+            "ESLAH_BACKUP", "MAX_BYTES", DEFAULT_MAX_BYTES)
+        self.max_entries = max_entries if max_entries is not None else ini.find_int(
+            "ESLAH_BACKUP", "MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+
+        self.entries = self.load_index()
+
+    # ---------------------------
+    # index handling
+    # ---------------------------
+    def load_index(self):
+        if not os.path.exists(self.index_file):
+            return []
+        try:
+            with open(self.index_file, "r") as f:
+                return json.load(f).get("entries", [])
+        except (ValueError, OSError) as e:
+            print(f"BACKUP: Warning - could not read index, starting empty: {e}")
+            return []
+
+    def save_index(self):
+        os.makedirs(self.backup_dir, exist_ok=True)
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"version": 1, "entries": self.entries}, f, indent=1)
+        os.replace(tmp_file, self.index_file)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest[2:] + ".z")
+
+    # ---------------------------
+    # store / restore
+    # ---------------------------
+    def put(self, file_path, workpiece_type, removed_at=None, save=True):
+        """Store file content (once per hash) and record its removal"""
+        with open(file_path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self.object_path(digest)
+
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            tmp_path = blob_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(data, 6))
+            os.replace(tmp_path, blob_path)
+            stored = True
+        else:
+            stored = False
+
+        self.entries.append({
+            "type": workpiece_type,
+            "name": os.path.basename(file_path),
+            "sha256": digest,
+            "size": len(data),
+            "removed_at": removed_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        if save:
+            self.save_index()
+
+        state = "stored" if stored else "already in store"
+        print(f"BACKUP: {os.path.basename(file_path)} -> {digest[:12]} ({state})")
+        return digest
+
+    def read_blob(self, digest):
+        with open(self.object_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def entries_for_type(self, workpiece_type):
+        """Removal records of one type, most recently removed first"""
+        matches = [e for e in self.entries if e["type"] == workpiece_type]
+        matches.reverse()
+        return matches
+
+    def restore_entry(self, entry, force=False):
+        target_dir = os.path.join(self.standard_dimensions_dir, entry["type"])
+        target = os.path.join(target_dir, entry["name"])
+        if os.path.exists(target) and not force:
+            print(f"BACKUP: Skipping {entry['name']} - file already exists (use --force)")
+            return False
+        data = self.read_blob(entry["sha256"])
+        if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            print(f"BACKUP: ERROR - blob for {entry['name']} is corrupt")
+            return False
+        os.makedirs(target_dir, exist_ok=True)
+        tmp_target = target + ".tmp"
+        with open(tmp_target, "wb") as f:
+            f.write(data)
+        os.replace(tmp_target, target)
+        print(f"BACKUP: Restored {entry['name']} (removed {entry['removed_at']})")
+        return True
+
+    def restore_latest(self, workpiece_type, count=1, force=False):
+        """Restore the last <count> removed files of a type"""
+        restored = []
+        seen = set()
+        for entry in self.entries_for_type(workpiece_type):
+            if len(restored) >= count:
+                break
+            if entry["name"] in seen:
+                continue
+            seen.add(entry["name"])
+            if self.restore_entry(entry, force):
+                restored.append(entry["name"])
+        return restored
+
+    def restore_file(self, workpiece_type, name, force=False):
+        for entry in self.entries_for_type(workpiece_type):
+            if entry["name"] == name:
+                return self.restore_entry(entry, force)
+        print(f"BACKUP: No backup of {name} for {workpiece_type}")
+        return False
+
+    # ---------------------------
+    # retention
+    # ---------------------------
+    def blob_size(self, digest):
+        try:
+            return os.path.getsize(self.object_path(digest))
+        except OSError:
+            return 0
+
+    def prune(self):
+        """Apply MAX_ENTRIES per type and MAX_BYTES over all blobs, oldest first"""
+        kept = []
+        per_type = {}
+        for entry in reversed(self.entries):
+            per_type[entry["type"]] = per_type.get(entry["type"], 0) + 1
+            if per_type[entry["type"]] <= self.max_entries:
+                kept.append(entry)
+        kept.reverse()
+
+        sizes = {}
+        for entry in kept:
+            if entry["sha256"] not in sizes:
+                sizes[entry["sha256"]] = self.blob_size(entry["sha256"])
+        total = sum(sizes.values())
+
+        while kept and total > self.max_bytes:
+            oldest = kept.pop(0)
+            if not any(e["sha256"] == oldest["sha256"] for e in kept):
+                total -= sizes.pop(oldest["sha256"], 0)
+
+        dropped = len(self.entries) - len(kept)
+        self.entries = kept
+        self.save_index()
+
+        removed_blobs = self.remove_unreferenced_blobs()
+        if dropped or removed_blobs:
+            print(f"BACKUP: Pruned {dropped} records, {removed_blobs} blobs ({total} bytes kept)")
+        return dropped
+
+    def remove_unreferenced_blobs(self):
+        referenced = {e["sha256"] for e in self.entries}
+        removed = 0
+        if not os.path.exists(self.objects_dir):
+            return 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for blob in os.listdir(prefix_dir):
+                digest = prefix + blob.replace(".z", "")
+                if digest not in referenced:
+                    os.remove(os.path.join(prefix_dir, blob))
+                    removed += 1
+        return removed
+
+    # ---------------------------
+    # old backup_<name>_<timestamp> copies
+    # ---------------------------
+    def migrate_legacy_backups(self):
+        """Move the old full-copy backups into the store"""
+        migrated = 0
+        for workpiece_type in WORKPIECE_TYPES:
+            legacy_dir = os.path.join(self.backup_dir, workpiece_type)
+            if not os.path.isdir(legacy_dir):
+                continue
+            for file_name in sorted(os.listdir(legacy_dir)):
+                if not file_name.startswith("backup_"):
+                    continue
+                file_path = os.path.join(legacy_dir, file_name)
+                # backup_S1-ESLH-5.txt_20250812_101500
+                name, _, stamp = file_name[len("backup_"):].rpartition(".txt_")
+                try:
+                    removed_at = datetime.strptime(stamp, '%Y%m%d_%H%M%S').strftime('%Y-%m-%d %H:%M:%S')
+                except ValueError:
+                    removed_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(os.path.getmtime(file_path)))
+                self.put(file_path, workpiece_type, removed_at, save=False)
+                self.entries[-1]["name"] = name + ".txt"
+                os.remove(file_path)
+                migrated += 1
+            try:
+                os.rmdir(legacy_dir)
+            except OSError:
+                pass
+        self.entries.sort(key=lambda e: e["removed_at"])
+        self.save_index()
+        print(f"BACKUP: Migrated {migrated} legacy backup files")
+        return migrated
+
+    def list_entries(self, workpiece_type=None):
+        types = [workpiece_type] if workpiece_type else WORKPIECE_TYPES
+        for wt in types:
+            entries = self.entries_for_type(wt)
+            if not entries:
+                continue
+            print(f"BACKUP: {wt} removals (newest first):")
+            for e in entries:
+                print(f"  - {e['name']}  removed {e['removed_at']}  {e['size']} bytes  {e['sha256'][:12]}")
+
+
+def sync_aggregate(store, workpiece_type):
+    """Re-add restored files to the running ESLH aggregate (see eslah_aggregate.py)"""
+    from eslah_aggregate import sync_type
+    sync_type(workpiece_type, os.path.join(store.standard_dimensions_dir, workpiece_type))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+
+    command = sys.argv[1]
+    force = "--force" in sys.argv
+    args = [a for a in sys.argv[2:] if a != "--force"]
+    store = EslahBackupStore()
+
+    try:
+        if command == "list":
+            store.list_entries(args[0].upper() if args else None)
+        elif command == "restore":
+            count = int(args[1]) if len(args) > 1 else 1
+            restored = store.restore_latest(args[0].upper(), count, force)
+            print(f"BACKUP: Restored {len(restored)} file(s): {', '.join(restored)}")
+            sync_aggregate(store, args[0].upper())
+        elif command == "restore-file":
+            restored = store.restore_file(args[0].upper(), args[1], force)
+            sync_aggregate(store, args[0].upper())
+            return 0 if restored else 1
+        elif command == "prune":
+            store.prune()
+        elif command == "migrate":
+            store.migrate_legacy_backups()
+            store.prune()
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError) as e:
+        print(f"BACKUP: Error parsing parameters: {e}")
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
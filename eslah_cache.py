@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+eslah_cache.py - Parsed ESLH files cached as binary NumPy sidecars
+
+Each file is parsed once: the values are saved next to it as
+    StandardDimentions/<TYPE>/.eslh_cache/<TYPE>-ESLH-N.<size>.<mtime_ns>.npy
+and later reads memory-map that array. Size and mtime are part of the
+sidecar name, so an edited or replaced text file simply misses the cache
+and stale sidecars are removed by prune (M124 removes the sidecars of the
+files it deletes).
+
+The ESLH reads this config owns go through load_eslh: the running
+aggregate (eslah_aggregate.py) parses the file M118 just created once and
+its rebuilds read the sidecars. m124_handler only lists and removes files.
+GuiLib.create_eslah and read_ESLH_values (gcode/GuiLib, outside this
+config) still parse the text files themselves; skipping that parse is
+blocked until GuiLib calls read_eslh_files.
+
+The parser is generic: every line with numbers becomes a row (comma or
+whitespace separated, non-numeric text ignored), short rows are padded
+with NaN.
+
+Usage:
+    python3 eslah_cache.py warm [TYPE ...]        (parse every ESLH file not cached yet)
+    python3 eslah_cache.py read <TYPE> <count>    (newest count files, shapes and timing)
+    python3 eslah_cache.py prune [TYPE ...]       (remove sidecars of changed/removed files)
+"""
+
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+STANDARD_DIMENSIONS_DIR = "/home/cnc/linuxcnc/configs/xzacw/gcode/StandardDimentions"
+WORKPIECE_TYPES = ["SX", "S1", "S2", "F1", "F2", "F3"]
+CACHE_DIR_NAME = ".eslh_cache"
+NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+def parse_eslh_text(text):
+    """ESLH text -> 2D float64 array (one row per line with numbers)"""
+    rows = []
+    for line in text.splitlines():
+        values = [float(v) for v in NUMBER.findall(line)]
+        if values:
+            rows.append(values)
+    if not rows:
+        return np.zeros((0, 0))
+    width = max(len(r) for r in rows)
+    array = np.full((len(rows), width), np.nan)
+    for i, row in enumerate(rows):
+        array[i, :len(row)] = row
+    return array
+
+
+def eslh_number(file_name, workpiece_type):
+    """S1-ESLH-5.txt -> 5"""
+    try:
+        return int(file_name[len(f"{workpiece_type}-ESLH-"):-len(".txt")])
+    except ValueError:
+        return 0
+
+
+def list_eslh_files(folder, workpiece_type):
+    """ESLH files of a type folder, newest (highest number) first"""
+    if not os.path.isdir(folder):
+        return []
+    names = [n for n in os.listdir(folder)
+             if n.startswith(f"{workpiece_type}-ESLH-") and n.endswith(".txt")]
+    names.sort(key=lambda n: eslh_number(n, workpiece_type), reverse=True)
+    return [os.path.join(folder, n) for n in names]
+
+
+def sidecar_path(file_path, st=None):
+    st = st or os.stat(file_path)
+    folder, name = os.path.split(file_path)
+    base = os.path.splitext(name)[0]
+    return os.path.join(folder, CACHE_DIR_NAME, f"{base}.{st.st_size}.{st.st_mtime_ns}.npy")
+
+
+def load_eslh(file_path):
+    """Parsed values of one ESLH file; a read-only memory map when cached"""
+    st = os.stat(file_path)
+    sidecar = sidecar_path(file_path, st)
+    try:
+        return np.load(sidecar, mmap_mode="r")
+    except (OSError, ValueError):
+        pass
+
+    with open(file_path, "r") as f:
+        array = parse_eslh_text(f.read())
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+        tmp_file = f"{sidecar}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_file, sidecar)
+        remove_stale_sidecars(file_path, keep=sidecar)
+        return np.load(sidecar, mmap_mode="r")
+    except OSError as e:
+        # read-only folder etc.: still return the parsed values
+        print(f"ESLH_CACHE: Warning - could not cache {os.path.basename(file_path)}: {e}")
+        return array
+
+
+def remove_stale_sidecars(file_path, keep=None):
+    """Remove sidecars of older versions of file_path (all of them when it is gone)"""
+    folder, name = os.path.split(file_path)
+    base = os.path.splitext(name)[0]
+    cache_dir = os.path.join(folder, CACHE_DIR_NAME)
+    removed = 0
+    if not os.path.isdir(cache_dir):
+        return 0
+    for sidecar in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, sidecar)
+        # <base>.<size>.<mtime_ns>.npy
+        if sidecar.rsplit(".", 3)[0] == base and path != keep:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def read_eslh_files(folder, workpiece_type, count):
+    """Parsed arrays of the newest count ESLH files of a type, newest first"""
+    return [load_eslh(path) for path in list_eslh_files(folder, workpiece_type)[:count]]
+
+
+def prune(folder):
+    """Remove sidecars whose text file changed or was removed"""
+    cache_dir = os.path.join(folder, CACHE_DIR_NAME)
+    if not os.path.isdir(cache_dir):
+        return 0
+    valid = set()
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.endswith(".txt") and os.path.isfile(path):
+            valid.add(os.path.basename(sidecar_path(path)))
+    removed = 0
+    for sidecar in os.listdir(cache_dir):
+        if sidecar not in valid:
+            try:
+                os.remove(os.path.join(cache_dir, sidecar))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def type_folder(workpiece_type):
+    return os.path.join(STANDARD_DIMENSIONS_DIR, workpiece_type)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    command = sys.argv[1]
+    types = [t.upper() for t in sys.argv[2:]] or WORKPIECE_TYPES
+    try:
+        if command == "warm":
+            for workpiece_type in types:
+                files = list_eslh_files(type_folder(workpiece_type), workpiece_type)
+                for path in files:
+                    load_eslh(path)
+                print(f"ESLH_CACHE: {workpiece_type}: {len(files)} file(s) cached")
+        elif command == "read":
+            workpiece_type, count = sys.argv[2].upper(), int(sys.argv[3])
+            start = time.perf_counter()
+            arrays = read_eslh_files(type_folder(workpiece_type), workpiece_type, count)
+            elapsed = (time.perf_counter() - start) * 1000.0
+            for array in arrays:
+                print(f"  {array.shape}")
+            print(f"ESLH_CACHE: {len(arrays)} file(s) in {elapsed:.2f} ms")
+        elif command == "prune":
+            for workpiece_type in types:
+                removed = prune(type_folder(workpiece_type))
+                print(f"ESLH_CACHE: {workpiece_type}: removed {removed} stale sidecar(s)")
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError) as e:
+        print(f"ESLH_CACHE: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
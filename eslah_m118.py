@@ -14,7 +14,8 @@ sys.path.append('/home/cnc/linuxcnc/configs/xzacw/gcode')
 
 # Import your existing functions
 from GuiLib import create_eslah
-from DrawLib import create_CNC_code
+from regen_worker import get_generator_params, generate_program
+from eslah_aggregate import add_file
 
 def get_latest_eslh_file(output_dir, file_type):
     """Get the most recently created ESLH file"""
@@ -43,6 +44,62 @@ def reset_eslah_via_signal():
         print(f"Note during eslah reset: {e}")
 
 
+# Map numeric file type to string
+FILE_TYPE_MAP = {
+    0: "SX",
+    1: "S1", 
+    2: "S2",
+    3: "F1",
+    4: "F2",
+    5: "F3"
+}
+
+# Fixed directory paths
+STANDARD_FOLDER = "/home/cnc/linuxcnc/configs/xzacw/gcode"
+MAIN_FOLDER = "/home/cnc/linuxcnc/configs/xzacw"
+
+
+def create_eslh_step(file_type, read_count):
+    """Step 1: create the new ESLH file and add it to the aggregate; returns True on success"""
+    eslh_output_dir = os.path.join(STANDARD_FOLDER, "StandardDimentions", file_type)
+    print("Step 1: Creating ESLH file...")
+    
+    # Get existing ESLH files before creation
+    existing_eslh_files = glob.glob(os.path.join(eslh_output_dir, f"{file_type}-ESLH-*.txt"))
+    
+    # Create ESLH file
+    create_eslah(STANDARD_FOLDER, file_type, read_count)
+    
+    # Wait a moment for file system to update
+    time.sleep(0.5)
+    
+    # Check if new ESLH file was created
+    new_eslh_files = glob.glob(os.path.join(eslh_output_dir, f"{file_type}-ESLH-*.txt"))
+    
+    if len(new_eslh_files) <= len(existing_eslh_files):
+        print("ERROR: No new ESLH file was created!")
+        return False
+    
+    # Get the newly created file
+    latest_eslh_file = get_latest_eslh_file(eslh_output_dir, file_type)
+    if not latest_eslh_file or not os.path.exists(latest_eslh_file):
+        print("ERROR: Could not find the newly created ESLH file!")
+        return False
+    print(f"ESLH file created successfully: {latest_eslh_file}")
+    
+    # Verify file has content
+    file_size = os.path.getsize(latest_eslh_file)
+    if file_size == 0:
+        print("ERROR: ESLH file is empty!")
+        return False
+        
+    print(f"ESLH file size: {file_size} bytes")
+    
+    # Append the new profile to the running aggregate (parsed once, see eslah_cache.py)
+    add_file(file_type, latest_eslh_file, eslh_output_dir)
+    return True
+
+
 def main():
     if len(sys.argv) != 3:
         print("Usage: python3 eslah_action.py <file_type> <read_count>")
@@ -52,60 +109,14 @@ def main():
     file_type_num = int(sys.argv[1])  # P value: file type as number
     read_count = int(sys.argv[2])     # Q value: read count
     
-    # Map numeric file type to string
-    file_type_map = {
-        0: "SX",
-        1: "S1", 
-        2: "S2",
-        3: "F1",
-        4: "F2",
-        5: "F3"
-    }
-    
-    file_type = file_type_map.get(file_type_num, "F2")  # Default to F2 if invalid
+    file_type = FILE_TYPE_MAP.get(file_type_num, "F2")  # Default to F2 if invalid
     
     print(f"eslah Action: file_type={file_type}, read_count={read_count}")
     
-    # Fixed directory paths
-    standard_folder = "/home/cnc/linuxcnc/configs/xzacw/gcode"
-    main_folder = "/home/cnc/linuxcnc/configs/xzacw"
-    eslh_output_dir = os.path.join(standard_folder, "StandardDimentions", file_type)
-    
     try:
         # Step 1: Create ESLH file (only if Q > 0)
         if read_count > 0:
-            print("Step 1: Creating ESLH file...")
-            
-            # Get existing ESLH files before creation
-            existing_eslh_files = glob.glob(os.path.join(eslh_output_dir, f"{file_type}-ESLH-*.txt"))
-            
-            # Create ESLH file
-            create_eslah(standard_folder, file_type, read_count)
-            
-            # Wait a moment for file system to update
-            time.sleep(0.5)
-            
-            # Check if new ESLH file was created
-            new_eslh_files = glob.glob(os.path.join(eslh_output_dir, f"{file_type}-ESLH-*.txt"))
-            
-            if len(new_eslh_files) <= len(existing_eslh_files):
-                print("ERROR: No new ESLH file was created!")
-                return 1
-            
-            # Get the newly created file
-            latest_eslh_file = get_latest_eslh_file(eslh_output_dir, file_type)
-            if latest_eslh_file and os.path.exists(latest_eslh_file):
-                print(f"ESLH file created successfully: {latest_eslh_file}")
-                
-                # Verify file has content
-                file_size = os.path.getsize(latest_eslh_file)
-                if file_size == 0:
-                    print("ERROR: ESLH file is empty!")
-                    return 1
-                    
-                print(f"ESLH file size: {file_size} bytes")
-            else:
-                print("ERROR: Could not find the newly created ESLH file!")
+            if not create_eslh_step(file_type, read_count):
                 return 1
         else:
             print("Skipping ESLH creation (Q=0)")
@@ -113,15 +124,12 @@ def main():
         # Step 2: Create CNC code (always run if P is valid, even if Q=0)
         print("Step 2: Creating CNC code...")
         
-        # Fixed parameters as you specified
-        stepsize = 0.2
-        maxfeed = 750
-        savefilename = os.path.join(main_folder, f"{file_type.lower()}.ngc")
-        IsReolix = False
-        x_steps = 6
+        # Generator parameters from lathe.ini [GENERATOR] (stepsize 0.2, maxfeed 750, x_steps 6)
+        params = get_generator_params()
+        savefilename = os.path.join(MAIN_FOLDER, f"{file_type.lower()}.ngc")
         
-        # Create CNC code
-        success = create_CNC_code(file_type, stepsize, maxfeed, savefilename, IsReolix, x_steps)
+        # Create CNC code in the staging area and swap it in atomically
+        success = generate_program(file_type, params, savefilename)
         
         if success:
             # Verify CNC file was created
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+feed_optimizer.py - Axis-limit-aware inverse-time feeds for generated programs
+
+create_CNC_code caps every g93 block at f[maxfeed] with a hand ramp at both
+ends of the profile. This post-processing stage computes the fastest feasible
+inverse-time F per block from the joint limits in lathe.ini. xzacw uses
+identity kinematics, so X/Z/C map to JOINT_0/JOINT_1/JOINT_2 directly.
+
+Each block must keep every joint under MAX_VELOCITY, and speed changes
+between blocks (including direction changes at the junctions) must stay
+under MAX_ACCELERATION, starting and ending each g93 run at rest. Junction
+speeds come from a forward and a backward pass over the blocks (as in a
+trajectory planner) and each block gets its trapezoid time t; F = 60 / t.
+
+Settings in lathe.ini:
+    [FEED_OPTIMIZER]
+    VELOCITY_FRACTION = 0.8        (use this fraction of the joint limits)
+    ACCELERATION_FRACTION = 0.8
+    MAX_INVERSE_FEED = 0           (optional process cap on F, 0 = none)
+
+Usage:
+    python3 feed_optimizer.py <program.ngc> [output_dir]
+Writes <output_dir>/<program>.ngc (same o<sub> name, default ./optimized)
+and <output_dir>/<program>_feed_report.csv
+"""
+
+import os
+import re
+import sys
+import csv
+
+import numpy as np
+
+from ini_config import IniConfig
+from segment_table import parse_program, AXES
+
+# xzacw identity kinematics: axis letter -> joint section in lathe.ini
+AXIS_JOINTS = {"x": "JOINT_0", "z": "JOINT_1", "c": "JOINT_2"}
+FEED_WORD = re.compile(r'f\s*(\[[^\]]*\]|[-+]?[\d.]+)', re.IGNORECASE)
+
+
+def read_joint_limits(ini=None):
+    """Velocity and acceleration limit per optimized axis (units per second)"""
+    ini = ini or IniConfig()
+    vel_fraction = ini.find_float("FEED_OPTIMIZER", "VELOCITY_FRACTION", 0.8)
+    acc_fraction = ini.find_float("FEED_OPTIMIZER", "ACCELERATION_FRACTION", 0.8)
+    limits = {}
+    for axis, joint in AXIS_JOINTS.items():
+        velocity = ini.find_float(joint, "MAX_VELOCITY")
+        acceleration = ini.find_float(joint, "MAX_ACCELERATION")
+        # a guessed limit would give feeds the machine cannot follow
+        for key, value in (("MAX_VELOCITY", velocity), ("MAX_ACCELERATION", acceleration)):
+            if value is None or value <= 0:
+                raise ValueError(f"[{joint}] {key} missing or not positive in {ini.ini_path}")
+        limits[axis] = (velocity * vel_fraction, acceleration * acc_fraction)
+    max_feed = ini.find_float("FEED_OPTIMIZER", "MAX_INVERSE_FEED", 0.0)
+    return limits, max_feed
+
+
+def runs_of_blocks(line_index):
+    """Start/end (exclusive) of consecutive g93 blocks; a run ends at rest"""
+    if len(line_index) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(line_index) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(line_index)]))
+    return list(zip(starts, ends))
+
+
+def _trapezoid_time(length, v_start, v_end, v_max):
+    """Time to cover length with accel 1, starting/ending at the given speeds"""
+    v_peak = np.sqrt((2.0 * length + v_start ** 2 + v_end ** 2) / 2.0)
+    if v_peak <= v_max:
+        return (v_peak - v_start) + (v_peak - v_end), False
+    d_ramps = (2.0 * v_max ** 2 - v_start ** 2 - v_end ** 2) / 2.0
+    return (v_max - v_start) + (v_max - v_end) + (length - d_ramps) / v_max, True
+
+
+def optimize_times(delta, limits, max_feed=0.0, runs=None):
+    """Minimum feasible block times; returns (times, limiting constraint per block)
+
+    Axis moves are scaled by 1/MAX_ACCELERATION so every axis has unit
+    acceleration, and block length is the largest scaled axis move: a path
+    acceleration of 1 then keeps every joint inside its limit. Junction
+    speeds are limited by the neighbouring block speeds, by the direction
+    change at the junction and by forward/backward v^2 = v0^2 + 2 L passes
+    from rest at both ends of a g93 run; each block takes its trapezoid time.
+    """
+    axes = list(limits)
+    signed = delta[:, [AXES.index(a) for a in axes]]
+    vmax = np.array([limits[a][0] for a in axes])
+    amax = np.array([limits[a][1] for a in axes])
+    n = len(signed)
+    times = np.zeros(n)
+    reason = np.array([""] * n, dtype=object)
+    runs = runs if runs is not None else [(0, n)]
+
+    scaled = signed / amax
+    length = np.abs(scaled).max(axis=1) if n else np.zeros(0)
+
+    for run_start, run_end in runs:
+        # zero length blocks are dropped by the motion planner
+        blocks = [i for i in range(run_start, run_end) if length[i] > 1e-12]
+        if not blocks:
+            continue
+        L = length[blocks]
+        direction = scaled[blocks] / L[:, None]
+
+        # block speed limit from the joint velocities (and the optional F cap)
+        axis_speed = vmax * L[:, None] / np.maximum(np.abs(signed[blocks]), 1e-12)
+        s_max = axis_speed.min(axis=1)
+        vel_axis = axis_speed.argmin(axis=1)
+        capped = np.zeros(len(blocks), dtype=bool)
+        if max_feed > 0:
+            cap = L * max_feed / 60.0
+            capped = cap < s_max
+            s_max = np.minimum(s_max, cap)
+
+        # junction speeds: w[k] between block k-1 and k, rest at both ends
+        w = np.zeros(len(blocks) + 1)
+        corner = np.zeros(len(blocks) + 1, dtype=bool)
+        for k in range(1, len(blocks)):
+            w[k] = min(s_max[k - 1], s_max[k])
+            turn = np.abs(direction[k] - direction[k - 1]).max()
+            if turn > 1e-12:
+                # velocity jump w*turn has to fit in a ramp over the shorter half block
+                corner_speed = np.sqrt(min(L[k - 1], L[k])) / turn
+                if corner_speed < w[k]:
+                    w[k] = corner_speed
+                    corner[k] = True
+        for k in range(len(blocks)):
+            w[k + 1] = min(w[k + 1], np.sqrt(w[k] ** 2 + 2.0 * L[k]))
+        for k in range(len(blocks) - 1, -1, -1):
+            w[k] = min(w[k], np.sqrt(w[k + 1] ** 2 + 2.0 * L[k]))
+
+        for k, i in enumerate(blocks):
+            t, cruising = _trapezoid_time(L[k], w[k], w[k + 1], s_max[k])
+            times[i] = t
+            if cruising:
+                reason[i] = "feed cap" if capped[k] else f"vel {axes[vel_axis[k]].upper()}"
+            else:
+                acc_axis = axes[int(np.abs(direction[k]).argmax())].upper()
+                reason[i] = f"acc {acc_axis}" + (" (corner)" if corner[k] or corner[k + 1] else "")
+    return times, reason
+
+
+def optimize_program(program_path, output_dir=None, ini=None):
+    """Write the optimized program and report; returns (old seconds, new seconds)"""
+    limits, max_feed = read_joint_limits(ini)
+    table = parse_program(program_path)
+    if len(table) == 0:
+        print(f"FEEDOPT: No g93 blocks in {program_path}")
+        return None
+
+    delta = table.delta
+    times, reason = optimize_times(delta, limits, max_feed, runs_of_blocks(table.line_index))
+    zero = table.is_zero_length()
+    old_times = table.block_times()
+    new_feed = np.where(zero, table.feed, 60.0 / np.where(times > 0, times, 1.0))
+
+    output_dir = output_dir or os.path.join(os.path.dirname(os.path.abspath(program_path)), "optimized")
+    os.makedirs(output_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(program_path))[0]
+    out_program = os.path.join(output_dir, f"{name}.ngc")
+    out_report = os.path.join(output_dir, f"{name}_feed_report.csv")
+
+    lines = list(table.lines)
+    for row, line_no in enumerate(table.line_index):
+        if zero[row]:
+            continue
+        lines[line_no] = FEED_WORD.sub(f"f[{new_feed[row]:.5f}]", lines[line_no], count=1)
+    tmp_program = out_program + ".tmp"
+    with open(tmp_program, "w") as f:
+        f.writelines(lines)
+    os.replace(tmp_program, out_program)
+
+    with open(out_report, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["line", "dx", "dz", "dc", "f_old", "f_new", "t_old_s", "t_new_s", "limited_by"])
+        for row, line_no in enumerate(table.line_index):
+            dx, dz, dc = (delta[row, AXES.index(a)] for a in "xzc")
+            t_new = 0.0 if zero[row] else times[row]
+            writer.writerow([line_no + 1, f"{dx:.5f}", f"{dz:.5f}", f"{dc:.5f}",
+                             f"{table.feed[row]:.5f}", f"{new_feed[row]:.5f}",
+                             f"{old_times[row]:.4f}", f"{t_new:.4f}",
+                             "zero length" if zero[row] else reason[row]])
+
+    old_total = old_times[~zero].sum()
+    new_total = times[~zero].sum()
+    if table.feed_uses_param.any():
+        print("FEEDOPT: Note - original feeds used #parameters; optimized feeds are absolute")
+    print(f"FEEDOPT: {name}: {len(table)} blocks, profile time per pass {old_total:.2f}s -> {new_total:.2f}s")
+    counts = {}
+    for r in reason[~zero]:
+        counts[r] = counts.get(r, 0) + 1
+    print(f"FEEDOPT: Limited by: {', '.join(f'{k} x{v}' for k, v in sorted(counts.items()))}")
+    print(f"FEEDOPT: Wrote {out_program} and {out_report}")
+    return old_total, new_total
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print(__doc__)
+        return 1
+    output_dir = sys.argv[2] if len(sys.argv) == 3 else None
+    try:
+        result = optimize_program(sys.argv[1], output_dir)
+    except (ValueError, OSError) as e:
+        print(f"FEEDOPT: Error: {e}")
+        return 1
+    return 0 if result else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
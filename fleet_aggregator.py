@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fleet_aggregator.py - Fleet-wide machine state from fleet_publisher deltas
+
+Receives the UDP deltas of every machine, keeps the merged state and a
+bounded change history per machine and serves them over HTTP. Readers only
+get the cached JSON snapshot (rebuilt once per change), so any number of
+dashboards costs the grinders nothing.
+
+HTTP (JSON):
+    /snapshot                    all machines: state, last seen, stale flag
+    /snapshot/<machine>          one machine
+    /history/<machine>[?since=t] changes of one machine after unix time t
+
+A machine is "stale" after a sequence gap until its next keyframe, and
+"offline" when nothing was received for OFFLINE_SECONDS.
+
+Settings in lathe.ini (on the aggregator host):
+    [FLEET]
+    UDP_PORT = 8764
+    HTTP_PORT = 8765
+    HISTORY = 5000               (changes kept per machine)
+    OFFLINE_SECONDS = 90
+
+Usage:
+    python3 fleet_aggregator.py serve
+    python3 fleet_aggregator.py simulate [machines] [seconds]   (aggregator + simulated machines on this host)
+"""
+
+import sys
+import json
+import time
+import random
+import socket
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from ini_config import IniConfig
+from fleet_publisher import FleetPublisher, DEFAULT_PORT
+
+
+class MachineState:
+    def __init__(self, machine_id, history_size):
+        self.machine_id = machine_id
+        self.values = {}
+        self.history = deque(maxlen=history_size)
+        self.seq = 0
+        self.last_seen = 0.0
+        self.stale = True
+        self.lost = 0
+
+    def apply(self, message, received_at):
+        seq = int(message.get("seq", 0))
+        keyframe = bool(message.get("key"))
+        if seq <= self.seq and not keyframe and seq > 1:
+            return False  # duplicate or reordered datagram
+        if keyframe:
+            self.values = {}
+            self.stale = False
+        elif self.seq and seq != self.seq + 1:
+            # publisher restarted (seq back to 1) or datagrams were lost
+            if seq > self.seq:
+                self.lost += seq - self.seq - 1
+            self.stale = True
+        changes = message.get("d", {})
+        self.values.update(changes)
+        self.seq = seq
+        self.last_seen = received_at
+        self.history.append((float(message.get("t", received_at)), changes))
+        return True
+
+    def to_dict(self, now, offline_seconds):
+        return {
+            "values": self.values,
+            "last_seen": round(self.last_seen, 3),
+            "stale": self.stale,
+            "offline": now - self.last_seen > offline_seconds,
+            "lost": self.lost,
+        }
+
+
+class FleetAggregator:
+    def __init__(self, udp_port=DEFAULT_PORT, history_size=5000, offline_seconds=90.0):
+        self.udp_port = udp_port
+        self.history_size = history_size
+        self.offline_seconds = offline_seconds
+        self.machines = {}
+        self.lock = threading.Lock()
+        self.version = 0
+        self._cache = (None, 0.0, b"")  # version, built at, JSON
+
+    @classmethod
+    def from_ini(cls, ini=None):
+        ini = ini or IniConfig()
+        return cls(ini.find_int("FLEET", "UDP_PORT", DEFAULT_PORT),
+                   ini.find_int("FLEET", "HISTORY", 5000),
+                   ini.find_float("FLEET", "OFFLINE_SECONDS", 90.0))
+
+    def handle_datagram(self, data, received_at=None):
+        received_at = received_at or time.time()
+        try:
+            message = json.loads(data.decode())
+            machine_id = str(message["m"])
+        except (ValueError, KeyError, UnicodeDecodeError):
+            return False
+        with self.lock:
+            machine = self.machines.get(machine_id)
+            if machine is None:
+                machine = self.machines[machine_id] = MachineState(machine_id, self.history_size)
+            if machine.apply(message, received_at):
+                self.version += 1
+                return True
+        return False
+
+    def receive_forever(self, sock=None):
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("", self.udp_port))
+        print(f"FLEET: Receiving machine updates on UDP {self.udp_port}")
+        while True:
+            data, _ = sock.recvfrom(65535)
+            self.handle_datagram(data)
+
+    def snapshot_json(self):
+        """Fleet snapshot, rebuilt only when state changed (or offline flags may have)"""
+        now = time.time()
+        version, built_at, body = self._cache
+        if version == self.version and now - built_at < 1.0:
+            return body
+        with self.lock:
+            version = self.version
+            fleet = {m_id: m.to_dict(now, self.offline_seconds) for m_id, m in self.machines.items()}
+            body = json.dumps({"time": round(now, 3), "machines": fleet}, sort_keys=True).encode()
+        self._cache = (version, now, body)
+        return body
+
+    def machine_json(self, machine_id):
+        with self.lock:
+            machine = self.machines.get(machine_id)
+            if machine is None:
+                return None
+            return json.dumps(machine.to_dict(time.time(), self.offline_seconds)).encode()
+
+    def history_json(self, machine_id, since=0.0):
+        with self.lock:
+            machine = self.machines.get(machine_id)
+            if machine is None:
+                return None
+            changes = [{"t": t, "d": d} for t, d in machine.history if t > since]
+        return json.dumps({"machine": machine_id, "changes": changes}).encode()
+
+
+def make_handler(aggregator):
+    class FleetRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            body = None
+            if parts == ["snapshot"]:
+                body = aggregator.snapshot_json()
+            elif len(parts) == 2 and parts[0] == "snapshot":
+                body = aggregator.machine_json(parts[1])
+            elif len(parts) == 2 and parts[0] == "history":
+                try:
+                    since = float(parse_qs(url.query).get("since", ["0"])[0])
+                except ValueError:
+                    since = 0.0
+                body = aggregator.history_json(parts[1], since)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # many polling readers: keep the console quiet
+
+    return FleetRequestHandler
+
+
+def serve(aggregator, http_port):
+    threading.Thread(target=aggregator.receive_forever, daemon=True).start()
+    server = ThreadingHTTPServer(("", http_port), make_handler(aggregator))
+    print(f"FLEET: Serving snapshots on http://0.0.0.0:{http_port}/snapshot")
+    server.serve_forever()
+
+
+def simulate_machine(index, port, seconds, stop):
+    """One simulated grinder: a part every few seconds, occasional touchoff/wear edits"""
+    publisher = FleetPublisher(("127.0.0.1", port), f"sim-{index + 1}", keyframe_seconds=10.0)
+    state = {"total_machined": random.randint(0, 500), "touchoff": 0.5,
+             "workpiece": random.choice(["SX", "S1", "S2", "F1", "F2", "F3"]), "eslah": False}
+    for tool in ["SX", "S1", "S2", "F1", "F2", "F3"]:
+        state[f"wear_{tool}"] = round(random.uniform(0.0003, 0.001), 5)
+    end = time.time() + seconds
+    while time.time() < end and not stop.is_set():
+        if random.random() < 0.3:
+            state["total_machined"] += 1
+        if random.random() < 0.05:
+            state["touchoff"] = round(state["touchoff"] + random.uniform(-0.002, 0.002), 4)
+        if random.random() < 0.02:
+            state["eslah"] = not state["eslah"]
+        publisher.publish(state)
+        time.sleep(0.5)
+    publisher.close()
+
+
+def simulate(machine_count, seconds, udp_port, http_port):
+    aggregator = FleetAggregator(udp_port)
+    threading.Thread(target=aggregator.receive_forever, daemon=True).start()
+    server = ThreadingHTTPServer(("127.0.0.1", http_port), make_handler(aggregator))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"FLEET: Simulating {machine_count} machine(s) for {seconds}s, "
+          f"snapshot at http://127.0.0.1:{http_port}/snapshot")
+
+    stop = threading.Event()
+    machines = [threading.Thread(target=simulate_machine, args=(i, udp_port, seconds, stop), daemon=True)
+                for i in range(machine_count)]
+    for thread in machines:
+        thread.start()
+    try:
+        for thread in machines:
+            thread.join()
+    except KeyboardInterrupt:
+        stop.set()
+    time.sleep(0.2)
+    snapshot = json.loads(aggregator.snapshot_json())
+    for machine_id, machine in sorted(snapshot["machines"].items()):
+        values = machine["values"]
+        print(f"  {machine_id}: total_machined={values.get('total_machined')} "
+              f"touchoff={values.get('touchoff')} stale={machine['stale']} lost={machine['lost']}")
+    server.shutdown()
+    return len(snapshot["machines"]) == machine_count
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        # the aggregator host usually has no lathe.ini: the [FLEET] defaults apply
+        ini = IniConfig()
+        http_port = ini.find_int("FLEET", "HTTP_PORT", 8765)
+        if command == "serve":
+            serve(FleetAggregator.from_ini(ini), http_port)
+        elif command == "simulate":
+            machine_count = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+            seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+            udp_port = ini.find_int("FLEET", "UDP_PORT", DEFAULT_PORT)
+            return 0 if simulate(machine_count, seconds, udp_port, http_port) else 1
+        else:
+            print(__doc__)
+            return 1
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"FLEET: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
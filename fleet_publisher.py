@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fleet_publisher.py - Push machine state deltas to the fleet aggregator
+
+Used by myui_handler: the handler passes the values it already owns
+(total_machined, touchoff, wear compensations, eslah, workpiece type) and
+only the keys that changed since the last message are sent as one small
+UDP datagram. A full keyframe is sent every KEYFRAME_SECONDS so the
+aggregator recovers from lost datagrams or its own restart. Nothing here
+reads HAL.
+
+Message (JSON):
+    {"m": machine id, "seq": n, "t": unix time, "key": true|false, "d": {changed values}}
+
+Settings in lathe.ini:
+    [FLEET]
+    AGGREGATOR = 192.168.1.10:8764      (empty = publishing disabled)
+    MACHINE_ID = grinder-1              (default: host name)
+    KEYFRAME_SECONDS = 30
+
+Usage:
+    python3 fleet_publisher.py send <key>=<value> ...     (one manual update)
+"""
+
+import sys
+import json
+import time
+import socket
+
+from ini_config import IniConfig
+
+DEFAULT_PORT = 8764
+MAX_DATAGRAM = 8192
+
+
+def parse_address(text, default_port=DEFAULT_PORT):
+    """'host:port' or 'host' -> (host, port)"""
+    host, _, port = text.strip().rpartition(":")
+    if not host:
+        return text.strip(), default_port
+    return host, int(port)
+
+
+class FleetPublisher:
+    def __init__(self, aggregator, machine_id=None, keyframe_seconds=30.0):
+        self.address = parse_address(aggregator) if isinstance(aggregator, str) else aggregator
+        self.machine_id = machine_id or socket.gethostname()
+        self.keyframe_seconds = keyframe_seconds
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sent = {}
+        self.seq = 0
+        self.last_keyframe = 0.0
+
+    @classmethod
+    def from_ini(cls, ini=None):
+        """Publisher configured from lathe.ini [FLEET]; None when not configured"""
+        ini = ini or IniConfig()
+        aggregator = ini.find("FLEET", "AGGREGATOR", "")
+        if not aggregator:
+            return None
+        return cls(aggregator, ini.find("FLEET", "MACHINE_ID", None),
+                   ini.find_float("FLEET", "KEYFRAME_SECONDS", 30.0))
+
+    def publish(self, state, now=None):
+        """Send the changed keys (or a keyframe); returns the number of keys sent"""
+        now = now if now is not None else time.time()
+        keyframe = now - self.last_keyframe >= self.keyframe_seconds
+        if keyframe:
+            changes = dict(state)
+        else:
+            changes = {k: v for k, v in state.items() if k not in self.sent or self.sent[k] != v}
+            if not changes:
+                return 0
+
+        self.seq += 1
+        message = json.dumps({"m": self.machine_id, "seq": self.seq, "t": round(now, 3),
+                              "key": keyframe, "d": changes}, separators=(",", ":")).encode()
+        if len(message) > MAX_DATAGRAM:
+            print(f"FLEET: Warning - message of {len(message)} bytes not sent")
+            return 0
+        try:
+            self.sock.sendto(message, self.address)
+        except OSError as e:
+            # aggregator down or network unreachable: retry the keys next time
+            print(f"FLEET: Send failed: {e}")
+            return 0
+        self.sent.update(changes)
+        if keyframe:
+            self.last_keyframe = now
+        return len(changes)
+
+    def close(self):
+        self.sock.close()
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != "send":
+        print(__doc__)
+        return 1
+    publisher = FleetPublisher.from_ini()
+    if publisher is None:
+        print("FLEET: [FLEET] AGGREGATOR not set in lathe.ini")
+        return 1
+    state = {}
+    for item in sys.argv[2:]:
+        key, _, value = item.partition("=")
+        try:
+            state[key] = float(value)
+        except ValueError:
+            state[key] = value
+    # a manual update is always a full message for the given keys
+    publisher.last_keyframe = time.time()
+    count = publisher.publish(state)
+    print(f"FLEET: Sent {count} value(s) as {publisher.machine_id}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
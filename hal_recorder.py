@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+hal_recorder.py - Low-overhead HAL telemetry recorder with memory-mapped ring files
+
+Samples a set of HAL pins/signals at a fixed rate into a fixed-record ring
+file, so a bad part can be investigated hours later without halscope.
+
+Ring file layout:
+    4096 byte header: magic, version, channel count, capacity, records written,
+                      sample rate, channel names (JSON)
+    capacity records: float64 time + float64 per channel
+
+Settings in lathe.ini:
+    [RECORDER]
+    RATE_HZ = 100
+    CAPACITY = 360000            (records per ring file, 1 h at 100 Hz)
+    DIR = /home/cnc/linuxcnc/configs/xzacw/telemetry
+    PINS = spindle-rpm joint.0.f-error ...
+
+Usage:
+    python3 hal_recorder.py record [name]          (needs the LinuxCNC hal module)
+    python3 hal_recorder.py info <ring file>
+    python3 hal_recorder.py dump <ring file> [seconds] [out.csv]
+
+Reader API (zero copy, numpy views on the memory map):
+    ring = RingReader("telemetry/production.ring")
+    for t, values in ring.segments():       # oldest first, at most two views
+        ...
+    t, rpm = ring.channel("spindle-rpm")[-1]
+"""
+
+import os
+import sys
+import json
+import time
+
+import numpy as np
+
+from ini_config import IniConfig
+
+MAGIC = b"HALRING1"
+VERSION = 1
+HEADER_SIZE = 4096
+# header words (uint64): 0 magic, 1 version, 2 channels, 3 capacity, 4 records written
+# float64 word 5: sample rate; JSON channel names from byte 64
+NAMES_OFFSET = 64
+
+DEFAULT_DIR = "/home/cnc/linuxcnc/configs/xzacw/telemetry"
+DEFAULT_PINS = [
+    "spindle-rpm",
+    "joint.0.f-error", "joint.1.f-error", "joint.2.f-error", "joint.3.f-error",
+    "gladevcp.total_machined", "gladevcp.touchoff_display-f",
+    "lcec.0.DI1.din-0", "lcec.0.DI1.din-1", "lcec.0.DI1.din-2", "lcec.0.DI1.din-3",
+]
+
+
+def record_dtype(channel_count):
+    return np.dtype([("t", "<f8"), ("v", "<f8", (channel_count,))])
+
+
+class RingWriter:
+    """Fixed-record ring file; the header write counter is updated after each record"""
+
+    def __init__(self, path, channels, capacity, rate_hz):
+        self.path = path
+        self.channels = list(channels)
+        self.capacity = int(capacity)
+        self.dtype = record_dtype(len(self.channels))
+        names = json.dumps(self.channels).encode()
+        if NAMES_OFFSET + len(names) > HEADER_SIZE:
+            raise ValueError("too many channels for the ring header")
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        size = HEADER_SIZE + self.capacity * self.dtype.itemsize
+        with open(path, "wb") as f:
+            f.truncate(size)
+
+        self.header = np.memmap(path, dtype="<u8", mode="r+", shape=(HEADER_SIZE // 8,))
+        raw = self.header.view(np.uint8)
+        raw[:8] = np.frombuffer(MAGIC, dtype=np.uint8)
+        self.header[1] = VERSION
+        self.header[2] = len(self.channels)
+        self.header[3] = self.capacity
+        self.header[4] = 0
+        self.header.view("<f8")[5] = rate_hz
+        raw[NAMES_OFFSET:NAMES_OFFSET + len(names)] = np.frombuffer(names, dtype=np.uint8)
+
+        self.records = np.memmap(path, dtype=self.dtype, mode="r+", offset=HEADER_SIZE,
+                                 shape=(self.capacity,))
+        self.written = 0
+
+    def append(self, timestamp, values):
+        slot = self.written % self.capacity
+        self.records["t"][slot] = timestamp
+        self.records["v"][slot] = values
+        self.written += 1
+        self.header[4] = self.written
+
+    def flush(self):
+        self.records.flush()
+        self.header.flush()
+
+
+class RingReader:
+    """Read-only view of a ring file; every returned array is a view on the mmap"""
+
+    def __init__(self, path):
+        self.path = path
+        header = np.memmap(path, dtype="<u8", mode="r", shape=(HEADER_SIZE // 8,))
+        raw = header.view(np.uint8)
+        if raw[:8].tobytes() != MAGIC:
+            raise ValueError(f"{path} is not a HAL ring file")
+        self.header = header
+        self.capacity = int(header[3])
+        self.rate_hz = float(header.view("<f8")[5])
+        names = raw[NAMES_OFFSET:].tobytes().split(b"\0", 1)[0]
+        self.channels = json.loads(names.decode())
+        self.records = np.memmap(path, dtype=record_dtype(len(self.channels)), mode="r",
+                                 offset=HEADER_SIZE, shape=(self.capacity,))
+
+    @property
+    def written(self):
+        return int(self.header[4])
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def segments(self):
+        """(t, values) view pairs in time order; two pairs once the ring has wrapped"""
+        written = self.written
+        if written <= self.capacity:
+            parts = [self.records[:written]]
+        else:
+            head = written % self.capacity
+            parts = [self.records[head:], self.records[:head]]
+        return [(p["t"], p["v"]) for p in parts if len(p)]
+
+    def channel(self, name):
+        """(t, values) view pairs of one channel (strided views, no copy)"""
+        k = self.channels.index(name)
+        return [(t, v[:, k]) for t, v in self.segments()]
+
+    def window(self, t_start, t_end):
+        """(t, values) views limited to t_start <= t < t_end"""
+        result = []
+        for t, v in self.segments():
+            lo, hi = np.searchsorted(t, [t_start, t_end])
+            if hi > lo:
+                result.append((t[lo:hi], v[lo:hi]))
+        return result
+
+    def last(self, seconds):
+        return self.window(self.newest_time() - seconds, np.inf)
+
+    def newest_time(self):
+        if self.written == 0:
+            return 0.0
+        return float(self.records["t"][(self.written - 1) % self.capacity])
+
+
+class HalRecorder:
+    def __init__(self, name="production"):
+        ini = IniConfig()
+        self.rate_hz = ini.find_float("RECORDER", "RATE_HZ", 100.0)
+        self.capacity = ini.find_int("RECORDER", "CAPACITY", 360000)
+        self.pins = ini.find_list("RECORDER", "PINS", DEFAULT_PINS)
+        record_dir = ini.find("RECORDER", "DIR", DEFAULT_DIR)
+        self.path = os.path.join(record_dir, f"{name}.ring")
+
+        import hal
+        self.get_value = hal.get_value
+        self.missing = set()
+
+    def sample(self):
+        values = np.empty(len(self.pins))
+        for k, name in enumerate(self.pins):
+            try:
+                values[k] = float(self.get_value(name))
+            except Exception as e:
+                if name not in self.missing:
+                    print(f"RECORDER: Warning - cannot read {name}: {e}")
+                    self.missing.add(name)
+                values[k] = np.nan
+        return values
+
+    def run(self):
+        # keep the previous ring for later investigation
+        if os.path.exists(self.path):
+            os.replace(self.path, self.path + ".1")
+        writer = RingWriter(self.path, self.pins, self.capacity, self.rate_hz)
+        print(f"RECORDER: {len(self.pins)} channels at {self.rate_hz} Hz -> {self.path}")
+        period = 1.0 / self.rate_hz
+        next_sample = time.time()
+        next_flush = next_sample + 5.0
+        try:
+            while True:
+                now = time.time()
+                writer.append(now, self.sample())
+                if now >= next_flush:
+                    writer.flush()
+                    next_flush = now + 5.0
+                next_sample += period
+                delay = next_sample - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # fell behind (e.g. machine busy): skip missed slots, keep the grid
+                    next_sample = time.time()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            writer.flush()
+
+
+def print_info(path):
+    ring = RingReader(path)
+    print(f"RECORDER: {path}")
+    print(f"  channels: {', '.join(ring.channels)}")
+    print(f"  rate: {ring.rate_hz} Hz, capacity: {ring.capacity}, records: {len(ring)} "
+          f"(written {ring.written})")
+    segments = ring.segments()
+    if segments:
+        start = segments[0][0][0]
+        end = segments[-1][0][-1]
+        print(f"  span: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))} - "
+              f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(end))}")
+
+
+def dump(path, seconds=None, out_file=None):
+    ring = RingReader(path)
+    parts = ring.last(seconds) if seconds else ring.segments()
+    out = open(out_file, "w") if out_file else sys.stdout
+    try:
+        out.write("time," + ",".join(ring.channels) + "\n")
+        for t, v in parts:
+            np.savetxt(out, np.column_stack((t, v)), delimiter=",", fmt="%.6f")
+    finally:
+        if out_file:
+            out.close()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    command = sys.argv[1]
+    try:
+        if command == "record":
+            HalRecorder(sys.argv[2] if len(sys.argv) > 2 else "production").run()
+        elif command == "info":
+            print_info(sys.argv[2])
+        elif command == "dump":
+            seconds = float(sys.argv[3]) if len(sys.argv) > 3 else None
+            dump(sys.argv[2], seconds, sys.argv[4] if len(sys.argv) > 4 else None)
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError) as e:
+        print(f"RECORDER: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+hal_startup_profiler.py - Time the HAL bring-up and build a concurrent launch plan
+
+lathe.hal runs "loadusr -W lcec_conf ..." and "loadusr -W mb2hal ..." in
+sequence and whb04b.hal adds "loadusr -W xhc-whb04b-6"; each -W blocks
+everything after it until that component is ready, so a slow Modbus open
+on /dev/ttyUSB0 delays the whole start.
+
+The HALFILEs from lathe.ini are parsed into commands, and every command is
+linked to the components whose pins/functions it uses (loadrt/loadusr
+define components, net/setp/sets/linkp/addf use them). From this graph:
+
+    plan     writes one HAL file where the waiting user components start
+             together at the top without -W, and a
+                 loadusr -w python3 hal_startup_profiler.py wait <comp>
+             is inserted right before the first command that needs their
+             pins, so only the dependent part of the bring-up waits.
+             Use it in lathe.ini [HAL] instead of the HALFILEs it replaces.
+    profile  runs the commands one by one with halcmd in a fresh realtime
+             session (LinuxCNC must not be running) and writes the time of
+             each to a CSV, plus the estimated time of the launch plan.
+    graph    prints the components and what depends on them.
+
+Usage:
+    python3 hal_startup_profiler.py graph [lathe.ini]
+    python3 hal_startup_profiler.py plan [lathe.ini] [launch_plan.hal]
+    python3 hal_startup_profiler.py profile [lathe.ini] [hal_profile.csv]
+    python3 hal_startup_profiler.py wait <component> [timeout_seconds]
+"""
+
+import os
+import re
+import sys
+import time
+import shlex
+import subprocess
+
+from ini_config import IniConfig
+
+# user programs whose HAL component name differs from the program name
+KNOWN_COMPONENTS = {"xhc-whb04b-6": "whb"}
+# components that need another one before they load (lcec reads the lcec_conf shared memory)
+KNOWN_DEPENDENCIES = {"lcec": ["lcec_conf"]}
+PIN_COMMANDS = {"net", "setp", "sets", "linkps", "linksp", "linkpp", "addf", "delf", "unlinkp"}
+INI_REFERENCE = re.compile(r'\[([^\]]+)\]([A-Za-z0-9_]+)')
+WAIT_POLL = 0.05
+
+
+class HalCommand:
+    def __init__(self, hal_file, line_number, text, raw=None):
+        self.hal_file = hal_file
+        self.line_number = line_number
+        self.text = text
+        self.raw = raw or text  # before [SECTION]KEY substitution
+        self.words = shlex.split(text, comments=True)
+        self.kind = self.words[0] if self.words else ""
+        self.defines = []     # components created by this command
+        self.uses = set()     # components this command needs
+        self.blocking = False  # loadusr -W / -Wn: waits until the component is ready
+        self.seconds = None
+
+    def __repr__(self):
+        return f"{os.path.basename(self.hal_file)}:{self.line_number}: {self.text}"
+
+
+def substitute_ini(text, ini):
+    """[SECTION]KEY -> value, as halcmd -i does"""
+    def replace(match):
+        value = ini.find(match.group(1), match.group(2))
+        return value if value is not None else match.group(0)
+    return INI_REFERENCE.sub(replace, text)
+
+
+def read_hal_file(path, ini):
+    commands = []
+    with open(path, "r") as f:
+        for number, line in enumerate(f, 1):
+            raw = line.split("#", 1)[0].strip()
+            text = substitute_ini(raw, ini)
+            if text:
+                try:
+                    commands.append(HalCommand(path, number, text, raw))
+                except ValueError as e:
+                    print(f"HALPROF: {path}:{number}: cannot parse ({e})")
+    return commands
+
+
+def mb2hal_component(args, config_dir):
+    """HAL_MODULE_NAME from the mb2hal config file"""
+    for arg in args:
+        if arg.startswith("config="):
+            config = os.path.join(config_dir, arg.split("=", 1)[1])
+            try:
+                with open(config, "r") as f:
+                    for line in f:
+                        if line.strip().startswith("HAL_MODULE_NAME"):
+                            return line.split("=", 1)[1].split(";")[0].strip()
+            except OSError:
+                pass
+    return "mb2hal"
+
+
+def describe_components(command, config_dir):
+    """Fill in what a loadrt/loadusr defines and whether it blocks"""
+    words = command.words
+    if command.kind == "loadrt" and len(words) > 1:
+        module = os.path.basename(words[1])
+        names = [w.split("=", 1)[1] for w in words[2:] if w.startswith("names=")]
+        command.defines = names[0].split(",") if names else [module]
+        command.uses.update(KNOWN_DEPENDENCIES.get(module, []))
+    elif command.kind == "loadusr":
+        i = 1
+        wait_name = None
+        while i < len(words) and words[i].startswith("-"):
+            option = words[i]
+            if option in ("-W", "-Wn"):
+                command.blocking = True
+            if option in ("-Wn", "-n") and i + 1 < len(words):
+                wait_name = words[i + 1]
+                i += 1
+            i += 1
+        if i < len(words):
+            program = os.path.basename(words[i])
+            if wait_name:
+                name = wait_name
+            elif program == "mb2hal":
+                name = mb2hal_component(words[i + 1:], config_dir)
+            else:
+                name = KNOWN_COMPONENTS.get(program, program)
+            command.defines = [name]
+            command.uses.update(KNOWN_DEPENDENCIES.get(program, []))
+
+
+def owner(name, components):
+    """Component owning a pin/function/parameter name (longest matching prefix)"""
+    best = None
+    for component in components:
+        if name == component or name.startswith(component + ".") or name.startswith(component.replace("_", "-") + "."):
+            if best is None or len(component) > len(best):
+                best = component
+    return best
+
+
+def build_graph(hal_files, ini):
+    """Parsed commands of all HALFILEs with their component dependencies"""
+    commands = []
+    for path in hal_files:
+        commands.extend(read_hal_file(path, ini))
+    components = {}
+    for command in commands:
+        describe_components(command, os.path.dirname(os.path.abspath(command.hal_file)))
+        for name in command.defines:
+            components[name] = command
+    for command in commands:
+        if command.kind not in PIN_COMMANDS:
+            continue
+        for word in command.words[1:]:
+            component = owner(word, components)
+            if component and component not in command.defines:
+                command.uses.add(component)
+    return commands, components
+
+
+def hal_files_from_ini(ini):
+    base_dir = os.path.dirname(os.path.abspath(ini.ini_path))
+    return [os.path.join(base_dir, f) for f in ini.findall("HAL", "HALFILE")]
+
+
+def launch_plan(commands, components):
+    """HAL lines: non-blocking starts of the -W user components, waits before first use"""
+    deferred = [c for c in commands if c.kind == "loadusr" and c.blocking]
+    deferred_names = {name: c for c in deferred for name in c.defines}
+    lines = ["# Launch plan written by hal_startup_profiler.py - do not edit, regenerate with:",
+             "#   python3 hal_startup_profiler.py plan",
+             "# user components started together, each waited for before its pins are used"]
+    for command in deferred:
+        words = [w for w in command.words if w not in ("-W", "-Wn")]
+        if "-Wn" in command.words:
+            # keep the component name, drop the wait
+            idx = command.words.index("-Wn")
+            words = command.words[:idx] + ["-n", command.words[idx + 1]] + command.words[idx + 2:]
+        lines.append(f"{shlex.join(words)}    # {os.path.basename(command.hal_file)}:{command.line_number}")
+    lines.append("")
+
+    script = os.path.abspath(__file__)
+    waited = set()
+    current_file = None
+    for command in commands:
+        if command in deferred:
+            continue
+        if command.hal_file != current_file:
+            current_file = command.hal_file
+            lines.append(f"# ---- {os.path.basename(current_file)}")
+        for name in sorted(command.uses):
+            if name in deferred_names and name not in waited:
+                lines.append(f"loadusr -w python3 {script} wait {name}")
+                waited.add(name)
+        lines.append(command.raw)
+    # components nobody uses in these files are still waited for once at the end
+    for name in deferred_names:
+        if name not in waited:
+            lines.append(f"loadusr -w python3 {script} wait {name}")
+    return lines
+
+
+def estimate_plan_seconds(commands, components):
+    """Sequential time vs. launch plan time from measured command times"""
+    sequential = sum(c.seconds or 0.0 for c in commands)
+    deferred = {name: c for c in commands if c.kind == "loadusr" and c.blocking for name in c.defines}
+    now = 0.0
+    ready_at = {name: c.seconds or 0.0 for name, c in deferred.items()}  # all started at t=0
+    for command in commands:
+        if command.kind == "loadusr" and command.blocking:
+            continue
+        for name in command.uses:
+            if name in ready_at:
+                now = max(now, ready_at[name])
+        now += command.seconds or 0.0
+    for ready in ready_at.values():
+        now = max(now, ready)
+    return sequential, now
+
+
+# ---------------------------
+# halcmd helpers
+# ---------------------------
+def halcmd(*args, timeout=60):
+    return subprocess.run(["halcmd"] + list(args), capture_output=True, text=True, timeout=timeout)
+
+
+def component_ready(name):
+    """Component has called hal_ready(), the state -W waits for (lcec_conf exports no pins)"""
+    result = halcmd("show", "comp", timeout=5)
+    if result.returncode != 0:
+        return False
+    # ID  Type  Name  [PID]  State, e.g. "   72  User  lcec_conf   10380 ready, u1:0 u2:0"
+    for line in result.stdout.splitlines():
+        fields = line.split()
+        if len(fields) >= 4 and fields[2] == name:
+            return "ready" in fields[3:] or "ready," in fields[3:]
+    return False
+
+
+def wait_for_component(name, timeout=30.0):
+    start = time.time()
+    while time.time() - start < timeout:
+        if component_ready(name):
+            print(f"HALPROF: {name} ready after {time.time() - start:.2f}s")
+            return True
+        time.sleep(WAIT_POLL)
+    print(f"HALPROF: Timeout waiting for {name} ({timeout}s)")
+    return False
+
+
+def profile(commands, components, ini, csv_path):
+    """Run every command with halcmd in a fresh realtime session and time it"""
+    if halcmd("list", "comp", timeout=5).returncode == 0:
+        print("HALPROF: HAL is already running - stop LinuxCNC first")
+        return False
+    os.environ.setdefault("INI_FILE_NAME", os.path.abspath(ini.ini_path))
+    subprocess.run(["realtime", "start"], check=True)
+    try:
+        for command in commands:
+            os.chdir(os.path.dirname(os.path.abspath(command.hal_file)))
+            start = time.perf_counter()
+            result = halcmd(*command.words)
+            command.seconds = time.perf_counter() - start
+            flag = "" if result.returncode == 0 else "  FAILED: " + result.stderr.strip()
+            print(f"HALPROF: {command.seconds * 1000.0:9.1f} ms  {command}{flag}")
+    finally:
+        subprocess.run(["halrun", "-U"], capture_output=True)
+
+    with open(csv_path, "w") as f:
+        f.write("file,line,command,seconds,defines,uses\n")
+        for c in commands:
+            text = c.text.replace('"', "'")
+            f.write(f'{os.path.basename(c.hal_file)},{c.line_number},"{text}",{c.seconds or 0.0:.4f},'
+                    f'{" ".join(c.defines)},{" ".join(sorted(c.uses))}\n')
+    sequential, planned = estimate_plan_seconds(commands, components)
+    slowest = sorted(commands, key=lambda c: c.seconds or 0.0, reverse=True)[:5]
+    print(f"HALPROF: Sequential bring-up {sequential:.2f}s, estimated with launch plan {planned:.2f}s")
+    print("HALPROF: Slowest commands:")
+    for c in slowest:
+        print(f"  {c.seconds:.2f}s  {c}")
+    print(f"HALPROF: Wrote {csv_path}")
+    return True
+
+
+def print_graph(commands, components):
+    for name, command in components.items():
+        users = [c for c in commands if name in c.uses]
+        flag = " (blocking -W)" if command.blocking else ""
+        print(f"{name}{flag}: defined at {os.path.basename(command.hal_file)}:{command.line_number}, "
+              f"{len(users)} dependent command(s)")
+        if users:
+            print(f"    first use: {users[0]}")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    command = sys.argv[1]
+    try:
+        if command == "wait":
+            timeout = float(sys.argv[3]) if len(sys.argv) > 3 else 30.0
+            return 0 if wait_for_component(sys.argv[2], timeout) else 1
+
+        ini = IniConfig(sys.argv[2] if len(sys.argv) > 2 else None)
+        commands, components = build_graph(hal_files_from_ini(ini), ini)
+        base_dir = os.path.dirname(os.path.abspath(ini.ini_path))
+        if command == "graph":
+            print_graph(commands, components)
+        elif command == "plan":
+            out_file = sys.argv[3] if len(sys.argv) > 3 else os.path.join(base_dir, "launch_plan.hal")
+            with open(out_file, "w") as f:
+                f.write("\n".join(launch_plan(commands, components)) + "\n")
+            print(f"HALPROF: Wrote {out_file}; in lathe.ini [HAL] replace the HALFILE lines with")
+            print(f"    HALFILE = {os.path.basename(out_file)}")
+        elif command == "profile":
+            csv_path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(base_dir, "hal_profile.csv")
+            return 0 if profile(commands, components, ini, csv_path) else 1
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError, subprocess.SubprocessError) as e:
+        print(f"HALPROF: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
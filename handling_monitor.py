@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+handling_monitor.py - Measure gripper/jack actuation times for the part handling
+
+With position sensors on motion.digital-in-00..02, file.ngc (#85=1) waits on
+them with M66 instead of fixed g4 dwells; the timeouts (#86) should come
+from real actuation times. This userspace HAL component times every command
+edge (DO01_00 gripper, DO01_01 jack) until the matching sensor (Gripper_pos,
+jack_pos) follows and appends it to handling_log.csv. Sensor high = closed,
+as in file.ngc.
+
+The DI inputs Gripper_in/jack_in are operator buttons ORed into the outputs,
+not sensors, so the HAL lines stay commented out in spindle_to_gladevcp.hal
+until the sensors are wired.
+
+HAL (spindle_to_gladevcp.hal, once the sensors exist):
+    loadusr -Wn handling python3 handling_monitor.py run
+    net DO01_00 => handling.gripper-cmd
+    net DO01_01 => handling.jack-cmd
+    net Gripper_pos => handling.gripper-in
+    net jack_pos => handling.jack-in
+Pins out: handling.gripper-seconds, handling.jack-seconds (last time),
+          handling.timeouts (edges not confirmed within LIMIT seconds)
+
+Usage:
+    python3 handling_monitor.py run
+    python3 handling_monitor.py report [handling_log.csv]     (stats and suggested #86)
+"""
+
+import os
+import sys
+import csv
+import time
+
+LOG_FILE = "/home/cnc/linuxcnc/configs/xzacw/handling_log.csv"
+POLL = 0.005
+LIMIT = 10.0          # give up on an edge after this many seconds
+ACTUATORS = ["gripper", "jack"]
+
+
+class Edge:
+    def __init__(self, actuator, closing, start):
+        self.actuator = actuator
+        self.closing = closing
+        self.start = start
+
+
+def append_log(actuator, closing, seconds, confirmed):
+    new_file = not os.path.exists(LOG_FILE)
+    with open(LOG_FILE, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["time", "actuator", "action", "seconds", "confirmed"])
+        writer.writerow([time.strftime('%Y-%m-%d %H:%M:%S'), actuator,
+                         "close" if closing else "open", f"{seconds:.3f}", int(confirmed)])
+
+
+def run():
+    import hal
+
+    comp = hal.component("handling")
+    for name in ACTUATORS:
+        comp.newpin(f"{name}-cmd", hal.HAL_BIT, hal.HAL_IN)
+        comp.newpin(f"{name}-in", hal.HAL_BIT, hal.HAL_IN)
+        comp.newpin(f"{name}-seconds", hal.HAL_FLOAT, hal.HAL_OUT)
+    comp.newpin("timeouts", hal.HAL_S32, hal.HAL_OUT)
+    comp.ready()
+
+    last_cmd = {name: comp[f"{name}-cmd"] for name in ACTUATORS}
+    pending = {}
+    print("HANDLING: Monitoring gripper/jack actuation times")
+    try:
+        while True:
+            now = time.monotonic()
+            for name in ACTUATORS:
+                cmd = comp[f"{name}-cmd"]
+                if cmd != last_cmd[name]:
+                    pending[name] = Edge(name, bool(cmd), now)
+                    last_cmd[name] = cmd
+                edge = pending.get(name)
+                if edge is None:
+                    continue
+                seconds = now - edge.start
+                if bool(comp[f"{name}-in"]) == edge.closing:
+                    comp[f"{name}-seconds"] = seconds
+                    append_log(name, edge.closing, seconds, True)
+                    del pending[name]
+                elif seconds > LIMIT:
+                    comp["timeouts"] += 1
+                    append_log(name, edge.closing, seconds, False)
+                    print(f"HANDLING: {name} {'close' if edge.closing else 'open'} not confirmed in {LIMIT}s")
+                    del pending[name]
+            time.sleep(POLL)
+    except KeyboardInterrupt:
+        pass
+
+
+def report(log_file=LOG_FILE):
+    times = {}
+    failed = 0
+    with open(log_file, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            if row["confirmed"] != "1":
+                failed += 1
+                continue
+            times.setdefault(f"{row['actuator']} {row['action']}", []).append(float(row["seconds"]))
+    if not times:
+        print("HANDLING: No confirmed actuations logged yet")
+        return
+    worst = 0.0
+    for key, values in sorted(times.items()):
+        values.sort()
+        p99 = values[min(len(values) - 1, int(0.99 * len(values)))]
+        worst = max(worst, p99)
+        print(f"  {key:14s} n={len(values):5d} min={values[0]:.3f}s "
+              f"median={values[len(values) // 2]:.3f}s p99={p99:.3f}s max={values[-1]:.3f}s")
+    print(f"HANDLING: {failed} unconfirmed actuation(s)")
+    print(f"HANDLING: Suggested file.ngc timeout #86={max(0.5, round(worst * 1.5, 1))} (1.5 x worst p99)")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if command == "run":
+            run()
+        elif command == "report":
+            report(sys.argv[2] if len(sys.argv) > 2 else LOG_FILE)
+        else:
+            print(__doc__)
+            return 1
+    except (OSError, KeyError, ValueError) as e:
+        print(f"HANDLING: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
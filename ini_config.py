@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ini_config.py - Read settings from lathe.ini for the helper scripts
+
+The M-code scripts run under /home/cnc/anaconda3/bin/python, which does not
+have the linuxcnc module, so this gives them the same find() lookup as
+linuxcnc.ini() using only the standard library.
+"""
+
+import os
+
+DEFAULT_INI = "/home/cnc/linuxcnc/configs/xzacw/lathe.ini"
+
+
+class IniConfig:
+    def __init__(self, ini_path=None, required=False):
+        # LinuxCNC exports the active ini file to everything it starts
+        self.ini_path = ini_path or os.environ.get("INI_FILE_NAME") or DEFAULT_INI
+        self.required = required
+        self.sections = {}
+        self.load()
+
+    def load(self):
+        """Parse the ini file, keeping every value of repeated keys"""
+        self.sections = {}
+        if not os.path.exists(self.ini_path):
+            if self.required:
+                raise FileNotFoundError(f"ini file not found: {self.ini_path}")
+            # tools run off the machine keep working on their defaults
+            print(f"INI: Warning - {self.ini_path} not found, using defaults")
+            return
+        section = None
+        with open(self.ini_path, "r", errors="replace") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or line.startswith(";"):
+                    continue
+                if line.startswith("[") and line.endswith("]"):
+                    section = line[1:-1].strip()
+                    self.sections.setdefault(section, {})
+                    continue
+                if section is None or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                self.sections[section].setdefault(key.strip(), []).append(value.strip())
+
+    def find(self, section, key, default=None):
+        """First value of key in section (same as linuxcnc.ini().find)"""
+        values = self.sections.get(section, {}).get(key)
+        if not values:
+            return default
+        return values[0]
+
+    def findall(self, section, key):
+        """All values of a repeated key, e.g. HALFILE"""
+        return list(self.sections.get(section, {}).get(key, []))
+
+    def find_float(self, section, key, default=None):
+        value = self.find(section, key)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return default
+
+    def find_int(self, section, key, default=None):
+        value = self.find(section, key)
+        try:
+            return int(float(value))
+        except (TypeError, ValueError):
+            return default
+
+    def find_list(self, section, key, default=None):
+        """Whitespace or comma separated list value"""
+        value = self.find(section, key)
+        if value is None:
+            return list(default or [])
+        return [item for item in value.replace(",", " ").split() if item]
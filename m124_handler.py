@@ -8,7 +8,10 @@ Uses existing read_ESLH_values function from the project
 import os
 import sys
 import glob
-from datetime import datetime
+
+from eslah_backup import EslahBackupStore
+from eslah_cache import remove_stale_sidecars
+from eslah_aggregate import pop_files
 
 # Add the path to import your existing functions
 sys.path.append('/home/cnc/linuxcnc/configs/xzacw/gcode')
@@ -35,6 +38,9 @@ class M124Handler:
             4: "F2",
             5: "F3"
         }
+        
+        # Content-addressed backup of removed files (see eslah_backup.py)
+        self.backup_store = EslahBackupStore(self.standard_dimensions_dir)
     
     def get_workpiece_type_from_value(self, workpiece_value):
         """Convert workpiece numeric value to type string"""
@@ -170,18 +176,13 @@ class M124Handler:
             print(f"M124: File number: {file_number}")
             
             try:
-                # Create backup before removal
-                backup_dir = os.path.join(self.standard_dimensions_dir, "backup", workpiece_type)
-                os.makedirs(backup_dir, exist_ok=True)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                backup_file = os.path.join(backup_dir, f"backup_{os.path.basename(file_to_remove)}_{timestamp}")
-                
-                import shutil
-                shutil.copy2(file_to_remove, backup_file)
-                print(f"M124: Backup created: {backup_file}")
+                # Store backup before removal (deduplicated by content hash); the
+                # index is saved first, so M125 can restore it after a crash below
+                self.backup_store.put(file_to_remove, workpiece_type)
                 
                 # Remove the file
                 os.remove(file_to_remove)
+                remove_stale_sidecars(file_to_remove)
                 removed_files.append(os.path.basename(file_to_remove))
                 print(f"M124: SUCCESS - Removed eslah file: {os.path.basename(file_to_remove)}")
                 
@@ -189,6 +190,15 @@ class M124Handler:
                 print(f"M124: ERROR - Failed to remove file {file_to_remove}: {e}")
                 continue
         
+        # Apply the retention budget
+        try:
+            self.backup_store.prune()
+        except Exception as e:
+            print(f"M124: Warning - backup index update failed: {e}")
+        
+        # Pop the removed profiles from the running ESLH aggregate
+        pop_files(workpiece_type, removed_files, workpiece_dir)
+        
         if removed_files:
             # Sort removed files by their numbers in descending order for the message
             removed_files_sorted = sorted(removed_files, key=lambda x: self.get_file_number_from_name(x), reverse=True)
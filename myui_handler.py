@@ -18,6 +18,13 @@ class HandlerClass:
         self.builder = builder
         self.useropts = useropts
 
+        # time every callback before any of them is connected (gladevcp.perf.* pins)
+        self.init_callback_perf()
+
+        # toolpath thumbnails, rendered off the GTK main loop
+        self.preview_renderer = None
+        self.preview_mtimes = {}
+
         # --- widgets (same names as your UI) ---
         self.led_gripper_out = builder.get_object('gripper_out')
         self.led_jack_in = builder.get_object('jack_in')
@@ -61,6 +68,14 @@ class HandlerClass:
         except Exception:
             pass
 
+        # resume point of an aborted series, set by M126 (series_checkpoint.py) and read by file.ngc
+        try:
+            self.halcomp.newpin("resume_valid", hal.HAL_BIT, hal.HAL_IN)
+            for name in ("serie", "pass", "flute", "touchoff", "x", "z", "c", "w"):
+                self.halcomp.newpin(f"resume_{name}", hal.HAL_FLOAT, hal.HAL_IN)
+        except Exception:
+            pass
+
         # eslah button - HALIO_Button with I/O pin
         self.eslah_button = builder.get_object('eslah')
         self.eslah_toggle_state = False
@@ -106,6 +121,8 @@ class HandlerClass:
         self.last_hal_total_machined = 0
         self.last_hal_touchoff = 0.0
 
+        # Profile thumbnail next to the radio buttons
+        self.init_toolpath_preview()
 
         ########wear compensation###########
          # Initialize wear compensation system FIRST
@@ -125,6 +142,9 @@ class HandlerClass:
         GLib.timeout_add(150, self._poll_hal_to_widget)
         GLib.timeout_add(100, self._poll_json_variables)
 
+        # fleet aggregation: push state deltas to the aggregator (lathe.ini [FLEET])
+        self.init_fleet_publisher()
+
         # load variables once at startup
         GLib.idle_add(self.load_variables)
 
@@ -249,6 +269,8 @@ class HandlerClass:
             except Exception as e:
                 print(f"Error updating workpiece spin: {e}")
         
+        self.request_preview(workpiece_type)
+
         # Rest of radio button functionality
         wear_value = self.get_wear_value(workpiece_type)
         if wear_value is None:
@@ -333,18 +355,7 @@ class HandlerClass:
                     self._write_variable_to_file("total_machined", val2)
                 
                 self.last_hal_total_machined = val2
-                if self.total_machined:
-                    try:
-                        # try set_value, fall back to set_label
-                        try:
-                            self.total_machined.set_value(int(val2))
-                        except Exception:
-                            try:
-                                self.total_machined.set_label(str(int(val2)))
-                            except Exception:
-                                pass
-                    except Exception:
-                        pass
+                self.set_total_machined_widget(val2)
         except Exception:
             pass
 
@@ -362,6 +373,131 @@ class HandlerClass:
         return True
         
     
+    def set_total_machined_widget(self, value):
+        """Show total_machined in its widget"""
+        if not self.total_machined:
+            return
+        try:
+            # try set_value, fall back to set_label
+            try:
+                self.total_machined.set_value(int(value))
+            except Exception:
+                try:
+                    self.total_machined.set_label(str(int(value)))
+                except Exception:
+                    pass
+        except Exception:
+            pass
+
+    # ---------------------------
+    # Toolpath preview
+    # ---------------------------
+    def init_toolpath_preview(self):
+        self.preview_image = self.builder.get_object("toolpath_preview")
+        if not self.preview_image:
+            return
+        try:
+            from toolpath_preview import PreviewRenderer
+            self.preview_renderer = PreviewRenderer(deliver=GLib.idle_add)
+        except Exception as e:
+            print(f"[myui_handler] Toolpath preview disabled: {e}")
+            return
+        self.preview_image.connect("map", self.on_preview_map)
+        self.request_preview(self.selected_workpiece_type())
+        # M118 / regen_worker replace <type>.ngc: pick up the new program
+        GLib.timeout_add(2000, self._poll_preview_program)
+
+    def on_preview_map(self, widget):
+        self.request_preview(self.selected_workpiece_type())
+
+    def selected_workpiece_type(self):
+        for name, button in self.radio_buttons.items():
+            if button and button.get_active():
+                return name
+        return "S1"
+
+    def request_preview(self, workpiece_type):
+        # rendering waits until the thumbnail is on screen (on_preview_map)
+        if not self.preview_renderer or not self.preview_image.get_mapped():
+            return
+        program = os.path.join(self.base_dir, f"{workpiece_type.lower()}.ngc")
+        try:
+            self.preview_mtimes[workpiece_type] = os.stat(program).st_mtime_ns
+        except OSError:
+            self.preview_image.set_from_icon_name("image-missing", Gtk.IconSize.DIALOG)
+            return
+        self.preview_renderer.request(workpiece_type, program, self.on_preview_ready)
+
+    def on_preview_ready(self, workpiece_type, png_path):
+        # runs in the GTK main loop (GLib.idle_add); drop results for an old selection
+        if workpiece_type == self.selected_workpiece_type():
+            if png_path:
+                self.preview_image.set_from_file(png_path)
+            else:
+                self.preview_image.set_from_icon_name("image-missing", Gtk.IconSize.DIALOG)
+        return False
+
+    def _poll_preview_program(self):
+        if not self.preview_image.get_mapped():
+            return True
+        workpiece_type = self.selected_workpiece_type()
+        program = os.path.join(self.base_dir, f"{workpiece_type.lower()}.ngc")
+        try:
+            if os.stat(program).st_mtime_ns != self.preview_mtimes.get(workpiece_type):
+                self.request_preview(workpiece_type)
+        except OSError:
+            pass
+        return True
+
+    # ---------------------------
+    # Callback timing
+    # ---------------------------
+    def init_callback_perf(self):
+        self.perf = None
+        try:
+            from callback_perf import PerfMonitor
+            self.perf = PerfMonitor(self.halcomp)
+            names = self.perf.instrument(self)
+            self.perf.start()
+            print(f"[myui_handler] Timing {len(names)} callbacks")
+        except Exception as e:
+            print(f"[myui_handler] Callback timing disabled: {e}")
+
+    # ---------------------------
+    # Fleet publisher
+    # ---------------------------
+    def init_fleet_publisher(self):
+        self.fleet_publisher = None
+        try:
+            from fleet_publisher import FleetPublisher
+            self.fleet_publisher = FleetPublisher.from_ini()
+        except Exception as e:
+            print(f"[myui_handler] Fleet publisher disabled: {e}")
+        if self.fleet_publisher:
+            print(f"[myui_handler] Publishing state as {self.fleet_publisher.machine_id}")
+            GLib.timeout_add(1000, self._publish_fleet_state)
+
+    def fleet_state(self):
+        """Values the handler already owns; no HAL reads"""
+        state = {
+            "total_machined": int(self.last_hal_total_machined),
+            "touchoff": float(self.last_hal_touchoff),
+            "eslah": bool(self.eslah_toggle_state),
+        }
+        state["workpiece"] = self.selected_workpiece_type()
+        for tool in self.radio_buttons:
+            spinbutton = self.builder.get_object(f"{tool}_Wear_Compensation")
+            if spinbutton:
+                state[f"wear_{tool}"] = round(spinbutton.get_value(), 5)
+        return state
+
+    def _publish_fleet_state(self):
+        try:
+            self.fleet_publisher.publish(self.fleet_state())
+        except Exception as e:
+            print(f"[myui_handler] Fleet publish error: {e}")
+        return True
+
     # ---------------------------
     # JSON pipe: M-codes write here, handler picks them up and updates widgets
     # ---------------------------
@@ -522,21 +658,11 @@ class HandlerClass:
         except Exception:
             pass
 
-        # For total_machined: just update widget (M115 will handle HAL pin)
-        try:
-            if self.total_machined:
-                try:
-                    self.total_machined.set_value(int(total_machined))
-                except Exception:
-                    try:
-                        self.total_machined.set_label(str(int(total_machined)))
-                    except Exception:
-                        pass
-        except Exception:
-            pass
-
         # Initialize last values
         self.last_hal_total_machined = total_machined
+
+        # For total_machined: just update widget (M115 will handle HAL pin)
+        self.set_total_machined_widget(total_machined)
         self.last_hal_touchoff = touchoff
         
         # Set flag that variables are loaded (to prevent startup zero overwrite)
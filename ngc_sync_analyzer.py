@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ngc_sync_analyzer.py - Queue flushes of file.ngc per part, and a consolidated program
+
+Every user M-code (M100-M199), every M66 and the immediate outputs M64, M65
+and M68 make task wait until the motion queue is empty, so blending stops
+there. An M66 also stops the interpreter's readahead until it ran, which is
+why file.ngc puts a dummy M66 E0 L0 in front of #<_hal[...]> reads.
+
+The analyzer runs file.ngc the way the interpreter would: o-word loops,
+if/else and local subs are followed with the constants of the program
+(#80 passes, #88 flutes, #85/#87/#89/#90 switches, #<_task> = 1), the
+o<type> subs are read from their files, and conditions that are only known
+on the machine (#5399, _hal values) are not counted. The part loop (the
+first top level while) runs twice; the second part is reported. For every
+flush point it counts the executions per part and estimates the stall:
+
+    STOP_SECONDS    when motion was queued since the last flush (stop and start again)
+    M-code script   SHELL_SECONDS + HALCMD_SECONDS per halcmd + PYTHON_SECONDS per python
+                    + COMMAND_SECONDS per sed, read from the M1xx file
+    others          [TASK]CYCLE_TIME (M66 waits with L > 0 are listed, not estimated)
+
+Flagged as redundant: a dummy M66 E0 L0 with no _hal read before the next
+M66, unless one of WRITES ran before it and a _hal read or o<type> call
+follows (the sub file has to be read after M118/M128 rewrote it). M-codes of
+DEFER (display counters) inside the loops of a part are flagged as
+deferrable.
+consolidate writes the program without the redundant M66 lines and with each
+deferred M-code once after the outermost loop it was in, then analyzes both.
+
+Settings in lathe.ini:
+    [SYNC_ANALYZER]
+    STOP_SECONDS = 0.1
+    SHELL_SECONDS = 0.01
+    HALCMD_SECONDS = 0.03
+    PYTHON_SECONDS = 0.25
+    COMMAND_SECONDS = 0.005
+    DEFER = M120 M122
+    WRITES = M113 M114 M115 M116 M117 M118 M126 M127 M128
+
+Usage:
+    python3 ngc_sync_analyzer.py analyze [file.ngc]
+    python3 ngc_sync_analyzer.py consolidate <file.ngc> <out.ngc>
+"""
+
+import os
+import re
+import sys
+
+from ini_config import IniConfig
+from segment_table import split_words, word_number
+
+PROGRAM_FILE = "/home/cnc/linuxcnc/configs/xzacw/file.ngc"
+PARTS_SIMULATED = 2
+MAX_ITERATIONS = 10000
+AXIS_LETTERS = "xyzabcuvw"
+# M-codes that write files or HAL pins the program reads back (M118/M128 rewrite the o<type> sub)
+WRITES = ["M113", "M114", "M115", "M116", "M117", "M118", "M126", "M127", "M128"]
+
+OWORD = re.compile(r'^o\s*(\d+|<[^>]+>)\s*(sub|endsub|while|endwhile|if|elseif|else|endif|call)\b(.*)$')
+ASSIGNMENT = re.compile(r'^#(\d+)\s*=\s*(.+)$')
+HAL_READ = re.compile(r'#<_hal\[[^\]]*\]>')
+EXISTS = re.compile(r'exists\s*\[\s*#<[^>]*>\s*\]')
+PARAM = re.compile(r'#(\d+)')
+OPERATORS = [("eq", "=="), ("ne", "!="), ("ge", ">="), ("gt", ">"), ("le", "<="), ("lt", "<"),
+             ("and", " and "), ("or", " or "), ("mod", "%"), ("abs", "abs")]
+EXPRESSION = re.compile(r'^[\d\s.+\-*/%()<>=!andorbs]*$')
+
+
+class Settings:
+    def __init__(self, ini=None):
+        ini = ini or IniConfig()
+        self.stop = ini.find_float("SYNC_ANALYZER", "STOP_SECONDS", 0.1)
+        self.shell = ini.find_float("SYNC_ANALYZER", "SHELL_SECONDS", 0.01)
+        self.halcmd = ini.find_float("SYNC_ANALYZER", "HALCMD_SECONDS", 0.03)
+        self.python = ini.find_float("SYNC_ANALYZER", "PYTHON_SECONDS", 0.25)
+        self.command = ini.find_float("SYNC_ANALYZER", "COMMAND_SECONDS", 0.005)
+        self.cycle = ini.find_float("TASK", "CYCLE_TIME", 0.001)
+        self.defer = [m.lower() for m in ini.find_list("SYNC_ANALYZER", "DEFER", ["M120", "M122"])]
+        self.writes = [m.lower() for m in ini.find_list("SYNC_ANALYZER", "WRITES", WRITES)]
+
+
+# --- program structure ---
+
+class Line:
+    def __init__(self, lineno, code, in_sub):
+        self.lineno = lineno
+        self.code = code
+        self.in_sub = in_sub
+
+
+class Block:
+    def __init__(self, kind, name, lineno, condition=None):
+        self.kind = kind
+        self.name = name
+        self.lineno = lineno
+        self.end = None
+        self.condition = condition
+        self.body = []
+        self.branches = [[condition, self.body]] if kind == "if" else None
+
+
+def strip_comment(line):
+    return re.sub(r'\([^)]*\)', '', line.split(";", 1)[0]).strip().lower()
+
+
+def parse(lines):
+    """Top level statements and {sub name: Block} of a program"""
+    root = Block("root", None, -1)
+    stack = [root]
+    subs = {}
+    for lineno, line in enumerate(lines):
+        code = strip_comment(line)
+        if not code or code == "%":
+            continue
+        top = stack[-1]
+        body = top.branches[-1][1] if top.kind == "if" else top.body
+        in_sub = any(block.kind == "sub" for block in stack)
+        m = OWORD.match(code)
+        if not m or m.group(2) == "call":
+            body.append(Line(lineno, code, in_sub))
+            continue
+        name, word, rest = m.group(1), m.group(2), m.group(3).strip()
+        if word in ("sub", "while", "if"):
+            block = Block(word, name, lineno, rest)
+            if word != "sub":
+                body.append(block)
+            stack.append(block)
+        elif word in ("elseif", "else") and top.kind == "if":
+            top.branches.append([rest if word == "elseif" else None, []])
+        elif word in ("endsub", "endwhile", "endif") and len(stack) > 1:
+            block = stack.pop()
+            block.end = lineno
+            if block.kind == "sub":
+                subs[block.name] = block
+    return root.body, subs
+
+
+def user_mcodes(body):
+    """(lineno, number) of the user M-codes in a body and everything nested in it"""
+    found = []
+    for node in body:
+        if isinstance(node, Line):
+            found.extend((node.lineno, int(word_number(value) or 0))
+                         for letter, value in split_words(node.code)
+                         if letter == "m" and value and 100 <= (word_number(value) or 0) <= 199)
+        elif node.kind == "if":
+            for _, branch in node.branches:
+                found.extend(user_mcodes(branch))
+        else:
+            found.extend(user_mcodes(node.body))
+    return found
+
+
+def script_cost(path, settings):
+    """Estimated run time of a user M-code script"""
+    cost = settings.shell
+    try:
+        with open(path, "r", errors="replace") as f:
+            lines = [line.strip() for line in f]
+    except OSError:
+        return cost
+    for line in lines:
+        if not line or line.startswith("#"):
+            continue
+        if line.endswith("&"):
+            cost += settings.command       # started in the background
+        elif "halcmd" in line:
+            cost += settings.halcmd
+        elif "python" in line:
+            cost += settings.python
+        elif line.startswith("sed ") or " sed " in line:
+            cost += settings.command
+    return cost
+
+
+# --- simulation ---
+
+class Unknown(Exception):
+    pass
+
+
+class Event:
+    def __init__(self, source, lineno, code, kind, part, loops, flush=False, sync=False, cost=0.0):
+        self.source = source
+        self.lineno = lineno
+        self.code = code
+        self.kind = kind
+        self.part = part
+        self.loops = loops          # while blocks inside the part loop, outermost first
+        self.flush = flush          # task waits for the motion queue
+        self.sync = sync            # interpreter readahead waits (M66)
+        self.cost = cost
+        self.drain = False          # motion was queued since the last flush
+        self.in_sub = False
+
+
+class Simulator:
+    def __init__(self, path, settings, directory=None):
+        self.path = path
+        # M-code scripts and o<type> subs
+        self.directory = directory or os.path.dirname(os.path.abspath(path))
+        self.settings = settings
+        with open(path, "r") as f:
+            self.lines = f.read().splitlines(keepends=True)
+        self.body, self.subs = parse(self.lines)
+        self.external = {}
+        self.script_costs = {}
+        self.params = {}
+        self.events = []
+        self.skipped = {}           # (source, lineno) -> condition not known before the run
+        self.part = None
+        self.part_loop = None
+        self.loops = []
+        self.motion_pending = False
+        self.source = os.path.basename(path)
+
+    # expressions
+
+    def evaluate(self, text):
+        text = EXISTS.sub("1", text.strip().lower())
+        if "#<_hal[" in text:
+            raise Unknown(text)
+        text = text.replace("#<_task>", "1")
+        if "#<" in text:
+            raise Unknown(text)
+
+        def param(m):
+            number = int(m.group(1))
+            if number not in self.params:
+                raise Unknown(m.group(0))
+            return repr(self.params[number])
+        text = PARAM.sub(param, text)
+        for word, operator in OPERATORS:
+            text = re.sub(rf'\b{word}\b', operator, text)
+        text = text.replace("[", "(").replace("]", ")")
+        if not EXPRESSION.match(text):
+            raise Unknown(text)
+        try:
+            return float(eval(text, {"__builtins__": {}, "abs": abs}))
+        except (SyntaxError, ZeroDivisionError, TypeError, NameError):
+            raise Unknown(text)
+
+    def condition(self, text, lineno):
+        self.note_reads(text, lineno)
+        try:
+            return bool(self.evaluate(text))
+        except Unknown:
+            self.skipped.setdefault((self.source, lineno), text)
+            return None
+
+    # events
+
+    def add(self, lineno, code, kind, **kwargs):
+        loops = tuple(self.loops[1:]) if self.part_loop is not None and self.loops[:1] == [self.part_loop] else ()
+        event = Event(self.source, lineno, code, kind, self.part, loops, **kwargs)
+        if event.flush:
+            event.drain = self.motion_pending
+            self.motion_pending = False
+        self.events.append(event)
+        return event
+
+    def note_reads(self, text, lineno):
+        if HAL_READ.search(EXISTS.sub("", text)):
+            self.add(lineno, text, "hal read")
+
+    def mcode_cost(self, number):
+        if number not in self.script_costs:
+            self.script_costs[number] = script_cost(os.path.join(self.directory, f"M{number}"), self.settings)
+        return self.script_costs[number]
+
+    # statements
+
+    def run(self):
+        self.walk(self.body)
+        return self.events
+
+    def walk(self, body):
+        for node in body:
+            if isinstance(node, Line):
+                self.line(node)
+            elif node.kind == "while":
+                self.loop(node)
+            else:
+                self.branch(node)
+
+    def loop(self, block):
+        is_part_loop = self.part_loop is None and not self.loops and self.source == os.path.basename(self.path)
+        if is_part_loop:
+            self.part_loop = block
+        self.loops.append(block)
+        iterations = 0
+        while iterations < MAX_ITERATIONS:
+            result = self.condition(block.condition, block.lineno)
+            if result is False or (result is None and (not is_part_loop or iterations >= PARTS_SIMULATED)):
+                if result is None and not is_part_loop:
+                    self.maybe(block.body)
+                break
+            if is_part_loop:
+                self.part = iterations
+            iterations += 1
+            self.walk(block.body)
+        self.loops.pop()
+        if is_part_loop:
+            # the part count is not known before the run either, PARTS_SIMULATED stands in for it
+            self.skipped.pop((self.source, block.lineno), None)
+            self.part = None
+
+    def branch(self, block):
+        for index, (condition, body) in enumerate(block.branches):
+            if condition is None:
+                self.walk(body)
+                return
+            result = self.condition(condition, block.lineno)
+            if result is None:
+                for _, branch in block.branches[index:]:
+                    self.maybe(branch)
+                return
+            if result:
+                self.walk(body)
+                return
+
+    def maybe(self, body):
+        """User M-codes of a body that is not simulated, for the M66 rules"""
+        for lineno, number in user_mcodes(body):
+            self.add(lineno, f"m{number}", f"maybe M{number}")
+
+    def line(self, node):
+        code = node.code
+        m = ASSIGNMENT.match(code)
+        if m:
+            self.note_reads(m.group(2), node.lineno)
+            try:
+                self.params[int(m.group(1))] = self.evaluate(m.group(2))
+            except Unknown:
+                self.params.pop(int(m.group(1)), None)
+            return
+        if code.startswith("#"):
+            return
+        m = OWORD.match(code)
+        if m:
+            self.call(m.group(1), m.group(3), node.lineno)
+            return
+
+        words = split_words(code)
+        letters = {w[0] for w in words}
+        codes = {f"{w[0]}{word_number(w[1]) if w[1].startswith('[') else w[1]}" for w in words if w[0] in "gm"}
+        codes = {re.sub(r'^([gm])0*(\d)', r'\1\2', c).replace(".0", "") for c in codes}
+        if not codes & {"g92", "g92.1", "g92.2", "g92.3", "g10"} and (
+                letters & set(AXIS_LETTERS) or codes & {"g0", "g1", "g2", "g3", "g4"}):
+            self.motion_pending = True
+        for letter, value in words:
+            if letter != "m":
+                continue
+            number = int(word_number(value) or 0) if value else 0
+            event = None
+            if number == 66:
+                wait = dict((w[0], w[1]) for w in words)
+                level = word_number(wait.get("l", "0")) or 0
+                if "p" not in wait and level == 0:
+                    event = self.add(node.lineno, code, "M66 dummy", flush=True, sync=True,
+                                     cost=self.settings.cycle)
+                elif level == 0:
+                    event = self.add(node.lineno, code, "M66 input", flush=True, sync=True,
+                                     cost=self.settings.cycle)
+                else:
+                    event = self.add(node.lineno, code, "M66 wait", flush=True, sync=True,
+                                     cost=self.settings.cycle)
+            elif number in (64, 65, 68):
+                event = self.add(node.lineno, code, f"M{number} output", flush=True, cost=self.settings.cycle)
+            elif 100 <= number <= 199:
+                event = self.add(node.lineno, code, f"M{number}", flush=True, cost=self.mcode_cost(number))
+            elif number in (0, 1, 60):
+                event = self.add(node.lineno, code, f"M{number} pause", flush=True)
+            if event is not None:
+                event.in_sub = node.in_sub or self.source != os.path.basename(self.path)
+
+    def call(self, name, rest, lineno):
+        args = []
+        for value in re.findall(r'\[([^\[\]]*(?:\[[^\[\]]*\][^\[\]]*)*)\]', rest):
+            try:
+                args.append(self.evaluate(f"[{value}]"))
+            except Unknown:
+                args.append(None)
+        if name in self.subs:
+            sub, source = self.subs[name], self.source
+        else:
+            sub, source = self.external_sub(name), name.strip("<>") + ".ngc"
+        if source != self.source:
+            # the interpreter reads the sub file here
+            self.add(lineno, f"o{name} call", "o-call")
+        if sub is None:
+            # sub not found: it moves the machine
+            self.motion_pending = True
+            return
+        saved = {n: self.params.get(n) for n in range(1, 31)}
+        for n, value in enumerate(args, start=1):
+            if value is None:
+                self.params.pop(n, None)
+            else:
+                self.params[n] = value
+        saved_source, saved_subs = self.source, self.subs
+        if source != self.source:
+            self.source, self.subs = source, self.external[name][1]
+        self.walk(sub.body)
+        self.source, self.subs = saved_source, saved_subs
+        for n, value in saved.items():
+            if value is None:
+                self.params.pop(n, None)
+            else:
+                self.params[n] = value
+
+    def external_sub(self, name):
+        if name not in self.external:
+            path = os.path.join(self.directory, name.strip("<>") + ".ngc")
+            try:
+                with open(path, "r") as f:
+                    body, subs = parse(f.read().splitlines())
+            except OSError:
+                self.external[name] = (None, {})
+            else:
+                self.external[name] = (subs.get(name), subs)
+        return self.external[name][0]
+
+
+# --- analysis ---
+
+class Analysis:
+    def __init__(self, path, settings=None, directory=None):
+        self.settings = settings or Settings()
+        self.simulator = Simulator(path, self.settings, directory)
+        self.events = self.simulator.run()
+        parts = sorted({e.part for e in self.events if e.part is not None})
+        self.part = parts[-1] if parts else None
+        self.redundant = self.find_redundant()
+        self.deferred = self.find_deferred()
+
+    def stall(self, event):
+        return event.cost + (self.settings.stop if event.drain else 0.0)
+
+    def part_events(self):
+        return [e for e in self.events if e.part == self.part]
+
+    def writes(self, event):
+        return event.kind.lower().replace("maybe ", "") in self.settings.writes
+
+    def find_redundant(self):
+        """{lineno: reason} of main program dummy M66 lines no _hal read or o-call depends on
+
+        A dummy M66 is needed when a _hal read follows before the next M66, or
+        when a WRITES M-code ran since the last M66 and a _hal read or o-call
+        follows before the next dummy M66: the M66 P/L waits in between depend
+        on #85/#87, and without a sync the readahead reads the o<type> file
+        M118/M128 is still rewriting.
+        """
+        main = os.path.basename(self.simulator.path)
+        needed = set()
+        seen = set()
+        last_sync = -1
+        for i, event in enumerate(self.events):
+            if event.kind != "M66 dummy" or event.source != main:
+                if event.sync:
+                    last_sync = i
+                continue
+            seen.add(event.lineno)
+            for later in self.events[i + 1:]:
+                if later.kind == "hal read":
+                    needed.add(event.lineno)
+                    break
+                if later.sync:
+                    break
+            if any(self.writes(e) for e in self.events[last_sync + 1:i]):
+                for later in self.events[i + 1:]:
+                    if later.kind in ("hal read", "o-call"):
+                        needed.add(event.lineno)
+                        break
+                    if later.kind == "M66 dummy":
+                        break
+            last_sync = i
+        return {lineno: "no _hal read or o-call depends on it" for lineno in seen - needed}
+
+    def find_deferred(self):
+        """{lineno: outermost loop Block} of DEFER M-codes inside the loops of a part"""
+        main = os.path.basename(self.simulator.path)
+        deferred = {}
+        for event in self.events:
+            if (event.source == main and event.loops and not event.in_sub
+                    and event.kind.lower() in self.settings.defer):
+                deferred[event.lineno] = event.loops[0]
+        return deferred
+
+    def totals(self):
+        events = [e for e in self.part_events() if e.flush]
+        return len(events), sum(1 for e in events if e.drain), sum(self.stall(e) for e in events)
+
+    def report(self):
+        lines = self.simulator.lines
+        events = self.part_events()
+        if self.part is None:
+            print("SYNC: No part loop found, reporting the whole program")
+            events = self.events
+        rows = {}
+        for event in events:
+            if not event.flush:
+                continue
+            row = rows.setdefault((event.source, event.lineno), [event, 0, 0, 0.0])
+            row[1] += 1
+            row[2] += event.drain
+            row[3] += self.stall(event)
+        print(f"SYNC: {os.path.basename(self.simulator.path)}, flush points of one part")
+        print(f"  {'file':10s} {'line':>5s} {'count':>6s} {'drains':>7s} {'stall':>8s}  {'kind':12s} code")
+        for (source, lineno), (event, count, drains, stall) in sorted(rows.items(), key=lambda r: -r[1][3]):
+            mark = " *" if source == os.path.basename(self.simulator.path) and (
+                lineno in self.redundant or lineno in self.deferred) else ""
+            print(f"  {source:10s} {lineno + 1:5d} {count:6d} {drains:7d} {stall:7.2f}s  {event.kind:12s} "
+                  f"{event.code}{mark}")
+        flushes, drains, stall = self.totals()
+        print(f"SYNC: {flushes} flushes per part, {drains} with motion queued, ~{stall:.1f}s estimated stall")
+        waits = {e.lineno: e.code for e in events if e.kind == "M66 wait"}
+        for lineno, code in sorted(waits.items()):
+            print(f"  line {lineno + 1}: {code} waits for its input (not in the estimate)")
+        if self.redundant:
+            print("Redundant (*):")
+            for lineno, reason in sorted(self.redundant.items()):
+                print(f"  line {lineno + 1}: {lines[lineno].strip()} - {reason}")
+        if self.deferred:
+            print("Deferrable to the part boundary (*):")
+            for lineno, block in sorted(self.deferred.items()):
+                same = [e for e in events if e.lineno == lineno and e.kind.lower() in self.settings.defer]
+                print(f"  line {lineno + 1}: {lines[lineno].strip()} - {len(same)}x per part in o{block.name}, "
+                      f"~{sum(self.stall(e) for e in same):.2f}s")
+        if self.simulator.skipped:
+            print("Not counted (condition only known on the machine):")
+            for (source, lineno), condition in sorted(self.simulator.skipped.items()):
+                print(f"  {source} line {lineno + 1}: {condition}")
+
+    def consolidated(self):
+        """Program text without the redundant M66 lines and with deferred M-codes after their loop"""
+        lines = self.simulator.lines
+        after = {}
+        for lineno, block in sorted(self.deferred.items()):
+            texts = after.setdefault(block.end, [])
+            if strip_comment(lines[lineno]) not in [strip_comment(t) for t in texts]:
+                texts.append(lines[lineno])
+        out = []
+        for lineno, line in enumerate(lines):
+            if lineno in self.redundant or lineno in self.deferred:
+                continue
+            out.append(line)
+            for text in after.get(lineno, []):
+                out.append(text if text.endswith("\n") else text + "\n")
+        return "".join(out)
+
+
+def consolidate(path, out_path):
+    settings = Settings()
+    before = Analysis(path, settings)
+    text = before.consolidated()
+    tmp_file = out_path + ".tmp"
+    with open(tmp_file, "w") as f:
+        f.write(text)
+    os.replace(tmp_file, out_path)
+    after = Analysis(out_path, settings, before.simulator.directory)
+    for name, analysis in (("before", before), ("after", after)):
+        flushes, drains, stall = analysis.totals()
+        print(f"  {name:6s} {flushes:4d} flushes per part, {drains:4d} with motion queued, ~{stall:.1f}s stall")
+    print(f"SYNC: Wrote {out_path} ({len(before.redundant)} M66 removed, "
+          f"{len(before.deferred)} M-codes moved to the part boundary)")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if command == "analyze" and len(sys.argv) <= 3:
+            Analysis(sys.argv[2] if len(sys.argv) > 2 else PROGRAM_FILE).report()
+        elif command == "consolidate" and len(sys.argv) == 4:
+            consolidate(sys.argv[2], sys.argv[3])
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError) as e:
+        print(f"SYNC: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+regen_worker.py - Background regeneration of the workpiece programs
+
+Watches the ESLH sets (gcode/StandardDimentions/<TYPE>/) and the [GENERATOR]
+parameters in lathe.ini for all six workpiece types. When a type changes,
+its <type>.ngc is regenerated with create_CNC_code into the M127/M128 shadow
+buffer (.regen_staging/shadow/), so switching types never waits on code
+generation. Types are generated in parallel, one per CPU core.
+
+The live program is never replaced while file.ngc runs: a ready buffer
+raises eslah-buffer-ready and M128 renames it over the running type at the
+next part boundary (eslah_async.py). While halui.program.is-idle is set the
+worker swaps every ready buffer in itself. Types with a pending buffer are
+left alone until it is swapped.
+
+Usage:
+    python3 regen_worker.py watch [poll_seconds]   (started from lathe.ini [APPLICATIONS])
+    python3 regen_worker.py once                   (regenerate changed types and exit)
+    python3 regen_worker.py all                    (regenerate every type and exit)
+    python3 regen_worker.py status
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from ini_config import IniConfig
+
+# Add the path to your project files so we can import them
+sys.path.append('/home/cnc/linuxcnc/configs/xzacw/gcode')
+
+MAIN_FOLDER = "/home/cnc/linuxcnc/configs/xzacw"
+STANDARD_FOLDER = os.path.join(MAIN_FOLDER, "gcode")
+STAGING_DIR = os.path.join(MAIN_FOLDER, ".regen_staging")
+STATE_FILE = os.path.join(STAGING_DIR, "state.json")
+SHADOW_DIR = os.path.join(STAGING_DIR, "shadow")
+WORKPIECE_TYPES = ["SX", "S1", "S2", "F1", "F2", "F3"]
+
+# Defaults are the values M118 always used
+DEFAULT_PARAMS = {"stepsize": 0.2, "maxfeed": 750, "x_steps": 6, "is_reolix": False}
+
+
+def get_generator_params():
+    """create_CNC_code parameters from lathe.ini [GENERATOR]"""
+    ini = IniConfig()
+    return {
+        "stepsize": ini.find_float("GENERATOR", "STEPSIZE", DEFAULT_PARAMS["stepsize"]),
+        "maxfeed": ini.find_int("GENERATOR", "MAXFEED", DEFAULT_PARAMS["maxfeed"]),
+        "x_steps": ini.find_int("GENERATOR", "X_STEPS", DEFAULT_PARAMS["x_steps"]),
+        "is_reolix": bool(ini.find_int("GENERATOR", "IS_REOLIX", int(DEFAULT_PARAMS["is_reolix"]))),
+    }
+
+
+def program_path(file_type):
+    return os.path.join(MAIN_FOLDER, f"{file_type.lower()}.ngc")
+
+
+def type_fingerprint(file_type, params):
+    """Hash of the type's ESLH/dimension files (name, size, mtime) and parameters"""
+    h = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    type_dir = os.path.join(STANDARD_FOLDER, "StandardDimentions", file_type)
+    if os.path.isdir(type_dir):
+        for entry in sorted(os.scandir(type_dir), key=lambda e: e.name):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            st = entry.stat()
+            h.update(f"{entry.name}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    tmp_file = STATE_FILE + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp_file, STATE_FILE)
+
+
+def record_generated(file_type, fingerprint):
+    """Remember which input state the live program was generated from"""
+    with type_lock("state"):
+        state = load_state()
+        state[file_type] = {"fingerprint": fingerprint, "generated_at": time.strftime('%Y-%m-%d %H:%M:%S')}
+        save_state(state)
+
+
+class type_lock:
+    """Exclusive lock so M118 and the worker never generate the same type at once"""
+
+    def __init__(self, name):
+        os.makedirs(STAGING_DIR, exist_ok=True)
+        self.path = os.path.join(STAGING_DIR, f".{name}.lock")
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.path, "w")
+        fcntl.flock(self.f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.f, fcntl.LOCK_UN)
+        self.f.close()
+        return False
+
+
+def is_valid_program(path, file_type):
+    """Generated file must be a complete o<type> sub"""
+    try:
+        if os.path.getsize(path) == 0:
+            return False
+        with open(path, "r") as f:
+            text = f.read()
+    except OSError:
+        return False
+    sub_name = f"o<{file_type.lower()}>"
+    return f"{sub_name} sub" in text and f"{sub_name} endsub" in text
+
+
+def generate_staged(file_type, params, target=None):
+    """Generate <type>.ngc into the staging area; returns the staged path or None"""
+    from DrawLib import create_CNC_code
+
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    target = target or program_path(file_type)
+    staged = os.path.join(STAGING_DIR, f"{os.path.basename(target)}.{os.getpid()}")
+    success = create_CNC_code(file_type, params["stepsize"], params["maxfeed"], staged,
+                              params["is_reolix"], params["x_steps"])
+    if not success or not is_valid_program(staged, file_type):
+        if os.path.exists(staged):
+            os.remove(staged)
+        return None
+    return staged
+
+
+def generate_program(file_type, params=None, target=None):
+    """Generate one type and swap it in atomically; returns True on success"""
+    params = params or get_generator_params()
+    target = target or program_path(file_type)
+    with type_lock(file_type):
+        fingerprint = type_fingerprint(file_type, params)
+        staged = generate_staged(file_type, params, target)
+        if staged is None:
+            print(f"REGEN: {file_type} generation failed")
+            return False
+        # rename() on the same filesystem: readers see the old or the new file, never a partial one
+        os.replace(staged, target)
+    if target == program_path(file_type):
+        record_generated(file_type, fingerprint)
+        # keep every generation in the versioned store (see toolpath_store.py)
+        from toolpath_store import commit_program
+        commit_program(file_type, target)
+    print(f"REGEN: {file_type} -> {target} ({os.path.getsize(target)} bytes)")
+    return True
+
+
+def shadow_paths(file_type):
+    """Shadow program and its marker for the M127/M128 double buffer"""
+    base = os.path.join(SHADOW_DIR, file_type.lower())
+    return f"{base}.ngc", f"{base}.json"
+
+
+def write_shadow_marker(file_type, marker):
+    os.makedirs(SHADOW_DIR, exist_ok=True)
+    marker_file = shadow_paths(file_type)[1]
+    tmp_file = marker_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(marker, f, indent=1)
+    os.replace(tmp_file, marker_file)
+
+
+def read_shadow_marker(file_type):
+    """Marker of a pending shadow buffer, None when there is none (or its writer died)"""
+    try:
+        with open(shadow_paths(file_type)[1], "r") as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if marker.get("state") == "generating":
+        try:
+            os.kill(marker.get("pid", 0), 0)
+        except (OSError, TypeError):
+            return None
+    return marker
+
+
+def shadow_ready(file_type):
+    marker = read_shadow_marker(file_type)
+    return marker is not None and marker.get("state") == "ready" and os.path.exists(shadow_paths(file_type)[0])
+
+
+def generate_shadow(file_type, params=None):
+    """Generate <type>.ngc into the shadow buffer; the live program is not touched"""
+    params = params or get_generator_params()
+    shadow, _ = shadow_paths(file_type)
+    with type_lock(file_type):
+        fingerprint = type_fingerprint(file_type, params)
+        staged = generate_staged(file_type, params)
+        if staged is None:
+            print(f"REGEN: {file_type} shadow generation failed")
+            return False
+        os.replace(staged, shadow)
+    write_shadow_marker(file_type, {"state": "ready", "fingerprint": fingerprint,
+                                    "generated_at": time.strftime('%Y-%m-%d %H:%M:%S')})
+    print(f"REGEN: {file_type} -> {shadow} ({os.path.getsize(shadow)} bytes), waiting for swap")
+    return True
+
+
+def swap_shadow(file_type):
+    """Move a ready shadow program over the live one; returns True when swapped"""
+    if not shadow_ready(file_type):
+        return False
+    shadow, marker_file = shadow_paths(file_type)
+    target = program_path(file_type)
+    with type_lock(file_type):
+        # M128 and the worker may both try; the second finds the buffer gone
+        if not shadow_ready(file_type):
+            return False
+        marker = read_shadow_marker(file_type)
+        os.replace(shadow, target)
+        os.remove(marker_file)
+    record_generated(file_type, marker["fingerprint"])
+    from toolpath_store import commit_program
+    commit_program(file_type, target)
+    print(f"REGEN: {file_type} shadow swapped into {target}")
+    return True
+
+
+def _generate_worker(file_type):
+    """Process pool entry point"""
+    try:
+        return file_type, generate_shadow(file_type)
+    except Exception as e:
+        print(f"REGEN: {file_type} error: {e}")
+        return file_type, False
+
+
+def program_idle():
+    """True while no program runs (halui.program.is-idle); unknown counts as running"""
+    try:
+        result = subprocess.run(["halcmd", "getp", "halui.program.is-idle"],
+                                capture_output=True, text=True, timeout=2.0)
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return result.returncode == 0 and result.stdout.strip() == "TRUE"
+
+
+def swap_ready_shadows():
+    """Swap every ready buffer in while no program runs; returns the swapped types"""
+    if not any(shadow_ready(t) for t in WORKPIECE_TYPES) or not program_idle():
+        return []
+    swapped = [t for t in WORKPIECE_TYPES if swap_shadow(t)]
+    if not any(read_shadow_marker(t) is not None for t in WORKPIECE_TYPES):
+        from eslah_async import set_buffer_ready
+        set_buffer_ready(False)
+    return swapped
+
+
+def changed_types(params=None, skip=None, adopt=True):
+    """Types whose inputs differ from the state their program was generated from"""
+    params = params or get_generator_params()
+    skip = skip or {}
+    state = load_state()
+    changed = []
+    for file_type in WORKPIECE_TYPES:
+        fingerprint = type_fingerprint(file_type, params)
+        if file_type not in state and os.path.exists(program_path(file_type)):
+            # First run: adopt the existing program instead of overwriting it
+            if adopt:
+                record_generated(file_type, fingerprint)
+            continue
+        if skip.get(file_type) == fingerprint:
+            continue
+        if read_shadow_marker(file_type) is not None:
+            # M127 owns this type until M128 swaps its buffer in at a part boundary
+            continue
+        if state.get(file_type, {}).get("fingerprint") != fingerprint or not os.path.exists(program_path(file_type)):
+            changed.append(file_type)
+    return changed
+
+
+def regenerate(types):
+    """Regenerate the given types into their shadow buffers in parallel"""
+    if not types:
+        return {}
+    workers = min(len(types), os.cpu_count() or 1)
+    print(f"REGEN: Regenerating {', '.join(types)} with {workers} worker(s)")
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = dict(pool.map(_generate_worker, types))
+    print(f"REGEN: Done in {time.time() - start:.2f}s: {results}")
+    if any(results.values()):
+        # a running file.ngc swaps the buffer of its type in with M128 at the part boundary
+        from eslah_async import set_buffer_ready
+        set_buffer_ready(True)
+    return results
+
+
+def watch(poll_seconds=2.0):
+    print(f"REGEN: Watching {', '.join(WORKPIECE_TYPES)} every {poll_seconds}s")
+    failed = {}  # type -> fingerprint that failed, retried when the inputs change again
+    while True:
+        try:
+            params = get_generator_params()
+            results = regenerate(changed_types(params, failed))
+            for file_type, success in results.items():
+                if success:
+                    failed.pop(file_type, None)
+                else:
+                    failed[file_type] = type_fingerprint(file_type, params)
+            swap_ready_shadows()
+        except Exception as e:
+            print(f"REGEN: Error in watch loop: {e}")
+        time.sleep(poll_seconds)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "once"
+    try:
+        if command == "watch":
+            watch(float(sys.argv[2]) if len(sys.argv) > 2 else 2.0)
+        elif command == "once":
+            results = regenerate(changed_types())
+            swap_ready_shadows()
+            return 0 if all(results.values()) else 1
+        elif command == "all":
+            # types with a pending buffer keep it until it is swapped
+            results = regenerate([t for t in WORKPIECE_TYPES if read_shadow_marker(t) is None])
+            swap_ready_shadows()
+            return 0 if all(results.values()) else 1
+        elif command == "status":
+            # read only: a type without a recorded state is not adopted here
+            pending = changed_types(adopt=False)
+            state = load_state()
+            for file_type in WORKPIECE_TYPES:
+                generated = state.get(file_type, {}).get("generated_at", "never")
+                flag = "CHANGED" if file_type in pending else "up to date"
+                if shadow_ready(file_type):
+                    flag += ", shadow ready"
+                elif read_shadow_marker(file_type) is not None:
+                    flag += ", shadow generating"
+                print(f"  {file_type}: {flag} (generated {generated})")
+        else:
+            print(__doc__)
+            return 1
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"REGEN: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+segment_table.py - Read the profile segments of a generated <type>.ngc
+
+create_CNC_code writes the profile as g93 blocks like
+    g93 g01 x[0.02132+#7*[#11-0.02132]] z-0.20328 c-72.02551 f[437.90323]
+and older programs as
+    g93 g01 x[0.04637+#7*[#11-0.04637]] z-0.20253 a0.00000 c-56.12798 f[#1*18.75000]
+
+parse_program() returns the g93 blocks as numpy arrays (one row per block).
+X is the profile value before the pass offset (#7 = 0, the finishing pass),
+which is also the pass with the largest X moves.
+
+Usage:
+    python3 segment_table.py <program.ngc>     (print the table)
+"""
+
+import re
+import sys
+
+import numpy as np
+
+NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)')
+# number inside an expression that is not a #parameter reference
+EXPR_NUMBER = re.compile(r'(?<![#\d.])[-+]?(?:\d+\.?\d*|\.\d+)')
+AXES = "xzacw"
+
+
+def split_words(line):
+    """Split a g-code line into (letter, value text) words; [..] values may nest"""
+    code = line.split("(", 1)[0].strip().lower()
+    words = []
+    i = 0
+    while i < len(code):
+        ch = code[i]
+        if not ch.isalpha():
+            i += 1
+            continue
+        j = i + 1
+        while j < len(code) and code[j] == " ":
+            j += 1
+        if j < len(code) and code[j] == "[":
+            depth = 0
+            k = j
+            while k < len(code):
+                if code[k] == "[":
+                    depth += 1
+                elif code[k] == "]":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                k += 1
+            words.append((ch, code[j:k + 1]))
+            i = k + 1
+        else:
+            m = NUMBER.match(code, j)
+            if m:
+                words.append((ch, m.group(0)))
+                i = m.end()
+            else:
+                words.append((ch, ""))
+                i = j
+    return words
+
+
+def word_number(value):
+    """Numeric part of a word: plain number, or first number inside [..]"""
+    m = EXPR_NUMBER.search(value)
+    return float(m.group(0)) if m else None
+
+
+class SegmentTable:
+    """g93 blocks of a program as arrays; start is the position before each block"""
+
+    def __init__(self, lines, rows, start):
+        self.lines = lines
+        self.line_index = np.array([r["line"] for r in rows], dtype=np.int64)
+        self.end = np.array([[r[a] for a in AXES] for r in rows], dtype=np.float64).reshape(-1, len(AXES))
+        self.start = np.array(start, dtype=np.float64).reshape(-1, len(AXES))
+        self.feed = np.array([r["f"] for r in rows], dtype=np.float64)
+        self.feed_uses_param = np.array([r["f_param"] for r in rows], dtype=bool)
+
+    def __len__(self):
+        return len(self.line_index)
+
+    def axis(self, name):
+        return self.end[:, AXES.index(name)]
+
+    @property
+    def delta(self):
+        """Per-block axis moves, columns in AXES order"""
+        return self.end - self.start
+
+    def block_times(self):
+        """Programmed block times in seconds (inverse time: F = 1 / minutes)"""
+        with np.errstate(divide="ignore"):
+            return np.where(self.feed > 0, 60.0 / self.feed, 0.0)
+
+    def is_zero_length(self, tolerance=1e-9):
+        return np.all(np.abs(self.delta) <= tolerance, axis=1)
+
+
+def parse_program(path=None, text=None):
+    """Parse a program file (or text) into a SegmentTable"""
+    if text is None:
+        with open(path, "r") as f:
+            text = f.read()
+    lines = text.splitlines(keepends=True)
+
+    position = dict.fromkeys(AXES, 0.0)
+    rows = []
+    start = []
+    for index, line in enumerate(lines):
+        words = split_words(line)
+        if not words:
+            continue
+        letters = [w[0] for w in words]
+        codes = {f"{w[0]}{w[1]}" for w in words if w[0] in "gm"}
+        is_inverse_time = "g93" in codes
+        is_motion = bool(codes & {"g0", "g00", "g1", "g01"}) or any(a in letters for a in AXES)
+        if not is_motion or codes & {"g92.1", "g92.2"}:
+            continue
+        if "g92" in codes:
+            # coordinate offset: the named axes now read the given values
+            for letter, value in words:
+                number = word_number(value) if letter in AXES else None
+                if number is not None:
+                    position[letter] = number
+            continue
+
+        new_position = dict(position)
+        feed = None
+        feed_param = False
+        for letter, value in words:
+            if letter in AXES:
+                number = word_number(value)
+                if number is not None:
+                    new_position[letter] = number
+            elif letter == "f":
+                feed = word_number(value)
+                feed_param = "#" in value
+
+        if is_inverse_time and feed is not None:
+            start.append([position[a] for a in AXES])
+            row = dict(new_position)
+            row.update({"line": index, "f": feed, "f_param": feed_param})
+            rows.append(row)
+        position = new_position
+
+    return SegmentTable(lines, rows, start)
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(__doc__)
+        return 1
+    table = parse_program(sys.argv[1])
+    print(f"{len(table)} g93 blocks, programmed time per pass {table.block_times().sum():.2f}s")
+    print("  line        x          z           c          f")
+    for i in range(len(table)):
+        x, z, a, c, w = table.end[i]
+        print(f"  {table.line_index[i] + 1:4d} {x:10.5f} {z:10.5f} {c:11.5f} {table.feed[i]:10.5f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
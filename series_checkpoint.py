@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+series_checkpoint.py - Checkpoints of the running series and resume after an abort
+
+An aborted file.ngc starts over with #71=0 and #78/#79=1, although
+M113/M116/M120/M122 already persisted how far the series came. file.ngc
+calls o210 at the series start and at every flute, pass and part boundary;
+it puts the series position on motion.analog-out-01..10 (M68, applied once the
+motion before it has finished) and bumps a sequence number on
+analog-out-11. This userspace HAL component writes the record to
+series_checkpoint.json whenever the sequence changes:
+
+    serie    parts finished in the series (#71)    pass, flute  next to grind (#78, #79)
+    touchoff (#72)   total (#77)   type (#81)   serie_total (#70)
+    offsets  G92 x, z, c, w (#5211 #5213 #5216 #5219) at the start of that flute
+
+#93 is 0 in file.ngc: every start begins with part 1 and its first o210
+overwrites the record. Only after an abort, with the interrupted part still
+clamped, the operator sets #93=1 for the restart; file.ngc then calls M126
+P#70 Q#81. When the record is an unfinished series of the same type and
+length, M126 sets gladevcp.resume_* and file.ngc continues from there (any
+other record is deleted, the series starts fresh): a part boundary runs
+the normal part start, a flute boundary restores the G92 offsets of the
+record (C is indexed per flute with g92 c0) instead of feeding and zeroing
+the part, and grinds the interrupted flute again. The touchoff of the record
+is the one left by M112 after the last finished part. An abort during the part
+handling resumes before the handling, so it runs again for that part.
+
+HAL (spindle_to_gladevcp.hal, motmod needs num_aio=12):
+    loadusr -Wn checkpoint python3 series_checkpoint.py run
+    net grind-pass motion.analog-out-00 => checkpoint.pass
+    net checkpoint-serie motion.analog-out-01 => checkpoint.serie
+    ... analog-out-02..11 => checkpoint.flute touchoff total x-offset z-offset c-offset
+                             w-offset type serie-total seq
+Pins out: checkpoint.records (written since start)
+
+Usage:
+    python3 series_checkpoint.py run
+    python3 series_checkpoint.py resume <serie_total> <type 0-5>   (M126)
+    python3 series_checkpoint.py show
+    python3 series_checkpoint.py clear                             (next start begins with part 1)
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+CHECKPOINT_FILE = "/home/cnc/linuxcnc/configs/xzacw/series_checkpoint.json"
+POLL = 0.01
+# pin name -> analog-out index (M68 E) in file.ngc o210
+FIELDS = {
+    "pass": 0, "serie": 1, "flute": 2, "touchoff": 3, "total": 4,
+    "x-offset": 5, "z-offset": 6, "c-offset": 7, "w-offset": 8,
+    "type": 9, "serie-total": 10,
+}
+COUNTS = ("pass", "serie", "flute", "total", "type", "serie-total")
+OFFSETS = ("x-offset", "z-offset", "c-offset", "w-offset")
+
+
+def make_record(values):
+    record = {name.replace("-", "_"): int(round(values[name])) for name in COUNTS}
+    record["touchoff"] = round(values["touchoff"], 6)
+    record["offsets"] = {name[0]: round(values[name], 6) for name in OFFSETS}
+    record["time"] = time.strftime('%Y-%m-%d %H:%M:%S')
+    return record
+
+
+def write_checkpoint(record, path=CHECKPOINT_FILE):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(record, f, indent=1)
+        f.flush()
+        # a power loss must not leave half a checkpoint behind
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+def read_checkpoint(path=CHECKPOINT_FILE):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def resumable(record, serie_total, file_type):
+    """Reason the record cannot be resumed, or None"""
+    if record is None:
+        return "no checkpoint"
+    if record["type"] != file_type or record["serie_total"] != serie_total:
+        return f"checkpoint is for type {record['type']}, {record['serie_total']} parts"
+    if record["serie"] >= record["serie_total"]:
+        return "series finished"
+    if record["serie"] == 0 and record["pass"] <= 1 and record["flute"] <= 1:
+        return "series had not started"
+    return None
+
+
+def run():
+    import hal
+
+    comp = hal.component("checkpoint")
+    for name in FIELDS:
+        comp.newpin(name, hal.HAL_FLOAT, hal.HAL_IN)
+    comp.newpin("seq", hal.HAL_FLOAT, hal.HAL_IN)
+    comp.newpin("records", hal.HAL_S32, hal.HAL_OUT)
+    comp.ready()
+
+    last_seq = comp["seq"]
+    records = 0
+    print(f"CHECKPOINT: Writing {CHECKPOINT_FILE}")
+    try:
+        while True:
+            seq = comp["seq"]
+            if seq != last_seq:
+                last_seq = seq
+                # o210 sets seq last, the other outputs are already in place
+                write_checkpoint(make_record({name: comp[name] for name in FIELDS}))
+                records += 1
+                comp["records"] = records
+            time.sleep(POLL)
+    except KeyboardInterrupt:
+        pass
+
+
+def set_resume_pins(record):
+    values = {}
+    if record:
+        values.update({"resume_serie": record["serie"], "resume_pass": record["pass"],
+                       "resume_flute": record["flute"], "resume_touchoff": record["touchoff"]})
+        values.update({f"resume_{axis}": value for axis, value in record["offsets"].items()})
+    # valid goes last, file.ngc never sees it with the values of an older record
+    values["resume_valid"] = 1 if record else 0
+    for pin, value in values.items():
+        subprocess.run(["halcmd", "setp", f"gladevcp.{pin}", str(value)], check=True, timeout=2.0)
+
+
+def resume(serie_total, file_type):
+    record = read_checkpoint()
+    reason = resumable(record, serie_total, file_type)
+    if reason is not None:
+        print(f"CHECKPOINT: Starting with part 1 ({reason})")
+        set_resume_pins(None)
+        # a fresh series: the old record must not be resumed later
+        clear()
+        return False
+    set_resume_pins(record)
+    print(f"CHECKPOINT: Resuming part {record['serie'] + 1}/{record['serie_total']} at pass "
+          f"{record['pass']} flute {record['flute']} (checkpoint {record['time']})")
+    return True
+
+
+def clear():
+    if os.path.exists(CHECKPOINT_FILE):
+        os.remove(CHECKPOINT_FILE)
+
+
+def show():
+    record = read_checkpoint()
+    if record is None:
+        print("CHECKPOINT: No checkpoint")
+        return
+    offsets = " ".join(f"{axis}{value:g}" for axis, value in record["offsets"].items())
+    print(f"  {record['time']}  type {record['type']}  part {record['serie']}/{record['serie_total']} "
+          f"finished  next pass {record['pass']} flute {record['flute']}")
+    print(f"  touchoff {record['touchoff']:g}  total {record['total']}  g92 {offsets}")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if command == "run":
+            run()
+        elif command == "resume" and len(sys.argv) == 4:
+            resume(int(float(sys.argv[2])), int(float(sys.argv[3])))
+        elif command == "show":
+            show()
+        elif command == "clear":
+            clear()
+            print("CHECKPOINT: Cleared, the next start begins with part 1")
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, KeyError, ValueError, OSError, subprocess.SubprocessError) as e:
+        print(f"CHECKPOINT: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+spark_out_monitor.py - Spindle load per grinding pass for adaptive spark-out
+
+The subs run the full o202 pass schedule even when the last passes remove
+almost nothing. This userspace HAL component samples the VFD output torque
+(mb2hal Output_torque) while file.ngc grinds (M64 P0 around every o<sub>
+call, pass number on M68 E0) and compares the pass mean with the idle load of
+the running spindle between passes. When the net load stays under THRESHOLD
+it sets motion.digital-in-04; file.ngc (#90 = minimum passes, 0 = off) then
+jumps to the final pass. motion.digital-in-05 tells file.ngc the reading is
+valid (idle baseline known, MIN_SAMPLES in the pass). Every pass is appended
+to spark_out_log.csv with the passes skipped after it.
+
+Settings in lathe.ini:
+    [SPARK_OUT]
+    THRESHOLD = 3.0         (net load in % below which a pass only sparks)
+    LOAD_SCALE = 0.1        (mb2hal value to %, Output_torque is 0.1 %)
+    MIN_SAMPLES = 20
+    BASELINE_ALPHA = 0.02   (idle load filter)
+
+HAL (spindle_to_gladevcp.hal):
+    loadusr -Wn spark-out python3 spark_out_monitor.py run
+    net spindle-load mb2hal.Output_torque.00.float => spark-out.load
+    net grind-gate motion.digital-out-00 => spark-out.gate
+    net grind-pass motion.analog-out-00 => spark-out.pass
+    net spindle-at-speed => spark-out.at-speed
+    net spark-out-low spark-out.low => motion.digital-in-04
+    net spark-out-valid spark-out.valid => motion.digital-in-05
+    net checkpoint-serie => spark-out.part      (#71 on motion.analog-out-01)
+Pins out: spark-out.pass-load (net % of the current pass), spark-out.baseline
+
+Usage:
+    python3 spark_out_monitor.py run
+    python3 spark_out_monitor.py report [spark_out_log.csv]    (load per pass and skips)
+"""
+
+import os
+import sys
+import csv
+import time
+
+from ini_config import IniConfig
+
+LOG_FILE = "/home/cnc/linuxcnc/configs/xzacw/spark_out_log.csv"
+POLL = 0.01
+
+
+class Settings:
+    def __init__(self, ini=None):
+        ini = ini or IniConfig()
+        self.threshold = ini.find_float("SPARK_OUT", "THRESHOLD", 3.0)
+        self.load_scale = ini.find_float("SPARK_OUT", "LOAD_SCALE", 0.1)
+        self.min_samples = ini.find_int("SPARK_OUT", "MIN_SAMPLES", 20)
+        self.baseline_alpha = ini.find_float("SPARK_OUT", "BASELINE_ALPHA", 0.02)
+
+
+class PassWindow:
+    def __init__(self, part, pass_no):
+        self.part = part
+        self.pass_no = pass_no
+        self.samples = 0
+        self.total = 0.0
+
+
+class SparkOut:
+    """Pass windows and idle baseline; update() returns a finished window or None"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.baseline = None
+        self.window = None
+        self.low = False
+        self.valid = False
+
+    def net_load(self, window=None):
+        window = window or self.window
+        if window is None or window.samples == 0 or self.baseline is None:
+            return 0.0
+        return window.total / window.samples - self.baseline
+
+    def update(self, load, gate, pass_no, part, at_speed):
+        s = self.settings
+        load = abs(load) * s.load_scale
+        finished = None
+        if gate:
+            if self.window is None or (pass_no, part) != (self.window.pass_no, self.window.part):
+                finished = self.window
+                self.window = PassWindow(part, pass_no)
+            self.window.samples += 1
+            self.window.total += load
+        elif at_speed:
+            # spindle running between passes: idle load
+            if self.baseline is None:
+                self.baseline = load
+            else:
+                self.baseline += s.baseline_alpha * (load - self.baseline)
+        window = self.window
+        self.valid = (window is not None and self.baseline is not None
+                      and window.samples >= s.min_samples)
+        self.low = self.valid and self.net_load() < s.threshold
+        if finished is not None:
+            return finished, self.net_load(finished), pass_no, part
+        return None
+
+
+def append_log(window, net_load, baseline, threshold, next_pass, next_part):
+    new_file = not os.path.exists(LOG_FILE)
+    skipped = 0
+    if next_part == window.part and next_pass > window.pass_no + 1:
+        skipped = int(next_pass - window.pass_no - 1)
+    with open(LOG_FILE, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["time", "part", "pass", "samples", "net_load", "baseline", "low", "skipped"])
+        writer.writerow([time.strftime('%Y-%m-%d %H:%M:%S'), window.part, int(window.pass_no),
+                         window.samples, f"{net_load:.2f}", f"{baseline or 0.0:.2f}",
+                         int(net_load < threshold), skipped])
+
+
+def run():
+    import hal
+
+    settings = Settings()
+    comp = hal.component("spark-out")
+    comp.newpin("load", hal.HAL_FLOAT, hal.HAL_IN)
+    comp.newpin("gate", hal.HAL_BIT, hal.HAL_IN)
+    comp.newpin("pass", hal.HAL_FLOAT, hal.HAL_IN)
+    comp.newpin("part", hal.HAL_FLOAT, hal.HAL_IN)
+    comp.newpin("at-speed", hal.HAL_BIT, hal.HAL_IN)
+    comp.newpin("low", hal.HAL_BIT, hal.HAL_OUT)
+    comp.newpin("valid", hal.HAL_BIT, hal.HAL_OUT)
+    comp.newpin("pass-load", hal.HAL_FLOAT, hal.HAL_OUT)
+    comp.newpin("baseline", hal.HAL_FLOAT, hal.HAL_OUT)
+    comp.ready()
+
+    state = SparkOut(settings)
+    print(f"SPARKOUT: Spark-out below {settings.threshold}% net load")
+    try:
+        while True:
+            result = state.update(comp["load"], comp["gate"], round(comp["pass"]),
+                                  round(comp["part"]), comp["at-speed"])
+            comp["low"] = state.low
+            comp["valid"] = state.valid
+            comp["pass-load"] = state.net_load()
+            comp["baseline"] = state.baseline or 0.0
+            if result is not None:
+                window, net_load, next_pass, next_part = result
+                append_log(window, net_load, state.baseline, settings.threshold, next_pass, next_part)
+            time.sleep(POLL)
+    except KeyboardInterrupt:
+        if state.window is not None:
+            append_log(state.window, state.net_load(), state.baseline, settings.threshold, 0, None)
+
+
+def report(log_file=LOG_FILE):
+    loads = {}
+    parts = {}
+    with open(log_file, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            loads.setdefault(int(row["pass"]), []).append(float(row["net_load"]))
+            part = parts.setdefault(row["part"], [0, 0])
+            part[0] += 1
+            part[1] += int(row["skipped"])
+    if not loads:
+        print("SPARKOUT: No passes logged yet")
+        return
+    print("  pass      n   mean net load   min    max")
+    for pass_no, values in sorted(loads.items()):
+        print(f"  {pass_no:4d} {len(values):6d} {sum(values) / len(values):12.2f}% "
+              f"{min(values):6.2f} {max(values):6.2f}")
+    run_passes = sum(p[0] for p in parts.values())
+    skipped = sum(p[1] for p in parts.values())
+    shortened = sum(1 for p in parts.values() if p[1])
+    print(f"SPARKOUT: {len(parts)} part(s), {run_passes} passes run, {skipped} skipped "
+          f"({shortened} part(s) cut short)")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if command == "run":
+            run()
+        elif command == "report":
+            report(sys.argv[2] if len(sys.argv) > 2 else LOG_FILE)
+        else:
+            print(__doc__)
+            return 1
+    except (OSError, KeyError, ValueError) as e:
+        print(f"SPARKOUT: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
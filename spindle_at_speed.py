@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+spindle_at_speed.py - Spindle at-speed from the mb2hal VFD feedback
+
+file.ngc used to dwell a fixed g4 p5 after m3. This userspace HAL component
+compares the VFD speed feedback (mb2hal Motor_actual_speed) with the
+commanded speed and drives spindle.0.at-speed and motion.digital-in-03, so
+file.ngc can wait with M66 P3 L3 (#87 timeout) instead. At-speed is set once
+the error stays inside TOLERANCE for SETTLE seconds and is only dropped again
+when it grows past TOLERANCE + HYSTERESIS, so feedback noise does not chatter.
+Every spin-up is appended to spindle_log.csv with the part number in the
+series (#71 on motion.analog-out-01, see series_checkpoint.py).
+
+Settings in lathe.ini:
+    [SPINDLE_AT_SPEED]
+    TOLERANCE = 0.05        (fraction of the commanded speed)
+    HYSTERESIS = 0.03       (extra fraction before at-speed drops)
+    SETTLE = 0.2            (seconds inside TOLERANCE before at-speed)
+    TIMEOUT = 15            (seconds before a spin-up is logged as failed)
+    FEEDBACK_SCALE = 1      (feedback units to rpm)
+    STATUS_MASK = 0         (Drive_operation_status bits that must be set, 0 = ignore)
+
+HAL (spindle_to_gladevcp.hal):
+    loadusr -Wn spindle-at-speed python3 spindle_at_speed.py run
+    net spindle-rpm => spindle-at-speed.feedback
+    net pdnt.spindle-speed-abs => spindle-at-speed.command     (signal from whb04b.hal)
+    net S-on => spindle-at-speed.on
+    net spindle-at-speed spindle-at-speed.at-speed => motion.digital-in-03
+    net checkpoint-serie => spindle-at-speed.part
+Pins out: spindle-at-speed.spinup-seconds (last spin-up), .error (relative),
+          .timeouts (spin-ups not at speed within TIMEOUT)
+
+Usage:
+    python3 spindle_at_speed.py run
+    python3 spindle_at_speed.py report [spindle_log.csv]     (stats and suggested #87)
+"""
+
+import os
+import sys
+import csv
+import time
+
+from ini_config import IniConfig
+
+LOG_FILE = "/home/cnc/linuxcnc/configs/xzacw/spindle_log.csv"
+POLL = 0.01
+OLD_DWELL = 5.0       # g4 p5 that the M66 wait replaced
+
+
+class Settings:
+    def __init__(self, ini=None):
+        ini = ini or IniConfig()
+        self.tolerance = ini.find_float("SPINDLE_AT_SPEED", "TOLERANCE", 0.05)
+        self.hysteresis = ini.find_float("SPINDLE_AT_SPEED", "HYSTERESIS", 0.03)
+        self.settle = ini.find_float("SPINDLE_AT_SPEED", "SETTLE", 0.2)
+        self.timeout = ini.find_float("SPINDLE_AT_SPEED", "TIMEOUT", 15.0)
+        self.feedback_scale = ini.find_float("SPINDLE_AT_SPEED", "FEEDBACK_SCALE", 1.0)
+        self.status_mask = ini.find_int("SPINDLE_AT_SPEED", "STATUS_MASK", 0)
+
+
+class AtSpeed:
+    """At-speed state with hysteresis; update() returns a finished spin-up or None"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.at_speed = False
+        self.error = 0.0
+        self.spinup_start = None     # time of the spindle-on or command change
+        self.inside_since = None     # time the error entered the tolerance band
+        self.command = 0.0
+
+    def update(self, now, on, command, feedback, status=0):
+        s = self.settings
+        command = abs(command)
+        feedback = abs(feedback) * s.feedback_scale
+        if not on or command <= 0.0:
+            self.at_speed = False
+            self.spinup_start = None
+            self.inside_since = None
+            self.command = 0.0
+            self.error = 0.0
+            return None
+
+        if command != self.command:
+            # spindle on or new S word: a new spin-up starts
+            self.spinup_start = now
+            self.inside_since = None
+            self.at_speed = False
+            self.command = command
+
+        self.error = (feedback - command) / command
+        status_ok = (status & s.status_mask) == s.status_mask
+        limit = s.tolerance + (s.hysteresis if self.at_speed else 0.0)
+        inside = abs(self.error) <= limit and status_ok
+
+        if self.at_speed:
+            if not inside:
+                self.at_speed = False
+                self.inside_since = None
+            return None
+        if not inside:
+            self.inside_since = None
+        elif self.inside_since is None:
+            self.inside_since = now
+        if self.inside_since is not None and now - self.inside_since >= s.settle:
+            self.at_speed = True
+            if self.spinup_start is not None:
+                seconds = now - self.spinup_start
+                self.spinup_start = None
+                return (command, seconds, True)
+        elif self.spinup_start is not None and now - self.spinup_start > s.timeout:
+            seconds = now - self.spinup_start
+            self.spinup_start = None
+            return (command, seconds, False)
+        return None
+
+
+def append_log(part, command, seconds, confirmed):
+    new_file = not os.path.exists(LOG_FILE)
+    with open(LOG_FILE, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["time", "part", "command_rpm", "seconds", "confirmed"])
+        writer.writerow([time.strftime('%Y-%m-%d %H:%M:%S'), part, f"{command:.0f}",
+                         f"{seconds:.3f}", int(confirmed)])
+
+
+def run():
+    import hal
+
+    settings = Settings()
+    comp = hal.component("spindle-at-speed")
+    comp.newpin("command", hal.HAL_FLOAT, hal.HAL_IN)
+    comp.newpin("feedback", hal.HAL_FLOAT, hal.HAL_IN)
+    comp.newpin("on", hal.HAL_BIT, hal.HAL_IN)
+    comp.newpin("status", hal.HAL_S32, hal.HAL_IN)
+    comp.newpin("part", hal.HAL_FLOAT, hal.HAL_IN)
+    comp.newpin("at-speed", hal.HAL_BIT, hal.HAL_OUT)
+    comp.newpin("error", hal.HAL_FLOAT, hal.HAL_OUT)
+    comp.newpin("spinup-seconds", hal.HAL_FLOAT, hal.HAL_OUT)
+    comp.newpin("timeouts", hal.HAL_S32, hal.HAL_OUT)
+    comp.ready()
+
+    state = AtSpeed(settings)
+    print(f"SPINDLE: At-speed within {settings.tolerance:.0%} "
+          f"(+{settings.hysteresis:.0%} hysteresis), timeout {settings.timeout}s")
+    try:
+        while True:
+            result = state.update(time.monotonic(), comp["on"], comp["command"],
+                                  comp["feedback"], comp["status"])
+            comp["at-speed"] = state.at_speed
+            comp["error"] = state.error
+            if result is not None:
+                command, seconds, confirmed = result
+                if confirmed:
+                    comp["spinup-seconds"] = seconds
+                else:
+                    comp["timeouts"] += 1
+                    print(f"SPINDLE: Not at {command:.0f} rpm within {settings.timeout}s")
+                append_log(round(comp["part"]), command, seconds, confirmed)
+            time.sleep(POLL)
+    except KeyboardInterrupt:
+        pass
+
+
+def report(log_file=LOG_FILE):
+    times = []
+    failed = 0
+    with open(log_file, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            if row["confirmed"] != "1":
+                failed += 1
+                continue
+            times.append(float(row["seconds"]))
+    if not times:
+        print("SPINDLE: No confirmed spin-ups logged yet")
+        return
+    times.sort()
+    p99 = times[min(len(times) - 1, int(0.99 * len(times)))]
+    mean = sum(times) / len(times)
+    print(f"  spin-up n={len(times):5d} min={times[0]:.3f}s median={times[len(times) // 2]:.3f}s "
+          f"mean={mean:.3f}s p99={p99:.3f}s max={times[-1]:.3f}s")
+    print(f"SPINDLE: {failed} spin-up(s) not at speed in time")
+    print(f"SPINDLE: Saved {OLD_DWELL - mean:.2f}s per part against g4 p{OLD_DWELL:g}")
+    print(f"SPINDLE: Suggested file.ngc timeout #87={max(1.0, round(p99 * 2.0, 1))} (2 x p99)")
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if command == "run":
+            run()
+        elif command == "report":
+            report(sys.argv[2] if len(sys.argv) > 2 else LOG_FILE)
+        else:
+            print(__doc__)
+            return 1
+    except (OSError, KeyError, ValueError) as e:
+        print(f"SPINDLE: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
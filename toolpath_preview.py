@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+toolpath_preview.py - X/Z/C profile thumbnails of the generated <type>.ngc
+
+Draws the finishing pass (#7 = 0) of a generated sub from its g93 segment
+table (segment_table.py): X over Z on top and C over Z below. PNGs are
+cached in .preview_cache/ by the sha256 of the program text, so an
+unchanged program is never drawn twice and a regenerated one is drawn once.
+
+PreviewRenderer does the hashing and drawing in one worker thread; the
+GladeVCP handler passes GLib.idle_add as deliver so the result callback
+runs in the GTK main loop, which never waits on rendering.
+
+Usage:
+    python3 toolpath_preview.py <program.ngc> [out.png] [width] [height]
+"""
+
+import os
+import sys
+import queue
+import hashlib
+import threading
+
+import numpy as np
+
+from segment_table import parse_program
+
+MAIN_FOLDER = "/home/cnc/linuxcnc/configs/xzacw"
+CACHE_DIR = os.path.join(MAIN_FOLDER, ".preview_cache")
+DEFAULT_SIZE = (160, 120)
+MARGIN = 4
+
+
+def program_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _plot(ctx, z, values, x0, y0, width, height, color):
+    """Polyline of values over z scaled into the given box"""
+    z_min, z_max = float(z.min()), float(z.max())
+    v_min, v_max = float(values.min()), float(values.max())
+    z_span = (z_max - z_min) or 1.0
+    v_span = (v_max - v_min) or 1.0
+    px = x0 + (z - z_min) / z_span * width
+    py = y0 + height - (values - v_min) / v_span * height
+    ctx.set_source_rgb(*color)
+    ctx.move_to(px[0], py[0])
+    for x, y in zip(px[1:], py[1:]):
+        ctx.line_to(x, y)
+    ctx.stroke()
+
+
+def render_preview(program, out_png, size=DEFAULT_SIZE):
+    """Write the thumbnail of one program; returns False when it has no g93 blocks"""
+    import cairo
+
+    table = parse_program(program)
+    width, height = size
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    ctx = cairo.Context(surface)
+    ctx.set_source_rgb(1.0, 1.0, 1.0)
+    ctx.paint()
+    ctx.set_line_width(1.0)
+
+    if len(table) == 0:
+        ctx.set_source_rgb(0.6, 0.0, 0.0)
+        ctx.move_to(MARGIN, height / 2)
+        ctx.show_text("no profile")
+        surface.write_to_png(out_png)
+        return False
+
+    # start of the first block plus every block end, along Z
+    z = np.concatenate(([table.start[0, 1]], table.axis("z")))
+    x = np.concatenate(([table.start[0, 0]], table.axis("x")))
+    c = np.concatenate(([table.start[0, 3]], table.axis("c")))
+
+    box_w = width - 2 * MARGIN
+    box_h = (height - 3 * MARGIN) / 2.0
+    ctx.set_source_rgb(0.85, 0.85, 0.85)
+    ctx.rectangle(MARGIN, MARGIN, box_w, box_h)
+    ctx.rectangle(MARGIN, 2 * MARGIN + box_h, box_w, box_h)
+    ctx.stroke()
+    _plot(ctx, z, x, MARGIN, MARGIN, box_w, box_h, (0.0, 0.2, 0.8))
+    _plot(ctx, z, c, MARGIN, 2 * MARGIN + box_h, box_w, box_h, (0.8, 0.3, 0.0))
+
+    ctx.set_source_rgb(0.3, 0.3, 0.3)
+    ctx.set_font_size(9)
+    ctx.move_to(MARGIN + 2, MARGIN + 9)
+    ctx.show_text(f"X  {x.min():.3f}..{x.max():.3f}")
+    ctx.move_to(MARGIN + 2, 2 * MARGIN + box_h + 9)
+    ctx.show_text(f"C  {c.min():.1f}..{c.max():.1f}")
+
+    tmp_png = f"{out_png}.{os.getpid()}.tmp"
+    surface.write_to_png(tmp_png)
+    os.replace(tmp_png, out_png)
+    return True
+
+
+def cached_preview(program, size=DEFAULT_SIZE, cache_dir=CACHE_DIR):
+    """Thumbnail path for the current program content, rendering it if needed"""
+    os.makedirs(cache_dir, exist_ok=True)
+    png = os.path.join(cache_dir, f"{program_hash(program)}-{size[0]}x{size[1]}.png")
+    if not os.path.exists(png):
+        render_preview(program, png, size)
+    return png
+
+
+class PreviewRenderer:
+    """One worker thread; only the newest request per key is rendered"""
+
+    def __init__(self, deliver=None, size=DEFAULT_SIZE, cache_dir=CACHE_DIR):
+        self.deliver = deliver or (lambda callback, *args: callback(*args))
+        self.size = size
+        self.cache_dir = cache_dir
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="toolpath-preview", daemon=True)
+        self.thread.start()
+
+    def request(self, key, program, callback):
+        """callback(key, png_path or None) is delivered once the thumbnail exists"""
+        self.requests.put((key, program, callback))
+
+    def _run(self):
+        while True:
+            pending = {}
+            item = self.requests.get()
+            pending[item[0]] = item
+            # coalesce: fast type switches only render the last selection
+            while True:
+                try:
+                    item = self.requests.get_nowait()
+                    pending[item[0]] = item
+                except queue.Empty:
+                    break
+            for key, program, callback in pending.values():
+                try:
+                    png = cached_preview(program, self.size, self.cache_dir)
+                except Exception as e:
+                    print(f"PREVIEW: {key} failed: {e}")
+                    png = None
+                self.deliver(callback, key, png)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    program = sys.argv[1]
+    size = DEFAULT_SIZE
+    if len(sys.argv) > 4:
+        size = (int(sys.argv[3]), int(sys.argv[4]))
+    try:
+        if len(sys.argv) > 2:
+            render_preview(program, sys.argv[2], size)
+            print(f"PREVIEW: Wrote {sys.argv[2]}")
+        else:
+            print(f"PREVIEW: {cached_preview(program, size)}")
+    except (OSError, ValueError, ImportError) as e:
+        print(f"PREVIEW: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+toolpath_store.py - Versioned store of the generated workpiece programs
+
+Every program generate_program() swaps in (M118, regen_worker) is committed
+as a new version of its type; operators can commit by hand, and the
+hand-saved generations in "old files/" can be imported once.
+
+A version is split into a text template (the program with the numbers of
+its g93 lines replaced by placeholders) and the numbers themselves as
+fixed-point integers, code = 3 * digits + sign (0 none, 1 '-', 2 '+') plus
+the decimal count, so "z-0.00000" comes back exactly. When the numbers
+line up with the previous version (same count and decimals) only the
+integer differences are stored, otherwise a keyframe; every KEYFRAME_EVERY
+versions is a keyframe too. A template is stored only when it changed.
+Objects are compressed .npz files.
+
+Store layout (toolpath_store/<TYPE>/):
+    index.json      versions: number, time, source, sha256, kind, base, template
+    v0001.npz       codes (absolute or delta), decimals, template (keyframes / changed templates)
+
+Usage:
+    python3 toolpath_store.py commit <TYPE> <program.ngc> [source]
+    python3 toolpath_store.py log <TYPE>
+    python3 toolpath_store.py diff <TYPE> <version_a> <version_b>   (max X/Z/C deviation, feed changes)
+    python3 toolpath_store.py show <TYPE> <version> [out.ngc]
+    python3 toolpath_store.py rollback <TYPE> <version>              (restore as the live <type>.ngc)
+    python3 toolpath_store.py import ["old files" folder]
+Versions may be given as numbers or as -1 (latest), -2 (previous), ...
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+
+import numpy as np
+
+from segment_table import parse_program
+
+MAIN_FOLDER = "/home/cnc/linuxcnc/configs/xzacw"
+STORE_DIR = os.path.join(MAIN_FOLDER, "toolpath_store")
+KEYFRAME_EVERY = 10
+PLACEHOLDER = "\x00"
+NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)')
+# numbers after these are codes, parameters or line numbers, not values
+NOT_A_VALUE = "gmnoGMNO#"
+# old files names: <type>[_...][_v<NN>][_<date>].ngc, e.g. s1_v01_2025-07-07.ngc, fii_p08-25_01_v11.ngc
+OLD_FILE_TYPE = re.compile(r'^[a-z0-9]+', re.IGNORECASE)
+OLD_FILE_VERSION = re.compile(r'_v(\d+)')
+OLD_FILE_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+SIGNS = {"": 0, "-": 1, "+": 2}
+SIGN_TEXT = ["", "-", "+"]
+
+
+# ---------------------------
+# program <-> template + numbers
+# ---------------------------
+def format_number(code, decimals):
+    digits = str(code // 3)
+    if decimals:
+        digits = digits.rjust(decimals + 1, "0")
+        digits = f"{digits[:-decimals]}.{digits[-decimals:]}"
+    return SIGN_TEXT[code % 3] + digits
+
+
+def split_line(line):
+    """g93 line -> (template, codes, decimals); None when it does not round-trip"""
+    template = []
+    codes = []
+    decimals = []
+    last = 0
+    for match in NUMBER.finditer(line):
+        if match.start() > 0 and line[match.start() - 1] in NOT_A_VALUE:
+            continue
+        text = match.group(0)
+        sign = text[0] if text[0] in "+-" else ""
+        body = text[len(sign):]
+        whole, _, fraction = body.partition(".")
+        if "." in body and not fraction or not whole:
+            return None  # "5." or ".5": keep the line as text
+        code = 3 * int(whole + fraction) + SIGNS[sign]
+        if format_number(code, len(fraction)) != text:
+            return None
+        template.append(line[last:match.start()])
+        template.append(PLACEHOLDER)
+        codes.append(code)
+        decimals.append(len(fraction))
+        last = match.end()
+    template.append(line[last:])
+    return "".join(template), codes, decimals
+
+
+def split_program(text):
+    """Program text -> (template text, int64 codes, uint8 decimals)"""
+    template_lines = []
+    codes = []
+    decimals = []
+    for line in text.splitlines(keepends=True):
+        if PLACEHOLDER not in line and line.lstrip().lower().startswith("g93"):
+            split = split_line(line)
+            if split:
+                template_lines.append(split[0])
+                codes.extend(split[1])
+                decimals.extend(split[2])
+                continue
+        template_lines.append(line)
+    return "".join(template_lines), np.array(codes, dtype=np.int64), np.array(decimals, dtype=np.uint8)
+
+
+def join_program(template, codes, decimals):
+    parts = template.split(PLACEHOLDER)
+    out = [parts[0]]
+    for k in range(len(codes)):
+        out.append(format_number(int(codes[k]), int(decimals[k])))
+        out.append(parts[k + 1])
+    return "".join(out)
+
+
+# ---------------------------
+# store
+# ---------------------------
+class ToolpathStore:
+    def __init__(self, file_type, store_dir=STORE_DIR):
+        self.file_type = file_type.upper()
+        self.type_dir = os.path.join(store_dir, self.file_type)
+        self.index_file = os.path.join(self.type_dir, "index.json")
+        self.versions = []
+        self._cache = {}
+        try:
+            with open(self.index_file, "r") as f:
+                self.versions = json.load(f)["versions"]
+        except (OSError, ValueError, KeyError):
+            self.versions = []
+
+    def save_index(self):
+        os.makedirs(self.type_dir, exist_ok=True)
+        tmp_file = self.index_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"version": 1, "versions": self.versions}, f, indent=1)
+        os.replace(tmp_file, self.index_file)
+
+    def object_path(self, number):
+        return os.path.join(self.type_dir, f"v{number:04d}.npz")
+
+    def resolve(self, version):
+        """Version number from '3' or '-1' (latest)"""
+        number = int(version)
+        if number < 0:
+            number = self.versions[number]["number"]
+        if not any(v["number"] == number for v in self.versions):
+            raise ValueError(f"{self.file_type} has no version {version}")
+        return number
+
+    def entry(self, number):
+        return next(v for v in self.versions if v["number"] == number)
+
+    def commit(self, program, source="generated", created=None):
+        """Add a program as the next version; returns its number (None if unchanged)"""
+        with open(program, "r") as f:
+            text = f.read()
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        if self.versions and self.versions[-1]["sha256"] == digest:
+            return None
+
+        template, codes, decimals = split_program(text)
+        number = self.versions[-1]["number"] + 1 if self.versions else 1
+        arrays = {"decimals": decimals}
+        entry = {"number": number, "created": created or time.strftime('%Y-%m-%d %H:%M:%S'),
+                 "source": source, "sha256": digest, "values": int(len(codes)), "size": len(text)}
+
+        previous = self.versions[-1] if self.versions else None
+        same_template = aligned = False
+        if previous is not None:
+            prev_template, prev_codes, prev_decimals = self.load(previous["number"])
+            same_template = prev_template == template
+            aligned = np.array_equal(prev_decimals, decimals)
+        if aligned and (number - 1) % KEYFRAME_EVERY != 0:
+            arrays["codes"] = codes - prev_codes
+            entry.update(kind="delta", base=previous["number"])
+        else:
+            arrays["codes"] = codes
+            entry.update(kind="key", base=None)
+        entry["template"] = previous["template"] if same_template else number
+        if entry["template"] == number:
+            arrays["template"] = np.frombuffer(template.encode(), dtype=np.uint8)
+
+        os.makedirs(self.type_dir, exist_ok=True)
+        tmp_file = self.object_path(number) + ".tmp.npz"
+        np.savez_compressed(tmp_file, **arrays)
+        os.replace(tmp_file, self.object_path(number))
+        self.versions.append(entry)
+        self.save_index()
+        self._cache[number] = (template, codes, decimals)
+        return number
+
+    def load(self, number):
+        """(template, codes, decimals) of a version"""
+        if number in self._cache:
+            return self._cache[number]
+        entry = self.entry(number)
+        with np.load(self.object_path(number)) as data:
+            codes = data["codes"]
+            decimals = data["decimals"]
+            template = data["template"].tobytes().decode() if "template" in data.files else None
+        if entry["kind"] == "delta":
+            codes = self.load(entry["base"])[1] + codes
+        if template is None:
+            template = self.load(entry["template"])[0]
+        self._cache[number] = (template, codes, decimals)
+        return self._cache[number]
+
+    def text(self, number):
+        text = join_program(*self.load(number))
+        if hashlib.sha256(text.encode()).hexdigest() != self.entry(number)["sha256"]:
+            raise ValueError(f"{self.file_type} v{number} does not match its checksum")
+        return text
+
+    def diff(self, number_a, number_b):
+        """Deviation between two versions from their g93 segment tables"""
+        table_a = parse_program(text=self.text(number_a))
+        table_b = parse_program(text=self.text(number_b))
+        result = {"blocks": (len(table_a), len(table_b))}
+        if len(table_a) == 0 or len(table_b) == 0:
+            return result
+        if len(table_a) == len(table_b):
+            for axis in "xzc":
+                result[f"max_d{axis}"] = float(np.abs(table_a.axis(axis) - table_b.axis(axis)).max())
+            changed = np.abs(table_a.feed - table_b.feed) > 1e-9
+            result["feed_changed"] = int(changed.sum())
+            result["max_dfeed"] = float(np.abs(table_a.feed - table_b.feed).max())
+            result["matched_by"] = "block"
+        else:
+            # different block counts: compare X and C as functions of Z
+            z_a, z_b = table_a.axis("z"), table_b.axis("z")
+            order = np.argsort(z_b)
+            for axis in "xc":
+                b_on_a = np.interp(z_a, z_b[order], table_b.axis(axis)[order])
+                result[f"max_d{axis}"] = float(np.abs(table_a.axis(axis) - b_on_a).max())
+            result["max_dz"] = float(abs(z_a.min() - z_b.min()) + abs(z_a.max() - z_b.max()))
+            result["matched_by"] = "z"
+        time_a = table_a.block_times().sum()
+        time_b = table_b.block_times().sum()
+        result["pass_time"] = (float(time_a), float(time_b))
+        return result
+
+    def checkout(self, number, target):
+        tmp_file = f"{target}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as f:
+            f.write(self.text(number))
+        os.replace(tmp_file, target)
+
+
+def commit_program(file_type, program, source="generated"):
+    """Hook for generate_program(); never raises"""
+    try:
+        number = ToolpathStore(file_type).commit(program, source)
+        if number:
+            print(f"STORE: {file_type} -> v{number}")
+        return number
+    except Exception as e:
+        print(f"STORE: Warning - {file_type} not stored: {e}")
+        return None
+
+
+def import_old_files(folder):
+    """Commit the hand-saved generations in date/version order"""
+    found = []
+    for name in os.listdir(folder):
+        type_match = OLD_FILE_TYPE.match(name)
+        if not name.lower().endswith(".ngc") or not type_match:
+            continue
+        path = os.path.join(folder, name)
+        date_match = OLD_FILE_DATE.search(name)
+        date = date_match.group(0) if date_match else time.strftime('%Y-%m-%d', time.localtime(os.path.getmtime(path)))
+        versions = OLD_FILE_VERSION.findall(name)
+        found.append((type_match.group(0).upper(), date, int(versions[-1]) if versions else 0, name, path))
+    found.sort()
+    count = 0
+    stores = {}
+    for file_type, date, _, name, path in found:
+        store = stores.setdefault(file_type, ToolpathStore(file_type))
+        if store.commit(path, f"import {name}", f"{date} 00:00:00"):
+            count += 1
+    print(f"STORE: Imported {count} of {len(found)} file(s) into {len(stores)} type(s)")
+
+
+def print_log(store):
+    for v in store.versions:
+        size = os.path.getsize(store.object_path(v["number"]))
+        print(f"  v{v['number']:<4d} {v['created']}  {v['kind']:5s} {size:7d} B (of {v['size']})  {v['source']}")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return 1
+    command = sys.argv[1]
+    try:
+        if command == "import":
+            import_old_files(sys.argv[2] if len(sys.argv) > 2 else os.path.join(MAIN_FOLDER, "old files"))
+            return 0
+        store = ToolpathStore(sys.argv[2])
+        if command == "commit":
+            number = store.commit(sys.argv[3], sys.argv[4] if len(sys.argv) > 4 else "operator")
+            print(f"STORE: {store.file_type} v{number}" if number else "STORE: Unchanged, nothing committed")
+        elif command == "log":
+            print_log(store)
+        elif command == "diff":
+            a, b = store.resolve(sys.argv[3]), store.resolve(sys.argv[4])
+            result = store.diff(a, b)
+            print(f"STORE: {store.file_type} v{a} -> v{b}")
+            for key, value in result.items():
+                print(f"  {key}: {value}")
+        elif command == "show":
+            number = store.resolve(sys.argv[3])
+            if len(sys.argv) > 4:
+                store.checkout(number, sys.argv[4])
+            else:
+                sys.stdout.write(store.text(number))
+        elif command == "rollback":
+            number = store.resolve(sys.argv[3])
+            target = os.path.join(MAIN_FOLDER, f"{store.file_type.lower()}.ngc")
+            store.checkout(number, target)
+            store.commit(target, f"rollback to v{number}")
+            print(f"STORE: {target} rolled back to v{number}")
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError, KeyError) as e:
+        print(f"STORE: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+vector_emitter.py - NumPy g93 emitter and (stepsize, maxfeed, x_steps) sweeps
+
+Re-emits a generated <type>.ngc for other create_CNC_code parameters without
+the ESLH pipeline: the finishing-pass profile (X, C over Z) of the existing
+program is resampled at the new stepsize with np.interp, the inverse-time
+feeds follow the create_CNC_code ramp (measured on the current programs)
+
+    d = 10 * maxfeed / blocks
+    F[i] = min(maxfeed, 0.1 * maxfeed + 3 * d * i, 0.5 * maxfeed + d * (blocks - i))
+
+and all g93 blocks are formatted with one %-operation over the flattened
+arrays. Like create_CNC_code, Z gets int(length / stepsize) equally spaced
+blocks (truncated in floating point: 12.4 / 0.2 gives 62 blocks for sx,
+16.4 / 0.2 = 81.999.. gives 81 for the others). x_steps rewrites
+the o202 pass table (#7) by resampling the 6-pass removal curve; file.ngc
+#80 has to match it.
+
+A sweep takes lists of values and reports every combination: block count,
+programmed time per pass (sum of 60 / F) and predicted time per pass, where
+each block takes at least its joint-limited time from feed_optimizer.py.
+Geometry is resampled once per stepsize and the feeds of all maxfeeds are
+computed as one 2-D array.
+
+Usage:
+    python3 vector_emitter.py emit <program.ngc> <out.ngc> [stepsize maxfeed x_steps]
+    python3 vector_emitter.py sweep <program.ngc> <stepsizes> <maxfeeds> <x_steps> [out_dir]
+Lists are comma separated or start:stop:step, e.g.
+    python3 vector_emitter.py sweep sx.ngc 0.1:0.4:0.05 500,625,750,900 4,5,6 sweep_sx
+Defaults for emit come from lathe.ini [GENERATOR].
+"""
+
+import os
+import sys
+import csv
+
+import numpy as np
+
+from segment_table import parse_program, AXES
+from feed_optimizer import read_joint_limits, optimize_times
+
+BLOCK_FORMAT = "g93 g01 x[%.5f+#7*[#11-%.5f]] z%.5f c%.5f f[%.5f]\n"
+# cumulative share of the stock removed after pass 1..6 in the current programs (x_steps = 6)
+PASS_REMOVAL = [0.3, 0.55, 0.76, 0.89, 0.95, 1.0]
+FLUTES = 3
+
+
+class Profile:
+    """Finishing-pass profile of a program plus the text around its g93 blocks"""
+
+    def __init__(self, program):
+        table = parse_program(program)
+        if len(table) == 0:
+            raise ValueError(f"no g93 blocks in {program}")
+        first, last = int(table.line_index[0]), int(table.line_index[-1])
+        if last - first + 1 != len(table):
+            raise ValueError(f"g93 blocks of {program} are not one run")
+        self.name = os.path.splitext(os.path.basename(program))[0]
+        self.header = table.lines[:first]
+        self.footer = table.lines[last + 1:]
+        self.z = table.axis("z").copy()
+        self.x = table.axis("x").copy()
+        self.c = table.axis("c").copy()
+        # create_CNC_code prints the equal Z steps rounded to 5 decimals (12.4 / 61 for
+        # sx); interpolating on the rounded points shifts the steep C by up to 8e-4
+        grid = np.linspace(self.z[0], self.z[-1], len(self.z))
+        if np.abs(grid - self.z).max() <= 0.6e-5:
+            self.z = grid
+
+    def resample(self, stepsize):
+        """(z, x, c) with the block count of create_CNC_code; the first block is the zero-length start"""
+        length = abs(self.z[-1] - self.z[0])
+        blocks = max(2, int(length / stepsize))
+        z = np.linspace(self.z[0], self.z[-1], blocks)
+        # np.interp needs increasing sample points; Z runs negative
+        direction = 1.0 if self.z[-1] >= self.z[0] else -1.0
+        x = np.interp(direction * z, direction * self.z, self.x)
+        c = np.interp(direction * z, direction * self.z, self.c)
+        return z, x, c
+
+
+def ramp_feeds(blocks, maxfeeds):
+    """create_CNC_code feed ramp; maxfeeds scalar or 1-D gives shape (len(maxfeeds), blocks)"""
+    maxfeed = np.atleast_1d(np.asarray(maxfeeds, dtype=np.float64))[:, None]
+    i = np.arange(blocks, dtype=np.float64)[None, :]
+    d = 10.0 * maxfeed / blocks
+    return np.minimum(maxfeed, np.minimum(0.1 * maxfeed + 3.0 * d * i, 0.5 * maxfeed + d * (blocks - i)))
+
+
+def format_blocks(z, x, c, f):
+    """All g93 lines in one formatting call"""
+    values = np.column_stack((x, x, z, c, f)).ravel().tolist()
+    return (BLOCK_FORMAT * len(z)) % tuple(values)
+
+
+def _share_text(value):
+    text = f"{value:.2f}".rstrip("0")
+    return text[1:] if text.startswith("0") else text
+
+
+def pass_table(header, x_steps):
+    """Header with the o202 pass table rewritten for x_steps passes"""
+    try:
+        start = next(i for i, line in enumerate(header) if line.startswith("o202 if"))
+        end = next(i for i, line in enumerate(header) if line.startswith("o202 endif"))
+    except StopIteration:
+        return list(header)
+    # extra moves of the second pass (z.5 / c360 lead-in) are kept as they are
+    extra = []
+    in_second = False
+    for line in header[start:end]:
+        if line.startswith("o202"):
+            in_second = "EQ 2]" in line
+        elif in_second and not line.startswith("#7="):
+            extra.append(line)
+
+    grid = np.linspace(0.0, 1.0, len(PASS_REMOVAL) + 1)
+    removal = np.interp(np.arange(1, x_steps + 1) / x_steps, grid, [0.0] + PASS_REMOVAL)
+    shares = np.diff(np.concatenate(([0.0], removal)))
+    table = []
+    for k in range(1, x_steps + 1):
+        table.append(f"o202 {'if' if k == 1 else 'elseif'} [#2 EQ {k}]\n")
+        if k == x_steps:
+            table.append("#7=0\n")
+        else:
+            table.append("#7=[1-" + "-".join(_share_text(s) for s in shares[:k]) + "]\n")
+        if k == 2:
+            table.extend(extra)
+    return list(header[:start]) + table + list(header[end:])
+
+
+def emit(profile, stepsize, maxfeed, x_steps):
+    """Program text for one parameter set"""
+    z, x, c = profile.resample(stepsize)
+    f = ramp_feeds(len(z), maxfeed)[0]
+    return "".join(pass_table(profile.header, x_steps)) + format_blocks(z, x, c, f) + "".join(profile.footer)
+
+
+def block_deltas(z, x, c):
+    """Per-block moves in AXES order, the first block starting where it ends"""
+    end = np.zeros((len(z), len(AXES)))
+    end[:, AXES.index("z")] = z
+    end[:, AXES.index("x")] = x
+    end[:, AXES.index("c")] = c
+    start = np.vstack((end[:1], end[:-1]))
+    return end - start
+
+
+def sweep(profile, stepsizes, maxfeeds, x_steps_list, limits=None):
+    """One result row per (stepsize, maxfeed, x_steps)"""
+    if limits is None:
+        limits, _ = read_joint_limits()
+    maxfeeds = np.asarray(maxfeeds, dtype=np.float64)
+    rows = []
+    for stepsize in stepsizes:
+        z, x, c = profile.resample(stepsize)
+        blocks = len(z)
+        feasible, _ = optimize_times(block_deltas(z, x, c), limits)
+        feeds = ramp_feeds(blocks, maxfeeds)                  # (maxfeeds, blocks)
+        programmed = 60.0 / feeds
+        programmed[:, 0] = 0.0                                # zero-length start block
+        predicted = np.maximum(programmed, feasible[None, :])
+        for j, maxfeed in enumerate(maxfeeds):
+            for x_steps in x_steps_list:
+                rows.append({
+                    "stepsize": float(stepsize), "maxfeed": float(maxfeed), "x_steps": int(x_steps),
+                    "blocks": blocks,
+                    "programmed_pass_s": float(programmed[j].sum()),
+                    "predicted_pass_s": float(predicted[j].sum()),
+                    "predicted_part_s": float(predicted[j].sum()) * int(x_steps) * FLUTES,
+                })
+    return rows
+
+
+def variant_name(name, row):
+    return f"{name}_s{row['stepsize']:g}_f{row['maxfeed']:g}_x{row['x_steps']}.ngc"
+
+
+def write_sweep(profile, rows, out_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "sweep.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file"] + list(rows[0]))
+        for row in rows:
+            name = variant_name(profile.name, row)
+            with open(os.path.join(out_dir, name), "w") as program:
+                program.write(emit(profile, row["stepsize"], row["maxfeed"], row["x_steps"]))
+            writer.writerow([name] + [f"{v:.3f}" if isinstance(v, float) else v for v in row.values()])
+
+
+def parse_values(text, kind=float):
+    """'a,b,c' or 'start:stop:step' (stop included)"""
+    if ":" in text:
+        start, stop, step = (float(v) for v in text.split(":"))
+        values = np.arange(start, stop + step / 2.0, step)
+        return [kind(round(v, 6)) for v in values]
+    return [kind(v) for v in text.split(",") if v]
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if command == "emit" and len(sys.argv) in (4, 7):
+            profile = Profile(sys.argv[2])
+            if len(sys.argv) == 7:
+                stepsize, maxfeed, x_steps = float(sys.argv[4]), float(sys.argv[5]), int(sys.argv[6])
+            else:
+                from regen_worker import get_generator_params
+                params = get_generator_params()
+                stepsize, maxfeed, x_steps = params["stepsize"], params["maxfeed"], params["x_steps"]
+            text = emit(profile, stepsize, maxfeed, x_steps)
+            tmp_file = sys.argv[3] + ".tmp"
+            with open(tmp_file, "w") as f:
+                f.write(text)
+            os.replace(tmp_file, sys.argv[3])
+            print(f"VEMIT: Wrote {sys.argv[3]} (stepsize {stepsize:g}, maxfeed {maxfeed:g}, x_steps {x_steps})")
+        elif command == "sweep" and len(sys.argv) in (6, 7):
+            profile = Profile(sys.argv[2])
+            rows = sweep(profile, parse_values(sys.argv[3]), parse_values(sys.argv[4]),
+                         parse_values(sys.argv[5], int))
+            print("  stepsize  maxfeed  x_steps  blocks  programmed/pass  predicted/pass  predicted/part")
+            for row in sorted(rows, key=lambda r: r["predicted_part_s"]):
+                print(f"  {row['stepsize']:8g} {row['maxfeed']:8g} {row['x_steps']:8d} {row['blocks']:7d} "
+                      f"{row['programmed_pass_s']:15.2f}s {row['predicted_pass_s']:14.2f}s "
+                      f"{row['predicted_part_s']:14.1f}s")
+            if len(sys.argv) == 7:
+                write_sweep(profile, rows, sys.argv[6])
+                print(f"VEMIT: Wrote {len(rows)} variants and sweep.csv to {sys.argv[6]}")
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError) as e:
+        print(f"VEMIT: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
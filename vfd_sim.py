@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+vfd_sim.py - Modbus RTU stand-in for the MS300 spindle drive behind mb2hal.ini
+
+Serves the registers mb2hal.ini uses on a pseudo-terminal, with the serial
+timing of the configured link: every response is held back for the wire
+time of the request and the response at SERIAL_BAUD (start, data, parity
+and stop bits per character), the 3.5 character frame gap and a drive
+processing time. Functions 03, 06 and 16 are answered; other functions and
+unknown registers get Modbus exceptions.
+
+The drive model ramps the output frequency at ACCEL/DECEL seconds per
+MAX_FREQUENCY, reports speed (rpm = Hz * 120 / POLES), V/f voltage, torque
+and power, and the operation status word of 2101H. 2002H bit 0 (EF) or
+FAULT_AFTER seconds of running trips it: the output coasts down, 2100H holds
+the fault code and run commands are ignored until 2002H bit 1 (reset).
+
+    2000H  Operation_command   bit 0-1 01 stop / 10 run, bit 4-5 01 fwd / 10 rev
+    2001H  Frequency_command   0.01 Hz
+    2002H  Fault_control       bit 0 external fault, bit 1 reset
+    2100H  Fault_status        fault code, 0 = none
+    2101H  Drive_operation_status  bit 0-1 00 stop 01 decel 10 standby 11 run,
+                               bit 3-4 direction, bit 8/10 frequency/command from comm
+    2103H  Output_frequency    0.01 Hz        2106H  Output_voltage  0.1 V
+    210BH  Output_torque       0.1 %          2206H  Power_output    0.001 kW
+    2207H  Motor_actual_speed  rpm
+
+bench runs the mb2hal transaction loop of mb2hal.ini (order, SERIAL_DELAY_MS
+between frames, MAX_UPDATE_RATE per transaction) with a Python RTU client
+against the simulator for the given seconds, starts the spindle like m3 s3000
+and reports achieved transaction rates, the refresh period of every read
+register and the command-to-feedback latencies. serve keeps the simulator
+running and writes a copy of mb2hal.ini pointing at the pty, for running the
+real mb2hal against it.
+
+Settings in lathe.ini:
+    [VFD_SIM]
+    ACCEL = 2.0             (seconds 0 -> MAX_FREQUENCY)
+    DECEL = 2.0
+    MAX_FREQUENCY = 200     (Pr.01-00)
+    POLES = 2               (Pr.05-04)
+    RATED_VOLTAGE = 220     (Pr.01-02)
+    RATED_POWER = 0.375     (Pr.05-02, kW)
+    RESPONSE_MS = 2         (drive processing time per request)
+    FAULT_AFTER = 0         (seconds of running before an overload trip, 0 = never)
+
+Usage:
+    python3 vfd_sim.py bench [seconds] [mb2hal.ini]
+    python3 vfd_sim.py serve [mb2hal.ini]
+"""
+
+import os
+import sys
+import time
+import tty
+import select
+import struct
+import termios
+import threading
+
+from ini_config import IniConfig
+
+MAIN_FOLDER = "/home/cnc/linuxcnc/configs/xzacw"
+MB2HAL_INI = os.path.join(MAIN_FOLDER, "mb2hal.ini")
+
+REG_COMMAND = 0x2000
+REG_FREQUENCY = 0x2001
+REG_FAULT_CONTROL = 0x2002
+REG_FAULT = 0x2100
+REG_STATUS = 0x2101
+REG_OUTPUT_FREQUENCY = 0x2103
+REG_OUTPUT_VOLTAGE = 0x2106
+REG_OUTPUT_TORQUE = 0x210B
+REG_POWER = 0x2206
+REG_SPEED = 0x2207
+WRITABLE = (REG_COMMAND, REG_FREQUENCY, REG_FAULT_CONTROL)
+READABLE = WRITABLE + (REG_FAULT, REG_STATUS, REG_OUTPUT_FREQUENCY, REG_OUTPUT_VOLTAGE,
+                       REG_OUTPUT_TORQUE, REG_POWER, REG_SPEED)
+FAULT_EXTERNAL = 49       # EF
+FAULT_OVERLOAD = 21       # oL
+BAUD_RATES = {1200: termios.B1200, 2400: termios.B2400, 4800: termios.B4800, 9600: termios.B9600,
+              19200: termios.B19200, 38400: termios.B38400, 57600: termios.B57600, 115200: termios.B115200}
+
+
+def crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return struct.pack("<H", crc)
+
+
+class SerialLink:
+    """Serial settings of the first mb2hal transaction (the others inherit them)"""
+
+    def __init__(self, port="/dev/ttyUSB0", baud=9600, bits=8, parity="none", stop=2, delay_ms=10, slave=1):
+        self.port = port
+        self.baud = baud
+        self.bits = bits
+        self.parity = parity
+        self.stop = stop
+        self.delay_ms = delay_ms
+        self.slave = slave
+
+    @property
+    def char_seconds(self):
+        return (1 + self.bits + (0 if self.parity == "none" else 1) + self.stop) / float(self.baud)
+
+    def wire_seconds(self, nbytes):
+        return nbytes * self.char_seconds
+
+
+class Transaction:
+    def __init__(self, name, code, first, count, max_rate):
+        self.name = name
+        self.code = code
+        self.first = first
+        self.count = count
+        self.max_rate = max_rate
+        self.done = 0
+        self.errors = 0
+        self.last = None
+        self.periods = []
+
+
+def read_mb2hal(path=MB2HAL_INI):
+    """(SerialLink, [Transaction]) from an mb2hal ini file"""
+    ini = IniConfig(path, required=True)
+    total = ini.find_int("MB2HAL_INIT", "TOTAL_TRANSACTIONS", 0)
+    if total <= 0:
+        raise ValueError(f"no [MB2HAL_INIT] TOTAL_TRANSACTIONS in {path}")
+    link = None
+    transactions = []
+    for i in range(total):
+        section = f"TRANSACTION_{i:02d}"
+        if link is None or ini.find(section, "SERIAL_PORT"):
+            link = SerialLink(ini.find(section, "SERIAL_PORT", "/dev/ttyUSB0"),
+                              ini.find_int(section, "SERIAL_BAUD", 9600),
+                              ini.find_int(section, "SERIAL_BITS", 8),
+                              ini.find(section, "SERIAL_PARITY", "none"),
+                              ini.find_int(section, "SERIAL_STOP", 1),
+                              ini.find_float(section, "SERIAL_DELAY_MS", 0.0),
+                              ini.find_int(section, "MB_SLAVE_ID", 1))
+        transactions.append(Transaction(ini.find(section, "HAL_TX_NAME", section),
+                                        ini.find(section, "MB_TX_CODE", ""),
+                                        ini.find_int(section, "FIRST_ELEMENT", 0),
+                                        ini.find_int(section, "NELEMENTS", 1),
+                                        ini.find_float(section, "MAX_UPDATE_RATE", 0.0)))
+    return link, transactions
+
+
+class DriveModel:
+    def __init__(self, ini=None):
+        ini = ini or IniConfig()
+        self.max_frequency = ini.find_float("VFD_SIM", "MAX_FREQUENCY", 200.0)
+        self.accel = self.max_frequency / max(0.01, ini.find_float("VFD_SIM", "ACCEL", 2.0))
+        self.decel = self.max_frequency / max(0.01, ini.find_float("VFD_SIM", "DECEL", 2.0))
+        self.poles = ini.find_int("VFD_SIM", "POLES", 2)
+        self.rated_voltage = ini.find_float("VFD_SIM", "RATED_VOLTAGE", 220.0)
+        self.rated_power = ini.find_float("VFD_SIM", "RATED_POWER", 0.375)
+        self.response = ini.find_float("VFD_SIM", "RESPONSE_MS", 2.0) / 1000.0
+        self.fault_after = ini.find_float("VFD_SIM", "FAULT_AFTER", 0.0)
+        self.registers = dict.fromkeys(WRITABLE, 0)
+        self.frequency = 0.0        # Hz, signed by direction
+        self.fault = 0
+        self.running_since = None
+        self.torque = 0.0
+        self.last_update = time.monotonic()
+
+    def target(self):
+        command = self.registers[REG_COMMAND]
+        if self.fault or (command & 0x3) not in (0x2, 0x3):
+            return 0.0
+        reverse = ((command >> 4) & 0x3) == 0x2
+        target = min(self.registers[REG_FREQUENCY] / 100.0, self.max_frequency)
+        return -target if reverse else target
+
+    def update(self, now=None):
+        now = time.monotonic() if now is None else now
+        dt = max(0.0, now - self.last_update)
+        self.last_update = now
+        target = self.target()
+        step = (self.accel if abs(target) > abs(self.frequency) else self.decel) * dt
+        if self.fault:
+            step = self.decel * dt * 0.5      # free run: coasts slower than a ramp
+        if abs(target - self.frequency) <= step:
+            self.frequency = target
+            self.torque = 20.0 if target else 0.0
+        else:
+            self.frequency += step if target > self.frequency else -step
+            self.torque = 80.0 if abs(target) > abs(self.frequency) else -30.0
+        if target and not self.fault:
+            self.running_since = self.running_since or now
+            if self.fault_after and now - self.running_since >= self.fault_after:
+                self.fault = FAULT_OVERLOAD
+        else:
+            self.running_since = None
+
+    def write(self, address, value):
+        if address == REG_FAULT_CONTROL:
+            if value & 0x1:
+                self.fault = FAULT_EXTERNAL
+            if value & 0x2:
+                self.fault = 0
+                self.running_since = None
+        self.registers[address] = value & 0xFFFF
+
+    def status_word(self):
+        target = self.target()
+        if self.frequency == 0.0:
+            state = 0x2 if not self.fault and target else 0x0
+        elif abs(target) < abs(self.frequency) or self.fault:
+            state = 0x1
+        else:
+            state = 0x3
+        direction = 0x3 if self.frequency < 0 or (self.frequency == 0 and target < 0) else 0x0
+        return state | (direction << 3) | (1 << 8) | (1 << 10)
+
+    def read(self, address):
+        hz = abs(self.frequency)
+        if address in WRITABLE:
+            return self.registers[address]
+        if address == REG_FAULT:
+            return self.fault
+        if address == REG_STATUS:
+            return self.status_word()
+        if address == REG_OUTPUT_FREQUENCY:
+            return int(round(hz * 100))
+        if address == REG_OUTPUT_VOLTAGE:
+            return int(round(self.rated_voltage * min(1.0, hz / self.max_frequency) * 10))
+        if address == REG_OUTPUT_TORQUE:
+            return int(round(self.torque * 10)) & 0xFFFF
+        if address == REG_POWER:
+            return int(round(self.rated_power * abs(self.torque) / 100.0 * hz / self.max_frequency * 1000))
+        if address == REG_SPEED:
+            return int(round(hz * 120.0 / self.poles))
+        raise KeyError(address)
+
+
+def open_pty(link):
+    """(master fd, slave path) set up like the real port: raw, configured baud"""
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    attrs = termios.tcgetattr(slave)
+    speed = BAUD_RATES.get(link.baud, termios.B9600)
+    attrs[4] = attrs[5] = speed
+    termios.tcsetattr(slave, termios.TCSANOW, attrs)
+    path = os.ttyname(slave)
+    return master, slave, path
+
+
+class VfdServer:
+    """RTU slave on the pty master; responds with the wire timing of the link"""
+
+    def __init__(self, fd, link, drive):
+        self.fd = fd
+        self.link = link
+        self.drive = drive
+        self.requests = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.serve, name="vfd-sim", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving; returns once the thread no longer uses the fd"""
+        self.stopped = True
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def frame_length(self, buffer):
+        if len(buffer) < 2:
+            return None
+        if buffer[1] in (0x03, 0x06):
+            return 8
+        if buffer[1] == 0x10 and len(buffer) >= 7:
+            return 9 + buffer[6]
+        return None
+
+    def serve(self):
+        buffer = b""
+        gap = 3.5 * self.link.char_seconds
+        while not self.stopped:
+            ready, _, _ = select.select([self.fd], [], [], gap if buffer else 0.2)
+            if ready:
+                buffer += os.read(self.fd, 256)
+                length = self.frame_length(buffer)
+                if length is None or len(buffer) < length:
+                    continue
+                frame, buffer = buffer[:length], buffer[length:]
+            elif buffer:
+                frame, buffer = buffer, b""     # silence ends an unknown frame
+            else:
+                continue
+            received = time.monotonic()
+            response = self.handle(frame)
+            if response is None:
+                continue
+            # the request is on the wire before the drive sees it, then the answer goes back
+            due = (received + self.link.wire_seconds(len(frame)) + gap + self.drive.response
+                   + self.link.wire_seconds(len(response)))
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            os.write(self.fd, response)
+
+    def handle(self, frame):
+        if len(frame) < 4 or crc16(frame[:-2]) != frame[-2:]:
+            return None                        # a real slave stays silent on CRC errors
+        slave, function = frame[0], frame[1]
+        if slave != self.link.slave:
+            return None
+        self.requests += 1
+        self.drive.update()
+        try:
+            if function == 0x03:
+                address, count = struct.unpack(">HH", frame[2:6])
+                values = [self.drive.read(address + i) for i in range(count)]
+                body = struct.pack(">BBB", slave, function, 2 * count) + struct.pack(f">{count}H", *values)
+            elif function == 0x06:
+                address, value = struct.unpack(">HH", frame[2:6])
+                if address not in WRITABLE:
+                    raise KeyError(address)
+                self.drive.write(address, value)
+                body = frame[:6]
+            elif function == 0x10:
+                address, count = struct.unpack(">HH", frame[2:6])
+                values = struct.unpack(f">{count}H", frame[7:7 + 2 * count])
+                for i, value in enumerate(values):
+                    if address + i not in WRITABLE:
+                        raise KeyError(address + i)
+                for i, value in enumerate(values):
+                    self.drive.write(address + i, value)
+                body = frame[:6]
+            else:
+                body = struct.pack(">BBB", slave, function | 0x80, 0x01)
+        except KeyError:
+            body = struct.pack(">BBB", slave, function | 0x80, 0x02)
+        return body + crc16(body)
+
+
+class RtuClient:
+    """Minimal Modbus RTU master, enough for the mb2hal transaction types"""
+
+    def __init__(self, fd, link, timeout=0.5):
+        self.fd = fd
+        self.link = link
+        self.timeout = timeout
+
+    def _exchange(self, request, length):
+        request += crc16(request)
+        termios.tcflush(self.fd, termios.TCIFLUSH)
+        os.write(self.fd, request)
+        response = b""
+        deadline = time.monotonic() + self.timeout
+        while len(response) < length:
+            remaining = deadline - time.monotonic()
+            ready, _, _ = select.select([self.fd], [], [], max(0.0, remaining))
+            if not ready:
+                raise TimeoutError("no response")
+            response += os.read(self.fd, length - len(response))
+            if len(response) >= 5 and response[1] & 0x80:
+                raise ValueError(f"exception {response[2]}")
+        if crc16(response[:-2]) != response[-2:]:
+            raise ValueError("CRC error")
+        return response
+
+    def read_holding(self, address, count):
+        response = self._exchange(struct.pack(">BBHH", self.link.slave, 0x03, address, count), 5 + 2 * count)
+        return list(struct.unpack(f">{count}H", response[3:3 + 2 * count]))
+
+    def write_single(self, address, value):
+        self._exchange(struct.pack(">BBHH", self.link.slave, 0x06, address, value & 0xFFFF), 8)
+
+
+def bench(seconds=10.0, mb2hal_ini=MB2HAL_INI):
+    link, transactions = read_mb2hal(mb2hal_ini)
+    drive = DriveModel()
+    master, slave, path = open_pty(link)
+    server = VfdServer(master, link, drive).start()
+    client = RtuClient(slave, link)
+    print(f"VFDSIM: {len(transactions)} transactions at {link.baud} baud, "
+          f"delay {link.delay_ms:g} ms, on {path}")
+
+    command_at = 0.5                     # m3 s3000 after half a second
+    target_rpm = 3000
+    writes = {REG_COMMAND: 1, REG_FREQUENCY: 0, REG_FAULT_CONTROL: 0}
+    first_feedback = at_speed = None
+    start = time.monotonic()
+    try:
+        while time.monotonic() - start < seconds:
+            now = time.monotonic() - start
+            if now >= command_at and writes[REG_COMMAND] == 1:
+                writes[REG_COMMAND] = 18
+                writes[REG_FREQUENCY] = int(target_rpm * drive.poles / 120.0 * 100)
+            for tx in transactions:
+                t = time.monotonic()
+                if tx.max_rate > 0 and tx.last is not None and t - tx.last < 1.0 / tx.max_rate:
+                    continue
+                try:
+                    if tx.code == "fnct_06_write_single_register":
+                        client.write_single(tx.first, writes.get(tx.first, 0))
+                    elif tx.code == "fnct_03_read_holding_registers":
+                        values = client.read_holding(tx.first, tx.count)
+                        if tx.first == REG_SPEED and writes[REG_COMMAND] == 18:
+                            elapsed = time.monotonic() - start - command_at
+                            if first_feedback is None and values[0] > 0:
+                                first_feedback = elapsed
+                            if at_speed is None and abs(values[0] - target_rpm) <= 0.05 * target_rpm:
+                                at_speed = elapsed
+                    else:
+                        continue
+                    tx.done += 1
+                except (TimeoutError, ValueError) as e:
+                    tx.errors += 1
+                    print(f"VFDSIM: {tx.name}: {e}")
+                if tx.last is not None:
+                    tx.periods.append(t - tx.last)
+                tx.last = t
+                if link.delay_ms:
+                    time.sleep(link.delay_ms / 1000.0)
+    finally:
+        server.stop()
+        os.close(slave)
+        os.close(master)
+
+    elapsed = time.monotonic() - start
+    total = sum(tx.done for tx in transactions)
+    print(f"  {'transaction':24s} {'done':>6s} {'errors':>6s} {'rate/s':>8s} {'period ms':>10s}")
+    for tx in transactions:
+        period = sum(tx.periods) / len(tx.periods) * 1000 if tx.periods else 0.0
+        print(f"  {tx.name:24s} {tx.done:6d} {tx.errors:6d} {tx.done / elapsed:8.1f} {period:10.1f}")
+    print(f"VFDSIM: {total / elapsed:.1f} transactions/s, full cycle "
+          f"{elapsed / max(1, min(tx.done for tx in transactions)) * 1000:.0f} ms")
+    if first_feedback is not None:
+        print(f"VFDSIM: Speed feedback moved {first_feedback * 1000:.0f} ms after the run command")
+    if at_speed is not None:
+        print(f"VFDSIM: {target_rpm} rpm within 5% seen after {at_speed:.2f}s")
+    return total / elapsed
+
+
+def serve(mb2hal_ini=MB2HAL_INI):
+    link, _ = read_mb2hal(mb2hal_ini)
+    drive = DriveModel()
+    master, slave, path = open_pty(link)
+    server = VfdServer(master, link, drive).start()
+    sim_ini = os.path.join(os.path.dirname(os.path.abspath(mb2hal_ini)), "mb2hal_sim.ini")
+    with open(mb2hal_ini, "r") as f:
+        text = f.read().replace(f"SERIAL_PORT={link.port}", f"SERIAL_PORT={path}")
+    with open(sim_ini, "w") as f:
+        f.write(text)
+    print(f"VFDSIM: Serving slave {link.slave} on {path} ({link.baud} baud)")
+    print(f"VFDSIM: Run: loadusr -W mb2hal config={sim_ini}")
+    try:
+        while True:
+            time.sleep(5.0)
+            drive.update()
+            print(f"VFDSIM: {server.requests} requests, {abs(drive.frequency):.2f} Hz, "
+                  f"status {drive.status_word():#06x}, fault {drive.fault}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        os.close(slave)
+        os.close(master)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    try:
+        if command == "bench":
+            bench(float(sys.argv[2]) if len(sys.argv) > 2 else 10.0,
+                  sys.argv[3] if len(sys.argv) > 3 else MB2HAL_INI)
+        elif command == "serve":
+            serve(sys.argv[2] if len(sys.argv) > 2 else MB2HAL_INI)
+        else:
+            print(__doc__)
+            return 1
+    except (IndexError, ValueError, OSError) as e:
+        print(f"VFDSIM: Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())